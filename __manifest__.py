@@ -21,6 +21,11 @@
         "views/iot_location_views.xml",
         "views/iot_device_group_views.xml",
         "views/iot_message_views.xml",
+        "views/iot_device_telemetry_views.xml",
+        "views/iot_presence_event_views.xml",
+        "views/iot_device_state_views.xml",
+        "views/iot_device_command_views.xml",
+        "views/iot_leader_lease_views.xml",
         "views/iot_attendance_menu_views.xml",
         "views/iot_attendance_user_views.xml",
         "views/iot_attendance_punch_views.xml",
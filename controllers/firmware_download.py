@@ -9,7 +9,7 @@ class IoTFirmwareController(http.Controller):
         if not serial or not token:
             return request.not_found()
 
-        device = request.env["iot.device"].sudo().search([("serial", "=ilike", serial), ("auth_token", "=", token)], limit=1)
+        device = request.env["iot.device"].sudo().search([("serial_key", "=", serial.strip().lower()), ("auth_token", "=", token)], limit=1)
         if not device:
             return request.not_found()
 
@@ -27,7 +27,7 @@ const char* DEFAULT_FIRMWARE_UPGRADE_URL = "iot.imytest.com";
 const char* PROFILE_RELAY = "IoT-Relay";
 const char* PROFILE_OUTLET = "IoT-Outlet";
 
-const char* FIRMWARE_VERSION = "1.8.8";
+const char* FIRMWARE_VERSION = "1.8.9";
 
 const char* NTP_SERVER_1 = "pool.ntp.org";
 const char* NTP_SERVER_2 = "time.cloudflare.com";
@@ -84,6 +84,7 @@ bool otaPending = false;
 String otaUrlPending;
 String otaState = "idle";
 String otaNote;
+String pendingCommandCid;
 bool delayActive = false;
 unsigned long delayEndAtMs = 0;
 uint32_t delayDurationSec = 0;
@@ -426,10 +427,16 @@ void publishStatus() {
   doc["delay_active"] = active;
   doc["delay_duration_sec"] = delayDurationSec;
   doc["delay_remaining_sec"] = active ? delayRemainingSec() : 0;
+  if (pendingCommandCid.length() > 0) {
+    // Echo the correlation id of the last command once so the server can measure round-trip latency.
+    doc["cid"] = pendingCommandCid;
+  }
 
-  char out[320];
+  char out[384];
   size_t len = serializeJson(doc, out);
-  mqttClient.publish(topicStatus.c_str(), reinterpret_cast<const uint8_t*>(out), len, true);
+  if (mqttClient.publish(topicStatus.c_str(), reinterpret_cast<const uint8_t*>(out), len, true)) {
+    pendingCommandCid = "";
+  }
 }
 
 void otaProgress(int, int) {
@@ -702,6 +709,8 @@ void handleCommand(char* topic, byte* payload, unsigned int length) {
   }
 
   const char* command = doc["command"] | "";
+  const char* cid = doc["cid"] | "";
+  pendingCommandCid = String(cid).substring(0, 32);
 
   if (strcmp(command, "relay") == 0) {
     if (isDelayActive()) {
@@ -1,3 +1,5 @@
+mod spool;
+
 use std::net::SocketAddr;
 use std::collections::HashMap;
 use std::sync::Arc;
@@ -6,7 +8,7 @@ use std::time::Duration;
 use anyhow::Context;
 use axum::extract::{Path, State};
 use axum::http::{HeaderMap, StatusCode};
-use axum::routing::post;
+use axum::routing::{get, post};
 use axum::{Json, Router};
 use base64::Engine as _;
 use sha2::{Digest, Sha256};
@@ -21,11 +23,14 @@ use tokio::task::JoinSet;
 use tokio::sync::RwLock;
 use tracing::{error, info, warn};
 
+use crate::spool::{FsyncPolicy, Spool, SpoolConfig, SpoolRecord};
+
 #[derive(Clone)]
 struct AppState {
     mqtt_client: AsyncClient,
     mqtt_topic_root: String,
     openwrt_cache: Arc<RwLock<HashMap<String, CachedOpenwrtTelemetry>>>,
+    spool: Option<Arc<Spool>>,
 }
 
 #[derive(Clone)]
@@ -33,6 +38,7 @@ struct Forwarder {
     http: Client,
     odoo_base_url: String,
     token: String,
+    spool: Option<Arc<Spool>>,
 }
 
 #[derive(Debug, Deserialize)]
@@ -125,6 +131,7 @@ struct Config {
     odoo_base_url: String,
     middleware_token: String,
     openwrt_ssh_key_path: Option<String>,
+    spool: Option<SpoolConfig>,
 }
 
 impl Config {
@@ -144,6 +151,23 @@ impl Config {
         let odoo_base_url = env_or("IOT_BRIDGE_ODOO_BASE_URL", "http://127.0.0.1:8069");
         let middleware_token = env_or("IOT_BRIDGE_TOKEN", "imytest-middleware-token");
         let openwrt_ssh_key_path = env_opt("IOT_BRIDGE_OPENWRT_SSH_KEY_PATH");
+        let spool_dir = env_or("IOT_BRIDGE_SPOOL_DIR", "spool");
+        let spool = if spool_dir.trim().is_empty() {
+            None
+        } else {
+            let max_mb = env_or("IOT_BRIDGE_SPOOL_MAX_MB", "512")
+                .parse::<u64>()
+                .context("IOT_BRIDGE_SPOOL_MAX_MB must be a valid integer")?;
+            let segment_mb = env_or("IOT_BRIDGE_SPOOL_SEGMENT_MB", "16")
+                .parse::<u64>()
+                .context("IOT_BRIDGE_SPOOL_SEGMENT_MB must be a valid integer")?;
+            Some(SpoolConfig {
+                dir: spool_dir.into(),
+                segment_bytes: segment_mb.max(1) * 1024 * 1024,
+                max_bytes: max_mb.max(1) * 1024 * 1024,
+                fsync: FsyncPolicy::parse(&env_or("IOT_BRIDGE_SPOOL_FSYNC", "batch")),
+            })
+        };
 
         Ok(Self {
             api_listen,
@@ -157,6 +181,7 @@ impl Config {
             odoo_base_url,
             middleware_token,
             openwrt_ssh_key_path,
+            spool,
         })
     }
 }
@@ -256,19 +281,42 @@ async fn main() -> anyhow::Result<()> {
         mqtt_options.set_credentials(user, cfg.mqtt_password.as_deref().unwrap_or(""));
     }
 
+    let spool = match cfg.spool.clone() {
+        Some(spool_cfg) => {
+            let dir = spool_cfg.dir.display().to_string();
+            let spool = tokio::task::spawn_blocking(move || Spool::open(spool_cfg))
+                .await
+                .context("spool open task failed")?
+                .with_context(|| format!("open spool {dir}"))?;
+            let spool = Arc::new(spool);
+            info!("ingest spool at {} pending={}", dir, spool.pending());
+            Some(spool)
+        }
+        None => None,
+    };
+
     let (mqtt_client, event_loop) = AsyncClient::new(mqtt_options, 2000);
     let openwrt_cache = Arc::new(RwLock::new(HashMap::new()));
     let state = AppState {
         mqtt_client: mqtt_client.clone(),
         mqtt_topic_root: cfg.mqtt_topic_root.clone(),
         openwrt_cache: openwrt_cache.clone(),
+        spool: spool.clone(),
     };
     let forwarder = Arc::new(Forwarder {
         http: Client::builder().timeout(Duration::from_secs(8)).build()?,
         odoo_base_url: cfg.odoo_base_url.clone().trim_end_matches('/').to_string(),
         token: cfg.middleware_token.clone(),
+        spool,
     });
 
+    if forwarder.spool.is_some() {
+        let replay_forwarder = forwarder.clone();
+        tokio::spawn(async move {
+            run_spool_replay_loop(replay_forwarder).await;
+        });
+    }
+
     let mqtt_topic_root = cfg.mqtt_topic_root.clone();
     let mqtt_forwarder = forwarder.clone();
     let mqtt_subscriber_client = mqtt_client.clone();
@@ -299,6 +347,7 @@ async fn main() -> anyhow::Result<()> {
 
     let app = Router::new()
         .route("/healthz", post(healthz))
+        .route("/v1/spool/stats", get(spool_stats))
         .route("/v1/switch/:serial/command", post(switch_command))
         .route("/v1/openwrt/probe", post(openwrt_probe))
         .route("/v1/openwrt/cache_bulk", post(openwrt_cache_bulk))
@@ -326,6 +375,30 @@ async fn healthz() -> Json<ApiResponse> {
     })
 }
 
+async fn spool_stats(State(state): State<AppState>) -> Json<Value> {
+    let Some(spool) = state.spool.as_ref() else {
+        return Json(serde_json::json!({"enabled": false}));
+    };
+    match spool_blocking(spool, |spool| Ok(spool.stats())).await {
+        Ok(stats) => Json(serde_json::json!({"enabled": true, "stats": stats})),
+        Err(err) => Json(serde_json::json!({"enabled": true, "error": format!("{err:#}")})),
+    }
+}
+
+/// Run a spool call on the blocking pool: it does file I/O and fsyncs under a
+/// std mutex, which must not stall the async workers.
+async fn spool_blocking<T, F>(spool: &Arc<Spool>, func: F) -> anyhow::Result<T>
+where
+    F: FnOnce(&Spool) -> std::io::Result<T> + Send + 'static,
+    T: Send + 'static,
+{
+    let spool = spool.clone();
+    let result = tokio::task::spawn_blocking(move || func(&spool))
+        .await
+        .context("spool task failed")?;
+    Ok(result?)
+}
+
 async fn switch_command(
     State(state): State<AppState>,
     Path(serial): Path<String>,
@@ -573,6 +646,7 @@ async fn state_for_heartbeat_writeback(
             .trim_end_matches('/')
             .to_string(),
         token: env_or("IOT_BRIDGE_TOKEN", "imytest-middleware-token"),
+        spool: None,
     });
     forwarder
         .post_json(
@@ -915,10 +989,10 @@ async fn run_mqtt_loop(
                     "payload": payload,
                 });
                 if let Err(err) = forwarder
-                    .post_json("/iot_control_center/internal/mqtt_ingest", &body)
+                    .forward_ingest("/iot_control_center/internal/mqtt_ingest", body)
                     .await
                 {
-                    warn!("forward mqtt message failed: {err}");
+                    warn!("forward mqtt message failed: {err:#}");
                 }
             }
             Ok(_) => {}
@@ -984,9 +1058,12 @@ async fn process_mixed_buffer(
                         "source_ip": remote.ip().to_string(),
                         "source_port": remote.port(),
                     });
-                    let _ = forwarder
-                        .post_json("/iot_control_center/internal/th_ingest_json", &body)
-                        .await;
+                    if let Err(err) = forwarder
+                        .forward_ingest("/iot_control_center/internal/th_ingest_json", body)
+                        .await
+                    {
+                        warn!("forward th json frame failed: {err:#}");
+                    }
                 }
                 continue;
             }
@@ -1027,9 +1104,12 @@ async fn process_mixed_buffer(
             "source_ip": remote.ip().to_string(),
             "source_port": remote.port(),
         });
-        let _ = forwarder
-            .post_json("/iot_control_center/internal/th_ingest_binary", &body)
-            .await;
+        if let Err(err) = forwarder
+            .forward_ingest("/iot_control_center/internal/th_ingest_binary", body)
+            .await
+        {
+            warn!("forward th binary frame failed: {err:#}");
+        }
     }
 }
 
@@ -1146,7 +1226,116 @@ async fn run_openwrt_heartbeat_loop(
     }
 }
 
+async fn run_spool_replay_loop(forwarder: Arc<Forwarder>) {
+    loop {
+        if let Some(spool) = forwarder.spool.as_ref() {
+            if let Err(err) = spool_blocking(spool, |spool| spool.sync()).await {
+                warn!("spool fsync failed: {err:#}");
+            }
+        }
+        match forwarder.replay_spool(200).await {
+            // Keep draining while Odoo accepts records.
+            Ok(n) if n > 0 => continue,
+            Ok(_) => {}
+            Err(err) => warn!("spool replay paused: {err:#}"),
+        }
+        tokio::time::sleep(Duration::from_secs(2)).await;
+    }
+}
+
 impl Forwarder {
+    /// Forward an ingest payload, spooling it to disk when Odoo cannot take it.
+    ///
+    /// While anything is pending, new records go straight to the spool so replay
+    /// keeps them in arrival order.
+    async fn forward_ingest(&self, path: &str, body: Value) -> anyhow::Result<()> {
+        let Some(spool) = self.spool.as_ref() else {
+            return self.post_json(path, &body).await;
+        };
+        if spool.pending() == 0 {
+            match self.post_once(path, &body).await {
+                Ok(status) if status.is_success() => return Ok(()),
+                Ok(status) if is_permanent_rejection(status) => {
+                    return Err(anyhow::anyhow!("status {status}"));
+                }
+                Ok(status) => warn!("odoo ingest returned {status}; spooling"),
+                Err(err) => warn!("odoo ingest unreachable: {err:#}; spooling"),
+            }
+        }
+        let record = SpoolRecord::new(path, body);
+        if !spool_blocking(spool, move |spool| spool.append(&record))
+            .await
+            .context("spool append failed")?
+        {
+            return Err(anyhow::anyhow!("record larger than a spool segment, dropped"));
+        }
+        Ok(())
+    }
+
+    /// Replay spooled records in order; returns how many were consumed.
+    async fn replay_spool(&self, limit: usize) -> anyhow::Result<usize> {
+        let Some(spool) = self.spool.as_ref() else {
+            return Ok(0);
+        };
+        let Some(batch) = spool_blocking(spool, move |spool| spool.peek(limit)).await? else {
+            return Ok(0);
+        };
+        let seq = batch.seq;
+        let mut consumed = 0;
+        let mut delivered_to = None;
+        let mut outcome = Ok(());
+        for (next_offset, record) in batch.records {
+            if !record.path.is_empty() {
+                match self.post_once(&record.path, &record.body).await {
+                    Ok(status) if is_permanent_rejection(status) => {
+                        warn!("odoo rejected spooled record {} with {status}; dropping", record.path);
+                    }
+                    Ok(status) if !status.is_success() => {
+                        outcome = Err(anyhow::anyhow!("status {status}"));
+                        break;
+                    }
+                    Ok(_) => {}
+                    Err(err) => {
+                        outcome = Err(err);
+                        break;
+                    }
+                }
+            }
+            delivered_to = Some(next_offset);
+            consumed += 1;
+        }
+        // At-least-once: the cursor only moves past records Odoo answered and is
+        // persisted once for the whole batch.
+        if let Some(next_offset) = delivered_to {
+            let count = consumed as u64;
+            spool_blocking(spool, move |spool| spool.commit(seq, next_offset, count)).await?;
+            info!("spool replayed {} record(s), pending={}", consumed, spool.pending());
+        }
+        outcome.map(|()| consumed)
+    }
+
+    async fn post_once(&self, path: &str, body: &Value) -> anyhow::Result<reqwest::StatusCode> {
+        let url = format!("{}{}", self.odoo_base_url, path);
+        let mut headers = HeaderMap::new();
+        if !self.token.is_empty() {
+            headers.insert(
+                "X-IoT-Middleware-Token",
+                self.token
+                    .parse()
+                    .context("invalid middleware token header")?,
+            );
+        }
+        let resp = self
+            .http
+            .post(&url)
+            .headers(headers)
+            .json(body)
+            .send()
+            .await
+            .context("ingest request failed")?;
+        Ok(resp.status())
+    }
+
     async fn post_json(&self, path: &str, body: &Value) -> anyhow::Result<()> {
         let url = format!("{}{}", self.odoo_base_url, path);
         let mut headers = HeaderMap::new();
@@ -1209,6 +1398,13 @@ impl Forwarder {
     }
 }
 
+fn is_permanent_rejection(status: reqwest::StatusCode) -> bool {
+    // Auth and payload errors will not heal by retrying; timeouts and throttling will.
+    status.is_client_error()
+        && status != reqwest::StatusCode::REQUEST_TIMEOUT
+        && status != reqwest::StatusCode::TOO_MANY_REQUESTS
+}
+
 fn internal_err<E: std::fmt::Display>(err: E) -> (StatusCode, Json<ApiResponse>) {
     (
         StatusCode::INTERNAL_SERVER_ERROR,
@@ -0,0 +1,429 @@
+//! Append-only segment spool for ingest forwards that Odoo could not accept.
+//!
+//! Records are framed as `[len u32 LE][crc32 u32 LE][json]` and appended to
+//! numbered segment files. A cursor file remembers the replay position, consumed
+//! segments are deleted and total disk usage is capped. A torn tail left by a
+//! crash fails its crc and is truncated on startup.
+//!
+//! Every method except [`Spool::pending`] does blocking file I/O under a
+//! `std::sync::Mutex`; async callers run them on the blocking pool.
+
+use std::fs::{self, File, OpenOptions};
+use std::io::{self, BufReader, Read, Seek, SeekFrom, Write};
+use std::path::{Path, PathBuf};
+use std::sync::atomic::{AtomicU64, Ordering};
+use std::sync::Mutex;
+use std::time::{Duration, Instant, SystemTime, UNIX_EPOCH};
+
+use serde::{Deserialize, Serialize};
+use serde_json::Value;
+
+const SEGMENT_SUFFIX: &str = ".seg";
+const HEADER_LEN: u64 = 8;
+
+#[derive(Debug, Clone, Copy, PartialEq, Eq)]
+pub enum FsyncPolicy {
+    Always,
+    Batch,
+    Never,
+}
+
+impl FsyncPolicy {
+    pub fn parse(value: &str) -> Self {
+        match value.trim().to_ascii_lowercase().as_str() {
+            "always" => FsyncPolicy::Always,
+            "never" => FsyncPolicy::Never,
+            _ => FsyncPolicy::Batch,
+        }
+    }
+
+    fn as_str(&self) -> &'static str {
+        match self {
+            FsyncPolicy::Always => "always",
+            FsyncPolicy::Batch => "batch",
+            FsyncPolicy::Never => "never",
+        }
+    }
+}
+
+#[derive(Debug, Clone)]
+pub struct SpoolConfig {
+    pub dir: PathBuf,
+    pub segment_bytes: u64,
+    pub max_bytes: u64,
+    pub fsync: FsyncPolicy,
+}
+
+#[derive(Debug, Clone, Serialize, Deserialize)]
+pub struct SpoolRecord {
+    pub path: String,
+    pub body: Value,
+    pub spooled_at: u64,
+}
+
+impl SpoolRecord {
+    pub fn new(path: &str, body: Value) -> Self {
+        let spooled_at = SystemTime::now()
+            .duration_since(UNIX_EPOCH)
+            .map(|d| d.as_secs())
+            .unwrap_or(0);
+        Self {
+            path: path.to_string(),
+            body,
+            spooled_at,
+        }
+    }
+}
+
+#[derive(Debug, Default, Clone, Serialize)]
+pub struct SpoolStats {
+    pub appended: u64,
+    pub replayed: u64,
+    pub rejected: u64,
+    pub dropped_segments: u64,
+    pub dropped_records: u64,
+    pub fsyncs: u64,
+    pub pending: u64,
+    pub segments: u64,
+    pub disk_bytes: u64,
+    pub max_bytes: u64,
+    pub fsync_policy: String,
+}
+
+struct Inner {
+    active_seq: u64,
+    active: Option<File>,
+    active_len: u64,
+    cursor: (u64, u64),
+    last_sync: Instant,
+    stats: SpoolStats,
+}
+
+pub struct Spool {
+    cfg: SpoolConfig,
+    inner: Mutex<Inner>,
+    /// Unreplayed records. Only changed with `inner` locked, read without it so
+    /// async code never waits behind an fsync.
+    pending: AtomicU64,
+}
+
+/// Entries returned by [`Spool::peek`]: the offset after each record and the record.
+pub struct SpoolBatch {
+    pub seq: u64,
+    pub records: Vec<(u64, SpoolRecord)>,
+}
+
+fn crc32(data: &[u8]) -> u32 {
+    let mut crc = 0xFFFF_FFFF_u32;
+    for byte in data {
+        crc ^= *byte as u32;
+        for _ in 0..8 {
+            let mask = (crc & 1).wrapping_neg();
+            crc = (crc >> 1) ^ (0xEDB8_8320 & mask);
+        }
+    }
+    !crc
+}
+
+fn segment_path(dir: &Path, seq: u64) -> PathBuf {
+    dir.join(format!("{seq:020}{SEGMENT_SUFFIX}"))
+}
+
+fn list_segments(dir: &Path) -> io::Result<Vec<u64>> {
+    let mut out = Vec::new();
+    for entry in fs::read_dir(dir)? {
+        let name = entry?.file_name();
+        let name = name.to_string_lossy();
+        if let Some(stem) = name.strip_suffix(SEGMENT_SUFFIX) {
+            if let Ok(seq) = stem.parse::<u64>() {
+                out.push(seq);
+            }
+        }
+    }
+    out.sort_unstable();
+    Ok(out)
+}
+
+/// Read valid records starting at `offset`; stops at the end or at a torn record.
+fn read_records(path: &Path, offset: u64, limit: usize) -> io::Result<Vec<(u64, Vec<u8>)>> {
+    let file = match File::open(path) {
+        Ok(file) => file,
+        Err(err) if err.kind() == io::ErrorKind::NotFound => return Ok(Vec::new()),
+        Err(err) => return Err(err),
+    };
+    let size = file.metadata()?.len();
+    let mut reader = BufReader::new(file);
+    reader.seek(SeekFrom::Start(offset))?;
+    let mut pos = offset;
+    let mut out = Vec::new();
+    while out.len() < limit && pos + HEADER_LEN <= size {
+        let mut header = [0_u8; 8];
+        reader.read_exact(&mut header)?;
+        let len = u32::from_le_bytes([header[0], header[1], header[2], header[3]]) as u64;
+        let crc = u32::from_le_bytes([header[4], header[5], header[6], header[7]]);
+        if len == 0 || pos + HEADER_LEN + len > size {
+            break;
+        }
+        let mut payload = vec![0_u8; len as usize];
+        reader.read_exact(&mut payload)?;
+        if crc32(&payload) != crc {
+            break;
+        }
+        pos += HEADER_LEN + len;
+        out.push((pos, payload));
+    }
+    Ok(out)
+}
+
+fn count_records(path: &Path, offset: u64) -> io::Result<u64> {
+    Ok(read_records(path, offset, usize::MAX)?.len() as u64)
+}
+
+impl Spool {
+    pub fn open(cfg: SpoolConfig) -> io::Result<Self> {
+        fs::create_dir_all(&cfg.dir)?;
+        let segments = list_segments(&cfg.dir)?;
+        let mut cursor = read_cursor(&cfg.dir).unwrap_or((0, 0));
+        if let Some(first) = segments.first() {
+            if cursor.0 < *first {
+                cursor = (*first, 0);
+            }
+        }
+        let mut pending = 0;
+        for seq in &segments {
+            let offset = if *seq == cursor.0 { cursor.1 } else { 0 };
+            pending += count_records(&segment_path(&cfg.dir, *seq), offset)?;
+        }
+        let mut stats = SpoolStats {
+            max_bytes: cfg.max_bytes,
+            fsync_policy: cfg.fsync.as_str().to_string(),
+            ..SpoolStats::default()
+        };
+        stats.pending = pending;
+        let spool = Self {
+            inner: Mutex::new(Inner {
+                active_seq: 0,
+                active: None,
+                active_len: 0,
+                cursor,
+                last_sync: Instant::now(),
+                stats,
+            }),
+            pending: AtomicU64::new(pending),
+            cfg,
+        };
+        {
+            let mut inner = spool.inner.lock().unwrap();
+            let seq = segments.last().copied().unwrap_or(1);
+            spool.open_segment(&mut inner, seq, true)?;
+        }
+        Ok(spool)
+    }
+
+    fn open_segment(&self, inner: &mut Inner, seq: u64, recover: bool) -> io::Result<()> {
+        let path = segment_path(&self.cfg.dir, seq);
+        let file = OpenOptions::new().create(true).read(true).append(true).open(&path)?;
+        let mut len = file.metadata()?.len();
+        if recover && len > 0 {
+            let valid = read_records(&path, 0, usize::MAX)?
+                .last()
+                .map(|(end, _)| *end)
+                .unwrap_or(0);
+            if valid < len {
+                file.set_len(valid)?;
+                len = valid;
+            }
+        }
+        inner.active_seq = seq;
+        inner.active = Some(file);
+        inner.active_len = len;
+        Ok(())
+    }
+
+    fn roll(&self, inner: &mut Inner) -> io::Result<()> {
+        if let Some(file) = inner.active.take() {
+            if self.cfg.fsync != FsyncPolicy::Never {
+                file.sync_data()?;
+            }
+        }
+        let next = inner.active_seq + 1;
+        let max_segments = (self.cfg.max_bytes / self.cfg.segment_bytes.max(1)).max(2);
+        let mut segments = list_segments(&self.cfg.dir)?;
+        while segments.len() as u64 >= max_segments {
+            let oldest = segments.remove(0);
+            let path = segment_path(&self.cfg.dir, oldest);
+            let offset = if oldest == inner.cursor.0 { inner.cursor.1 } else { 0 };
+            let dropped = count_records(&path, offset)?;
+            fs::remove_file(&path)?;
+            self.sub_pending(dropped);
+            inner.stats.dropped_segments += 1;
+            inner.stats.dropped_records += dropped;
+            if inner.cursor.0 <= oldest {
+                let cursor = (segments.first().copied().unwrap_or(next), 0);
+                write_cursor(&self.cfg.dir, cursor, self.cfg.fsync)?;
+                inner.cursor = cursor;
+            }
+            tracing::error!(
+                "spool {} full, dropped oldest segment with {} record(s)",
+                self.cfg.dir.display(),
+                dropped
+            );
+        }
+        self.open_segment(inner, next, false)
+    }
+
+    pub fn append(&self, record: &SpoolRecord) -> io::Result<bool> {
+        let payload = serde_json::to_vec(record).map_err(io::Error::other)?;
+        let needed = HEADER_LEN + payload.len() as u64;
+        let mut inner = self.inner.lock().unwrap();
+        if needed > self.cfg.segment_bytes {
+            inner.stats.rejected += 1;
+            return Ok(false);
+        }
+        if inner.active.is_none() || inner.active_len + needed > self.cfg.segment_bytes {
+            self.roll(&mut inner)?;
+        }
+        let mut frame = Vec::with_capacity(needed as usize);
+        frame.extend_from_slice(&(payload.len() as u32).to_le_bytes());
+        frame.extend_from_slice(&crc32(&payload).to_le_bytes());
+        frame.extend_from_slice(&payload);
+        let sync = match self.cfg.fsync {
+            FsyncPolicy::Always => true,
+            FsyncPolicy::Batch => inner.last_sync.elapsed() >= Duration::from_secs(1),
+            FsyncPolicy::Never => false,
+        };
+        {
+            let file = inner.active.as_mut().expect("active spool segment");
+            file.write_all(&frame)?;
+            if sync {
+                file.sync_data()?;
+            }
+        }
+        if sync {
+            inner.last_sync = Instant::now();
+            inner.stats.fsyncs += 1;
+        }
+        inner.active_len += needed;
+        self.pending.fetch_add(1, Ordering::Relaxed);
+        inner.stats.appended += 1;
+        Ok(true)
+    }
+
+    /// Flush appends still buffered under the `batch` policy.
+    pub fn sync(&self) -> io::Result<()> {
+        let mut inner = self.inner.lock().unwrap();
+        if self.cfg.fsync != FsyncPolicy::Batch {
+            return Ok(());
+        }
+        if let Some(file) = inner.active.as_ref() {
+            file.sync_data()?;
+        }
+        inner.last_sync = Instant::now();
+        inner.stats.fsyncs += 1;
+        Ok(())
+    }
+
+    pub fn pending(&self) -> u64 {
+        self.pending.load(Ordering::Relaxed)
+    }
+
+    fn sub_pending(&self, count: u64) {
+        // Writers hold `inner`, so load and store cannot interleave.
+        let left = self.pending.load(Ordering::Relaxed).saturating_sub(count);
+        self.pending.store(left, Ordering::Relaxed);
+    }
+
+    /// Oldest unreplayed records, at most `limit`. Consumed sealed segments are removed.
+    pub fn peek(&self, limit: usize) -> io::Result<Option<SpoolBatch>> {
+        let mut inner = self.inner.lock().unwrap();
+        loop {
+            if self.pending() == 0 {
+                return Ok(None);
+            }
+            let segments = list_segments(&self.cfg.dir)?;
+            let Some(first) = segments.first().copied() else {
+                self.pending.store(0, Ordering::Relaxed);
+                return Ok(None);
+            };
+            let (mut seq, mut offset) = inner.cursor;
+            if !segments.contains(&seq) {
+                seq = first;
+                offset = 0;
+            }
+            let raw = read_records(&segment_path(&self.cfg.dir, seq), offset, limit)?;
+            if !raw.is_empty() {
+                let mut records = Vec::with_capacity(raw.len());
+                for (end, payload) in raw {
+                    match serde_json::from_slice::<SpoolRecord>(&payload) {
+                        Ok(record) => records.push((end, record)),
+                        Err(err) => {
+                            tracing::warn!("spool skipped undecodable record: {err}");
+                            records.push((
+                                end,
+                                SpoolRecord::new("", Value::Null),
+                            ));
+                        }
+                    }
+                }
+                return Ok(Some(SpoolBatch { seq, records }));
+            }
+            if seq >= inner.active_seq {
+                // Caught up with the writer.
+                return Ok(None);
+            }
+            fs::remove_file(segment_path(&self.cfg.dir, seq))?;
+            let next = segments.into_iter().find(|s| *s > seq).unwrap_or(seq + 1);
+            write_cursor(&self.cfg.dir, (next, 0), self.cfg.fsync)?;
+            inner.cursor = (next, 0);
+        }
+    }
+
+    /// Advance the cursor past `count` delivered (or rejected) records of a
+    /// [`SpoolBatch`], ending at `next_offset`.
+    ///
+    /// The cursor file is written once per call, so a crash replays at most the
+    /// records of one batch again.
+    pub fn commit(&self, seq: u64, next_offset: u64, count: u64) -> io::Result<()> {
+        let mut inner = self.inner.lock().unwrap();
+        write_cursor(&self.cfg.dir, (seq, next_offset), self.cfg.fsync)?;
+        inner.cursor = (seq, next_offset);
+        self.sub_pending(count);
+        inner.stats.replayed += count;
+        Ok(())
+    }
+
+    pub fn stats(&self) -> SpoolStats {
+        let inner = self.inner.lock().unwrap();
+        let mut stats = inner.stats.clone();
+        stats.pending = self.pending();
+        if let Ok(segments) = list_segments(&self.cfg.dir) {
+            stats.segments = segments.len() as u64;
+            stats.disk_bytes = segments
+                .iter()
+                .filter_map(|seq| fs::metadata(segment_path(&self.cfg.dir, *seq)).ok())
+                .map(|meta| meta.len())
+                .sum();
+        }
+        stats
+    }
+}
+
+fn read_cursor(dir: &Path) -> Option<(u64, u64)> {
+    let raw = fs::read_to_string(dir.join("cursor")).ok()?;
+    let mut parts = raw.split_whitespace();
+    let seq = parts.next()?.parse().ok()?;
+    let offset = parts.next()?.parse().ok()?;
+    Some((seq, offset))
+}
+
+fn write_cursor(dir: &Path, cursor: (u64, u64), fsync: FsyncPolicy) -> io::Result<()> {
+    let tmp = dir.join("cursor.tmp");
+    {
+        let mut file = File::create(&tmp)?;
+        file.write_all(format!("{} {}\n", cursor.0, cursor.1).as_bytes())?;
+        if fsync != FsyncPolicy::Never {
+            file.sync_data()?;
+        }
+    }
+    fs::rename(tmp, dir.join("cursor"))
+}
@@ -1,7 +1,11 @@
 from . import iot_department
 from . import iot_location
+from . import iot_presence
 from . import iot_device_group
+from . import iot_device_runtime
 from . import iot_device
+from . import iot_device_state_interval
+from . import iot_device_command
 from . import iot_attendance_device
 from . import iot_attendance_user
 from . import iot_attendance_punch
@@ -11,6 +15,8 @@ from . import iot_schedule
 from . import iot_firmware
 from . import iot_firmware_upgrade_log
 from . import iot_mqtt_message
+from . import iot_device_telemetry
+from . import iot_leader_lease
 from . import iot_control_board
 from . import th_gateway
 from . import th_sensor_group
@@ -85,7 +85,7 @@ class IoTControlBoard(models.Model):
                 rec.metric_1_label = "Devices"
                 rec.metric_1_value = Device.search_count([("company_id", "!=", False)])
                 rec.metric_2_label = "Online"
-                rec.metric_2_value = Device.search_count([("company_id", "!=", False), ("last_seen", "!=", False)])
+                rec.metric_2_value = Device.search_count([("company_id", "!=", False), ("presence_state", "=", "online")])
             elif rec.key == "th":
                 rec.metric_1_label = "Sensors"
                 rec.metric_1_value = Sensor.search_count([("company_id", "!=", False)])
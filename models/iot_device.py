@@ -1,19 +1,21 @@
 import json
 import logging
+import math
 import time
 import uuid
 from urllib import error as urlerror
 from urllib import parse as urlparse
 from urllib import request as urlrequest
-from datetime import datetime
 from datetime import timedelta
 
 import psycopg2
-import pytz
 from odoo import _, api, fields, models
 from odoo.exceptions import UserError
 
-from ..services.mqtt_service import ensure_running, publish_once
+from ..services.leader_election import exclusive_job
+from ..services.message_listener import ensure_running as ensure_message_listener
+from ..services.mqtt_service import ensure_running, publish_many, shared_subscription_enabled
+from ..services.rate_limiter import get_bucket
 
 _logger = logging.getLogger(__name__)
 
@@ -21,11 +23,14 @@ _logger = logging.getLogger(__name__)
 class IoTDevice(models.Model):
     _name = "iot.device"
     _description = "IoT Relay Device"
-    _inherit = ["mail.thread"]
+    _inherit = ["mail.thread", "iot.presence.mixin"]
+    _inherits = {"iot.device.runtime": "runtime_id"}
 
     name = fields.Char(required=True, tracking=True)
     serial = fields.Char(required=True, tracking=True)
     module_id = fields.Char(tracking=True, index=True)
+    serial_key = fields.Char(compute="_compute_device_keys", store=True, readonly=True)
+    module_key = fields.Char(compute="_compute_device_keys", store=True, readonly=True)
     switch_id_display = fields.Char(compute="_compute_switch_id_display", store=False)
     active = fields.Boolean(default=True)
 
@@ -39,14 +44,16 @@ class IoTDevice(models.Model):
     location_detail = fields.Char(string="Location Detail", tracking=True, translate=True)
     group_ids = fields.Many2many("iot.device.group", "iot_device_group_rel", "device_id", "group_id", string="Groups")
 
-    relay_state = fields.Selection(
-        [("unknown", "Unknown"), ("off", "Off"), ("on", "On")],
-        default="unknown",
+    # Relay state, last_seen, uptime, delay and command/sync timestamps live on
+    # the runtime sidecar row and are delegated through _inherits.
+    runtime_id = fields.Many2one(
+        "iot.device.runtime",
         required=True,
-        tracking=True,
+        ondelete="restrict",
+        auto_join=True,
+        index=True,
+        copy=False,
     )
-    last_seen = fields.Datetime(tracking=True)
-    online = fields.Boolean(compute="_compute_online", store=False)
 
     firmware_version = fields.Char(tracking=True)
     firmware_target_version = fields.Char(tracking=True)
@@ -59,23 +66,17 @@ class IoTDevice(models.Model):
     )
     auth_token = fields.Char(required=True, default=lambda self: uuid.uuid4().hex)
 
-    on_since = fields.Datetime()
-    total_on_minutes = fields.Integer(default=0, tracking=True)
     total_on_hours = fields.Float(compute="_compute_total_on_hours", digits=(16, 2), store=False)
     delay_duration_minutes = fields.Integer(default=30, tracking=True)
-    delay_active = fields.Boolean(default=False, tracking=True)
-    delay_started_at = fields.Datetime(tracking=True)
-    delay_end_at = fields.Datetime(tracking=True)
     delay_remaining_minutes = fields.Float(compute="_compute_delay_remaining_minutes", digits=(16, 2), store=False)
     manual_override = fields.Boolean(default=False, tracking=True)
 
-    last_command_at = fields.Datetime()
-    last_command_payload = fields.Text()
+    ack_latency_p50_ms = fields.Integer(string="Ack Latency p50 (ms)", compute="_compute_ack_latency")
+    ack_latency_p95_ms = fields.Integer(string="Ack Latency p95 (ms)", compute="_compute_ack_latency")
+    ack_latency_p99_ms = fields.Integer(string="Ack Latency p99 (ms)", compute="_compute_ack_latency")
     schedule_dirty = fields.Boolean(default=True, tracking=True)
     schedule_version = fields.Integer(default=0, tracking=True)
-    schedule_applied_version = fields.Integer(default=0, tracking=True)
-    schedule_last_push_at = fields.Datetime(tracking=True)
-    schedule_last_sync_at = fields.Datetime(tracking=True)
+    schedule_hash = fields.Char(readonly=True, copy=False, help="Content hash of the schedule entries last pushed to the switch.")
     schedule_sync_state = fields.Selection(
         [("pending", "Pending"), ("in_sync", "In Sync"), ("outdated", "Outdated")],
         compute="_compute_schedule_sync_state",
@@ -88,11 +89,188 @@ class IoTDevice(models.Model):
         ("iot_device_serial_uniq", "unique(serial)", "Serial must be unique."),
     ]
 
+    @api.model
+    def init(self):
+        self._attach_runtime_rows()
+        # Backfill before the unique indexes; the ORM recompute of an upgraded
+        # column lands later than init.
+        self.env.cr.execute(
+            """
+            UPDATE iot_device
+            SET serial_key = NULLIF(lower(btrim(serial, E' \\t\\r\\n')), ''),
+                module_key = NULLIF(lower(btrim(module_id, E' \\t\\r\\n')), '')
+            WHERE serial_key IS DISTINCT FROM NULLIF(lower(btrim(serial, E' \\t\\r\\n')), '')
+               OR module_key IS DISTINCT FROM NULLIF(lower(btrim(module_id, E' \\t\\r\\n')), '')
+            """
+        )
+        self._dedupe_device_keys()
+        self.env.cr.execute(
+            """
+            CREATE UNIQUE INDEX IF NOT EXISTS iot_device_serial_key_uniq
+            ON iot_device (serial_key)
+            WHERE serial_key IS NOT NULL
+            """
+        )
+        self.env.cr.execute(
+            """
+            CREATE UNIQUE INDEX IF NOT EXISTS iot_device_module_key_uniq
+            ON iot_device (module_key)
+            WHERE module_key IS NOT NULL
+            """
+        )
+        super().init()
+
+    @api.model
+    def _attach_runtime_rows(self):
+        """Give every device without one a runtime row, in one statement.
+
+        On upgrade the runtime values are copied from the former iot_device
+        columns, which the ORM leaves in place but no longer reads.
+        """
+        cr = self.env.cr
+        runtime_model = self.env["iot.device.runtime"]
+        names = [name for name, field in runtime_model._fields.items() if field.store and name != "id"]
+        cr.execute(
+            """
+            SELECT table_name, column_name, data_type
+            FROM information_schema.columns
+            WHERE table_name IN ('iot_device', 'iot_device_runtime') AND column_name = ANY(%s)
+            """,
+            [names],
+        )
+        legacy = set()
+        types = {}
+        for table, column, data_type in cr.fetchall():
+            if table == "iot_device":
+                legacy.add(column)
+            else:
+                types[column] = data_type
+        defaults = {"relay_state": "'unknown'", "total_on_minutes": "0", "delay_active": "false", "schedule_applied_version": "0"}
+        columns = []
+        for name in names:
+            default = f"{defaults.get(name, 'NULL')}::{types[name]}"
+            value = f"COALESCE(d.{name}, {default})" if name in legacy else default
+            columns.append(f"{value} AS {name}")
+        select_sql = ", ".join(columns)
+        cr.execute(
+            f"""
+            WITH src AS (
+                SELECT d.id AS device_id, nextval('iot_device_runtime_id_seq') AS runtime_id, {select_sql}
+                FROM iot_device d
+                WHERE d.runtime_id IS NULL
+            ), created AS (
+                INSERT INTO iot_device_runtime (id, {", ".join(names)})
+                SELECT runtime_id, {", ".join(names)} FROM src
+            )
+            UPDATE iot_device d
+            SET runtime_id = src.runtime_id
+            FROM src
+            WHERE d.id = src.device_id
+            """
+        )
+        cr.execute("ALTER TABLE iot_device ALTER COLUMN runtime_id SET NOT NULL")
+        cr.execute(
+            "CREATE UNIQUE INDEX IF NOT EXISTS iot_device_runtime_id_uniq ON iot_device (runtime_id)"
+        )
+
+    @api.model
+    def _runtime_fields(self):
+        return {name for name, field in self._fields.items() if field.inherited}
+
+    @api.model
+    def _presence_source_sql(self):
+        return "iot_device JOIN iot_device_runtime rt ON rt.id = iot_device.runtime_id", "rt.last_seen"
+
+    @api.model
+    def _normalize_key(self, value):
+        return (value or "").strip().lower()
+
+    @api.depends("serial", "module_id")
+    def _compute_device_keys(self):
+        for rec in self:
+            rec.serial_key = self._normalize_key(rec.serial) or False
+            rec.module_key = self._normalize_key(rec.module_id) or False
+
+    @api.model
+    def _upsert_by_key(self, key):
+        """Resolve a topic key to a device, creating a bare device when unknown.
+
+        A serial match wins over a module_id match. Creation is a single
+        ``INSERT ... ON CONFLICT DO NOTHING`` on the unique serial key, so
+        concurrent workers converge on one row without locks.
+        """
+        key = self._normalize_key(key)
+        if not key:
+            return self.browse()
+        cr = self.env.cr
+        cr.execute(
+            """
+            SELECT id
+            FROM iot_device
+            WHERE serial_key = %s OR module_key = %s
+            ORDER BY serial_key = %s DESC NULLS LAST
+            LIMIT 1
+            """,
+            [key, key, key],
+        )
+        row = cr.fetchone()
+        if row:
+            return self.browse(row[0])
+        # The runtime id is only reserved up front; its row is inserted for the
+        # device row that actually got created, so a lost race leaves no orphan.
+        # The foreign key is checked at the end of the statement.
+        cr.execute(
+            """
+            WITH device AS (
+                INSERT INTO iot_device (
+                    name, serial, serial_key, auth_token, active, runtime_id, firmware_upgrade_state,
+                    delay_duration_minutes, manual_override, schedule_dirty, schedule_version, presence_state,
+                    create_uid, create_date, write_uid, write_date
+                )
+                VALUES (
+                    %s, %s, %s, %s, true, nextval('iot_device_runtime_id_seq'), 'none',
+                    30, false, true, 0, 'unknown',
+                    %s, now() AT TIME ZONE 'UTC', %s, now() AT TIME ZONE 'UTC'
+                )
+                ON CONFLICT (serial_key) WHERE serial_key IS NOT NULL DO NOTHING
+                RETURNING id, runtime_id
+            ), runtime AS (
+                INSERT INTO iot_device_runtime (id, relay_state, total_on_minutes, delay_active, schedule_applied_version)
+                SELECT runtime_id, 'unknown', 0, false, 0
+                FROM device
+            )
+            SELECT id FROM device
+            """,
+            [key, key, key, uuid.uuid4().hex, self.env.uid, self.env.uid],
+        )
+        row = cr.fetchone()
+        if not row:
+            # Another transaction created it first.
+            cr.execute("SELECT id FROM iot_device WHERE serial_key = %s", [key])
+            row = cr.fetchone()
+        return self.browse(row[0]) if row else self.browse()
+
+    def _release_module_key(self, module_id):
+        """Detach ``module_id`` from other devices before this one claims it.
+
+        A module moved to another serial keeps reporting its id; the latest
+        reporter wins, as the former dedupe cron decided.
+        """
+        self.ensure_one()
+        key = self._normalize_key(module_id)
+        if not key:
+            return
+        others = self.with_context(active_test=False).search([("module_key", "=", key), ("id", "!=", self.id)])
+        if others:
+            others.with_context(**self._system_no_track_context()).write({"module_id": False})
+
     @api.model
     def _runtime_no_track_fields(self):
         return {
             "relay_state",
             "last_seen",
+            "presence_state",
+            "presence_changed_at",
             "firmware_version",
             "firmware_target_version",
             "firmware_upgrade_requested_at",
@@ -109,6 +287,7 @@ class IoTDevice(models.Model):
             "last_command_payload",
             "schedule_dirty",
             "schedule_version",
+            "schedule_hash",
             "schedule_applied_version",
             "schedule_last_push_at",
             "schedule_last_sync_at",
@@ -136,13 +315,6 @@ class IoTDevice(models.Model):
                 time.sleep(sleep_sec * (attempt + 1))
         return None
 
-    @api.depends("last_seen")
-    def _compute_online(self):
-        timeout = int(self.env["ir.config_parameter"].sudo().get_param("iot_control_center.online_timeout_sec", 300))
-        now = fields.Datetime.now()
-        for rec in self:
-            rec.online = bool(rec.last_seen and (now - rec.last_seen) <= timedelta(seconds=timeout))
-
     @api.depends("total_on_minutes", "relay_state", "on_since")
     def _compute_total_on_hours(self):
         now = fields.Datetime.now()
@@ -164,6 +336,17 @@ class IoTDevice(models.Model):
             else:
                 rec.schedule_sync_state = "outdated"
 
+    def _compute_ack_latency(self):
+        stats = {}
+        if self.ids:
+            rows = self.env["iot.device.command"].sudo().get_ack_latency_stats("device", device_ids=self.ids)
+            stats = {row["key"]: row for row in rows}
+        for rec in self:
+            row = stats.get(rec.id, {})
+            rec.ack_latency_p50_ms = row.get("p50_ms", 0)
+            rec.ack_latency_p95_ms = row.get("p95_ms", 0)
+            rec.ack_latency_p99_ms = row.get("p99_ms", 0)
+
     @api.depends("module_id", "serial")
     def _compute_switch_id_display(self):
         for rec in self:
@@ -179,14 +362,15 @@ class IoTDevice(models.Model):
             remaining = (rec.delay_end_at - now).total_seconds()
             rec.delay_remaining_minutes = round(max(remaining, 0.0) / 60.0, 2)
 
-    def _accumulate_on_minutes_until(self, until_dt):
+    def _close_on_interval(self, until_dt):
+        """Book the open on interval up to ``until_dt`` in the ledger; the relay stays on from there."""
+        intervals = []
         for rec in self:
             if rec.relay_state == "on" and rec.on_since and until_dt > rec.on_since:
-                diff = until_dt - rec.on_since
-                delta_min = int(diff.total_seconds() // 60)
-                if delta_min > 0:
-                    rec.total_on_minutes += delta_min
-                    rec.on_since = rec.on_since + timedelta(minutes=delta_min)
+                intervals.append((rec.id, rec.on_since, until_dt))
+                delta_min = int((until_dt - rec.on_since).total_seconds() // 60)
+                rec.write({"total_on_minutes": rec.total_on_minutes + delta_min, "on_since": until_dt})
+        self.env["iot.device.state.interval"].sudo()._record_intervals(intervals)
 
     def _mqtt_topic_root(self):
         return self.env["ir.config_parameter"].sudo().get_param("iot_control_center.mqtt_topic_root", "iot/relay")
@@ -201,17 +385,14 @@ class IoTDevice(models.Model):
         if not key:
             raise UserError(_("Switch ID/Serial is required."))
         rec = self.sudo().search(
-            ["|", ("serial", "=ilike", key), ("module_id", "=ilike", key)],
+            ["|", ("serial_key", "=", key.lower()), ("module_key", "=", key.lower())],
             order="last_seen desc, id desc",
             limit=1,
         )
         if not rec:
             raise UserError(_("No switch found for ID: %s") % key)
-        if require_online:
-            timeout = int(self.env["ir.config_parameter"].sudo().get_param("iot_control_center.online_timeout_sec", 300))
-            now = fields.Datetime.now()
-            if not rec.last_seen or (now - rec.last_seen) > timedelta(seconds=timeout):
-                raise UserError(_("Switch %s is offline. Please power it on first.") % (rec.module_id or rec.serial))
+        if require_online and rec.presence_state != "online":
+            raise UserError(_("Switch %s is offline. Please power it on first.") % (rec.module_id or rec.serial))
         return rec.with_env(self.env)
 
     @api.model
@@ -244,7 +425,7 @@ class IoTDevice(models.Model):
                     "schedule_dirty": True,
                 }
             )
-            rec._force_schedule_clear()
+        self._force_schedule_clear()
 
     def _delay_locked_devices(self):
         now = fields.Datetime.now()
@@ -257,36 +438,53 @@ class IoTDevice(models.Model):
             raise UserError(_("Delay mode is active. This action is blocked for: %s") % names)
 
     def _publish_command(self, command, payload=None, raise_on_fail=True, retain=False, return_details=False):
+        payload = payload or {}
+        return self._publish_commands(
+            [(rec, command, payload) for rec in self],
+            raise_on_fail=raise_on_fail,
+            retain=retain,
+            return_details=return_details,
+        )
+
+    @api.model
+    def _publish_commands(self, entries, raise_on_fail=True, retain=False, return_details=False, write_metadata=True):
+        """Publish ``(device, command, payload)`` entries in one pipelined batch.
+
+        With ``return_details`` returns ``(all_ok, results)`` where ``results``
+        holds one boolean per entry, aligned with ``entries``.
+        """
         icp = self.env["ir.config_parameter"].sudo()
         middleware_enabled = str(icp.get_param("iot_control_center.middleware_enabled", "False")).lower() in ("1", "true", "yes")
+        command_model = self.env["iot.device.command"]
+        # Every command carries a correlation id the firmware echoes back in its status.
+        stamped = []
+        for rec, command, payload in entries:
+            payload = dict(payload or {})
+            payload.setdefault("cid", command_model._new_correlation_id())
+            stamped.append((rec, command, payload))
+        entries = stamped
+        sent_ts = time.time()
         if middleware_enabled:
-            return self._publish_command_via_middleware(
-                command,
-                payload=payload,
-                raise_on_fail=raise_on_fail,
-                retain=retain,
-                return_details=return_details,
-            )
-
-        mqtt_host = self.env["ir.config_parameter"].sudo().get_param("iot_control_center.mqtt_host")
-        if not mqtt_host or str(mqtt_host).strip().lower() in ("false", ""):
-            if raise_on_fail:
-                raise UserError(_("MQTT is not configured. Please set broker settings first."))
-            return False
-        payload = payload or {}
+            results = self._publish_entries_via_middleware(entries, raise_on_fail=raise_on_fail, retain=retain)
+        else:
+            results = self._publish_entries_via_mqtt(entries, raise_on_fail=raise_on_fail, retain=retain)
+        if results is False:
+            return (False, [False] * len(entries)) if return_details else False
+        if write_metadata:
+            # Outbox rows track their own acks; direct publishes get a sent row here.
+            command_model._log_direct_publish(entries, results, sent_ts)
+
+        results = [bool(ok) for ok in results]
         all_ok = True
-        succeeded = self.browse()
-        for rec in self:
-            command_id = rec._command_identity()
-            topic = f"{self._mqtt_topic_root()}/{command_id}/command"
-            body = {"command": command, **payload}
-            ok = publish_once(self.env, topic, json.dumps(body, separators=(",", ":")), retain=retain)
+        for (rec, command, payload), ok in zip(entries, results):
             if not ok:
                 all_ok = False
                 if raise_on_fail:
                     raise UserError(_("Failed to publish MQTT command for %s") % rec.display_name)
                 continue
-            succeeded |= rec
+            if not write_metadata:
+                continue
+            body = {"command": command, **(payload or {})}
             # Metadata write should never block command success.
             # Under concurrent MQTT/status updates, this row can be hot.
             try:
@@ -301,10 +499,26 @@ class IoTDevice(models.Model):
             except Exception as exc:
                 _logger.warning("Skip command metadata write for %s due to contention: %s", rec.display_name, exc)
         if return_details:
-            return all_ok, succeeded
+            return all_ok, results
         return all_ok
 
-    def _publish_command_via_middleware(self, command, payload=None, raise_on_fail=True, retain=False, return_details=False):
+    @api.model
+    def _publish_entries_via_mqtt(self, entries, raise_on_fail=True, retain=False):
+        mqtt_host = self.env["ir.config_parameter"].sudo().get_param("iot_control_center.mqtt_host")
+        if not mqtt_host or str(mqtt_host).strip().lower() in ("false", ""):
+            if raise_on_fail:
+                raise UserError(_("MQTT is not configured. Please set broker settings first."))
+            return False
+        topic_root = self._mqtt_topic_root()
+        messages = []
+        for rec, command, payload in entries:
+            topic = f"{topic_root}/{rec._command_identity()}/command"
+            body = {"command": command, **(payload or {})}
+            messages.append((topic, json.dumps(body, separators=(",", ":")), retain))
+        return publish_many(self.env, messages)
+
+    @api.model
+    def _publish_entries_via_middleware(self, entries, raise_on_fail=True, retain=False):
         icp = self.env["ir.config_parameter"].sudo()
         base_url = (icp.get_param("iot_control_center.middleware_base_url") or "").strip().rstrip("/")
         token = (icp.get_param("iot_control_center.middleware_token") or "").strip()
@@ -312,17 +526,15 @@ class IoTDevice(models.Model):
             if raise_on_fail:
                 raise UserError(_("Middleware is enabled but Middleware Base URL is empty."))
             return False
-        payload = payload or {}
         headers = {"Content-Type": "application/json"}
         if token:
             headers["X-IoT-Middleware-Token"] = token
 
-        all_ok = True
-        succeeded = self.browse()
-        for rec in self:
+        results = []
+        for rec, command, payload in entries:
             command_id = rec._command_identity()
             endpoint = f"{base_url}/v1/switch/{urlparse.quote(command_id, safe='')}/command"
-            body = {"command": command, "payload": payload, "retain": bool(retain)}
+            body = {"command": command, "payload": payload or {}, "retain": bool(retain)}
             req = urlrequest.Request(
                 endpoint,
                 data=json.dumps(body, separators=(",", ":")).encode("utf-8"),
@@ -338,29 +550,12 @@ class IoTDevice(models.Model):
             except (urlerror.URLError, urlerror.HTTPError, TimeoutError) as exc:
                 _logger.warning("Middleware command publish failed for %s via %s: %s", rec.serial, endpoint, exc)
                 ok = False
-
-            if not ok:
-                all_ok = False
-                if raise_on_fail:
-                    raise UserError(_("Failed to publish MQTT command for %s") % rec.display_name)
-                continue
-            succeeded |= rec
-
-            try:
-                self._run_with_serialization_retry(
-                    lambda: rec.with_context(**self._system_no_track_context()).write(
-                        {
-                            "last_command_at": fields.Datetime.now(),
-                            "last_command_payload": json.dumps(body, ensure_ascii=False),
-                        }
-                    )
-                )
-            except Exception as exc:
-                _logger.warning("Skip command metadata write for %s due to contention: %s", rec.display_name, exc)
-
-        if return_details:
-            return all_ok, succeeded
-        return all_ok
+            results.append(ok)
+            if not ok and raise_on_fail:
+                # Stop at the first failure like the direct MQTT path reports it.
+                results.extend([False] * (len(entries) - len(results)))
+                break
+        return results
 
     def _apply_state_report_safe(self, state, reported_at=None):
         try:
@@ -368,169 +563,191 @@ class IoTDevice(models.Model):
         except Exception as exc:
             _logger.warning("Skip optimistic state write for %s due to contention: %s", self.mapped("display_name"), exc)
 
-    def action_turn_on(self):
-        self._ensure_not_delay_locked()
-        ok, succeeded = self._publish_command("relay", {"state": "on"}, raise_on_fail=False, return_details=True)
-        if succeeded:
-            succeeded._apply_state_report_safe("on", reported_at=fields.Datetime.now())
-        if ok:
-            return {"type": "ir.actions.client", "tag": "soft_reload"}
+    @api.model
+    def _ensure_command_transport_configured(self):
+        icp = self.env["ir.config_parameter"].sudo()
+        middleware_enabled = str(icp.get_param("iot_control_center.middleware_enabled", "False")).lower() in ("1", "true", "yes")
+        if middleware_enabled:
+            if not (icp.get_param("iot_control_center.middleware_base_url") or "").strip():
+                raise UserError(_("Middleware is enabled but Middleware Base URL is empty."))
+            return
+        mqtt_host = icp.get_param("iot_control_center.mqtt_host")
+        if not mqtt_host or str(mqtt_host).strip().lower() in ("false", ""):
+            raise UserError(_("MQTT is not configured. Please set broker settings first."))
+
+    @api.model
+    def _enqueue_commands(self, entries, retain=False, job_name=None):
+        """Write commands to the outbox; the dispatcher publishes them after commit."""
+        return self.env["iot.device.command"].enqueue(entries, retain=retain, job_name=job_name)
+
+    @api.model
+    def _command_job_action(self, job, title):
+        if len(job.command_ids) > 1:
+            return {
+                "type": "ir.actions.act_window",
+                "name": title,
+                "res_model": "iot.device.command.job",
+                "res_id": job.id,
+                "view_mode": "form",
+                "target": "new",
+            }
         return {
             "type": "ir.actions.client",
             "tag": "display_notification",
             "params": {
-                "title": _("Switch command"),
-                "message": _("MQTT publish failed for some devices, please retry."),
+                "title": title,
+                "message": _("Command queued, the switch will update shortly."),
                 "sticky": False,
-                "type": "warning",
+                "type": "info",
+                "next": {"type": "ir.actions.client", "tag": "soft_reload"},
             },
         }
 
+    def _after_command_sent(self, command, payload, command_rec=None):
+        """Apply the local side effects of a command once the broker accepted it."""
+        self.ensure_one()
+        now = fields.Datetime.now()
+        body = {"command": command, **(payload or {})}
+        vals = {
+            "last_command_at": now,
+            "last_command_payload": json.dumps(body, ensure_ascii=False),
+        }
+        if command == "relay" and payload.get("state") in ("on", "off"):
+            self.apply_state_report(payload["state"], reported_at=now)
+        elif command == "delay_toggle":
+            duration_min = max(int(payload.get("duration_sec") or 60) // 60, 1)
+            if self.delay_active and (not self.delay_end_at or self.delay_end_at > now):
+                self._close_on_interval(now)
+                vals.update(
+                    {
+                        "delay_active": False,
+                        "delay_started_at": False,
+                        "delay_end_at": False,
+                        "on_since": False,
+                        "relay_state": "off",
+                        "last_seen": now,
+                    }
+                )
+            else:
+                self.apply_state_report("on", reported_at=now)
+                vals.update(
+                    {
+                        "delay_active": True,
+                        "delay_started_at": now,
+                        "delay_end_at": now + timedelta(minutes=duration_min),
+                    }
+                )
+        elif command in ("schedule_set", "schedule_clear"):
+            version = int(payload.get("version") or 0)
+            vals.update(
+                {
+                    "schedule_version": max(version, self.schedule_version),
+                    "schedule_hash": self.env["iot.schedule"]._entries_hash(payload.get("entries") or []),
+                    "schedule_last_push_at": now,
+                    "schedule_dirty": False,
+                }
+            )
+        elif command == "upgrade":
+            vals.update(
+                {
+                    "firmware_target_version": payload.get("version"),
+                    "firmware_upgrade_requested_at": now,
+                    "firmware_upgrade_state": "pending",
+                }
+            )
+            self.env["iot.firmware.upgrade.log"].sudo().create(
+                {
+                    "device_id": self.id,
+                    "firmware_id": command_rec.firmware_id.id if command_rec else False,
+                    "target_version": payload.get("version") or "",
+                    "state": "pending",
+                    "requested_at": now,
+                    "command_payload": json.dumps(payload, ensure_ascii=False),
+                }
+            )
+        self.write(vals)
+
+    def _after_command_failed(self, command, payload):
+        self.ensure_one()
+        if command in ("schedule_set", "schedule_clear"):
+            # Keep it dirty so the retry cron pushes it again once the device is back.
+            self.write({"schedule_dirty": True})
+
+    def action_turn_on(self):
+        self._ensure_not_delay_locked()
+        job = self._enqueue_commands([(rec, "relay", {"state": "on"}) for rec in self])
+        return self._command_job_action(job, _("Switch command"))
+
     def action_turn_off(self):
         self._ensure_not_delay_locked()
-        ok, succeeded = self._publish_command("relay", {"state": "off"}, raise_on_fail=False, return_details=True)
-        if succeeded:
-            succeeded._apply_state_report_safe("off", reported_at=fields.Datetime.now())
-        if ok:
-            return {"type": "ir.actions.client", "tag": "soft_reload"}
-        return {
-            "type": "ir.actions.client",
-            "tag": "display_notification",
-            "params": {
-                "title": _("Switch command"),
-                "message": _("MQTT publish failed for some devices, please retry."),
-                "sticky": False,
-                "type": "warning",
-            },
-        }
+        job = self._enqueue_commands([(rec, "relay", {"state": "off"}) for rec in self])
+        return self._command_job_action(job, _("Switch command"))
 
     def action_toggle(self):
         return False
 
     def action_delay_toggle(self):
-        now = fields.Datetime.now()
-        all_ok = True
-        for rec in self:
-            duration_min = max(int(rec.delay_duration_minutes or 0), 1)
-            ok = rec._publish_command("delay_toggle", {"duration_sec": duration_min * 60}, raise_on_fail=False)
-            all_ok = all_ok and ok
-            if not ok:
-                continue
-
-            if rec.delay_active and (not rec.delay_end_at or rec.delay_end_at > now):
-                rec._accumulate_on_minutes_until(now)
-                rec.delay_active = False
-                rec.delay_started_at = False
-                rec.delay_end_at = False
-                rec.on_since = False
-                rec.relay_state = "off"
-                rec.last_seen = now
-            else:
-                rec.apply_state_report("on", reported_at=now)
-                rec.delay_active = True
-                rec.delay_started_at = now
-                rec.delay_end_at = now + timedelta(minutes=duration_min)
-
-        if all_ok:
-            return {"type": "ir.actions.client", "tag": "soft_reload"}
-        return {
-            "type": "ir.actions.client",
-            "tag": "display_notification",
-            "params": {
-                "title": _("Delay switch"),
-                "message": _("MQTT publish failed for some devices, please retry."),
-                "sticky": False,
-                "type": "warning",
-            },
-        }
+        entries = [
+            (rec, "delay_toggle", {"duration_sec": max(int(rec.delay_duration_minutes or 0), 1) * 60})
+            for rec in self
+        ]
+        job = self._enqueue_commands(entries)
+        return self._command_job_action(job, _("Delay switch"))
 
     def _iter_schedule_entries(self):
         self.ensure_one()
-        schedules = self.env["iot.schedule"].search(
-            [
-                ("active", "=", True),
-                "|",
-                ("device_id", "=", self.id),
-                ("group_id", "in", self.group_ids.ids),
-            ],
-            order="id asc",
-        )
-        entries = []
-        for rec in schedules:
-            tz = pytz.timezone(rec.timezone or "UTC")
-            offset = int((datetime.now(tz).utcoffset() or timedelta()).total_seconds() // 60)
-            for weekday in rec.get_enabled_weekdays():
-                entries.append(
-                    {
-                        "weekday": weekday,  # Monday=0 .. Sunday=6
-                        "hour": rec.hour,
-                        "minute": rec.minute,
-                        "action": rec.command,
-                        "offset_min": offset,
-                    }
-                )
-        return entries
+        return self.env["iot.schedule"]._compile_for_devices(self)[self.id]
 
-    def _sync_schedule_payload(self, raise_on_error=False):
+    def _schedule_in_sync(self, schedule_hash):
+        """True when the switch already runs exactly these entries."""
+        self.ensure_one()
+        return bool(self.schedule_hash) and self.schedule_hash == schedule_hash and self.schedule_applied_version >= self.schedule_version
+
+    def _sync_schedule_payload(self, raise_on_error=False, force=False):
+        if raise_on_error:
+            self._ensure_command_transport_configured()
+        changed, compiled = self._split_schedule_changes(force=force)
+        return changed._enqueue_schedule_payload(compiled)
+
+    def _split_schedule_changes(self, force=False):
+        """Clear the dirty flag of switches already running their schedule.
+
+        Returns the switches that still need a push and the compiled entries
+        of all of them.
+        """
+        schedule_model = self.env["iot.schedule"]
+        compiled = schedule_model._compile_for_devices(self)
+        changed = self.browse()
+        unchanged = self.browse()
         for rec in self:
-            next_version = rec.schedule_version + 1
-            entries = rec._iter_schedule_entries()
-            try:
-                ok = False
-                if entries:
-                    ok = rec._publish_command(
-                        "schedule_set",
-                        {"version": next_version, "entries": entries},
-                        raise_on_fail=raise_on_error,
-                        retain=True,
-                    )
-                else:
-                    ok = rec._publish_command(
-                        "schedule_clear",
-                        {"version": next_version},
-                        raise_on_fail=raise_on_error,
-                        retain=True,
-                    )
-                if not ok:
-                    rec.schedule_dirty = True
-                    if raise_on_error:
-                        raise UserError(_("Failed to publish MQTT command for %s") % rec.display_name)
-                    continue
-                rec.schedule_version = next_version
-                rec.schedule_last_push_at = fields.Datetime.now()
-                rec.schedule_dirty = False
-            except Exception as exc:
-                rec.schedule_dirty = True
-                if raise_on_error:
-                    raise
-                _logger.warning("Auto schedule sync failed for %s: %s", rec.display_name, exc)
+            if not force and rec._schedule_in_sync(schedule_model._entries_hash(compiled[rec.id])):
+                unchanged |= rec
+            else:
+                changed |= rec
+        if unchanged:
+            unchanged.with_context(**self._system_no_track_context()).write({"schedule_dirty": False})
+        return changed, compiled
 
-    def _force_schedule_clear(self, raise_on_error=False):
+    def _enqueue_schedule_payload(self, compiled):
+        entries = []
         for rec in self:
+            schedule_entries = compiled[rec.id]
             next_version = rec.schedule_version + 1
-            try:
-                ok = rec._publish_command(
-                    "schedule_clear",
-                    {"version": next_version},
-                    raise_on_fail=raise_on_error,
-                    retain=True,
-                )
-                if not ok:
-                    rec.schedule_dirty = True
-                    if raise_on_error:
-                        raise UserError(_("Failed to publish MQTT command for %s") % rec.display_name)
-                    continue
-                rec.schedule_version = next_version
-                rec.schedule_last_push_at = fields.Datetime.now()
-                rec.schedule_dirty = False
-            except Exception as exc:
-                rec.schedule_dirty = True
-                if raise_on_error:
-                    raise
-                _logger.warning("Schedule clear failed for %s: %s", rec.display_name, exc)
+            if schedule_entries:
+                entries.append((rec, "schedule_set", {"version": next_version, "entries": schedule_entries}))
+            else:
+                entries.append((rec, "schedule_clear", {"version": next_version}))
+        return self._enqueue_commands(entries, retain=True, job_name=_("Schedule sync x %s") % len(entries))
+
+    def _force_schedule_clear(self, raise_on_error=False):
+        if raise_on_error:
+            self._ensure_command_transport_configured()
+        entries = [(rec, "schedule_clear", {"version": rec.schedule_version + 1}) for rec in self]
+        return self._enqueue_commands(entries, retain=True, job_name=_("Schedule clear x %s") % len(entries))
 
     def action_sync_schedule(self):
-        self._sync_schedule_payload(raise_on_error=True)
+        job = self._sync_schedule_payload(raise_on_error=True, force=True)
+        return self._command_job_action(job, _("Schedule sync"))
 
     def action_reset_uptime(self):
         self.ensure_one()
@@ -551,9 +768,10 @@ class IoTDevice(models.Model):
             raise UserError(_("Reset reason is required."))
         now = fields.Datetime.now()
         for rec in self:
+            # Close the running interval so the ledger keeps the time before the reset.
+            rec._close_on_interval(now)
             before_minutes = rec.total_on_minutes
             rec.total_on_minutes = 0
-            rec.on_since = now if rec.relay_state == "on" else False
             rec.message_post(
                 body=_(
                     "Accumulated ON time reset by %s. Reason: %s. Previous total: %.2f hours."
@@ -567,7 +785,7 @@ class IoTDevice(models.Model):
         for rec in self:
             old_state = rec.relay_state
             if old_state == "on" and state != "on":
-                rec._accumulate_on_minutes_until(at)
+                rec._close_on_interval(at)
                 rec.on_since = False
             elif old_state != "on" and state == "on":
                 rec.on_since = at
@@ -632,6 +850,7 @@ class IoTDevice(models.Model):
         at = reported_at or fields.Datetime.now()
         for rec in self:
             if module_id and rec.module_id != module_id:
+                rec._release_module_key(module_id)
                 rec.module_id = module_id
             rec.last_seen = at
 
@@ -701,14 +920,198 @@ class IoTDevice(models.Model):
             rec.firmware_upgrade_state = "failed"
             rec.firmware_upgrade_completed_at = at
 
+    @api.model
+    def _reduced_report_fields(self):
+        return (
+            "relay_state",
+            "last_seen",
+            "on_since",
+            "total_on_minutes",
+            "delay_active",
+            "delay_started_at",
+            "delay_end_at",
+            "manual_override",
+            "module_id",
+            "firmware_version",
+            "firmware_upgrade_state",
+            "firmware_upgrade_completed_at",
+            "schedule_applied_version",
+            "schedule_last_sync_at",
+        )
+
+    def _reduce_reports(self, reports, closed_intervals=None):
+        """Fold ordered ``(payload, reported_at)`` device reports into one delta.
+
+        Follows the ``apply_*_report`` methods step by step, but on a plain dict
+        seeded from the record, so a whole batch ends in a single write. Returns
+        the vals that differ from the current record; relay on intervals closed
+        on the way are appended to ``closed_intervals`` as ``(start, end)``.
+        """
+        self.ensure_one()
+        fields_list = self._reduced_report_fields()
+        start = {name: self[name] for name in fields_list}
+        st = dict(start)
+        log_model = self.env["iot.firmware.upgrade.log"]
+        pending_log = None
+
+        def _pending_log():
+            nonlocal pending_log
+            if pending_log is None:
+                pending_log = log_model.search(
+                    [("device_id", "=", self.id), ("state", "=", "pending")],
+                    order="requested_at desc, id desc",
+                    limit=1,
+                )
+            return pending_log
+
+        for payload, at in reports:
+            payload = payload if isinstance(payload, dict) else {}
+            state = payload.get("state")
+            ota_state = payload.get("ota_state")
+            if state in ("on", "off", "unknown"):
+                if st["relay_state"] == "on" and state != "on":
+                    if st["on_since"] and at > st["on_since"]:
+                        if closed_intervals is not None:
+                            closed_intervals.append((st["on_since"], at))
+                        delta_min = int((at - st["on_since"]).total_seconds() // 60)
+                        if delta_min > 0:
+                            st["total_on_minutes"] += delta_min
+                    st["on_since"] = False
+                elif st["relay_state"] != "on" and state == "on":
+                    st["on_since"] = at
+                st["relay_state"] = state
+                st["last_seen"] = at
+                if state != "on" and st["delay_active"]:
+                    st.update({"delay_active": False, "delay_started_at": False, "delay_end_at": False})
+            else:
+                st["last_seen"] = fields.Datetime.now()
+
+            fw = payload.get("firmware_version")
+            if fw:
+                prev_version = st["firmware_version"]
+                st["firmware_version"] = fw
+                st["last_seen"] = at
+                # Do not mark success only by periodic telemetry with same version.
+                confirmed = ota_state == "ok" or (prev_version and prev_version != fw)
+                log = _pending_log()
+                if log:
+                    if confirmed:
+                        result = "success" if (log.target_version or "") == (fw or "") else "mismatch"
+                        log.write({"reported_version": fw, "state": result, "completed_at": at})
+                        pending_log = None
+                        st["firmware_upgrade_completed_at"] = at
+                        st["firmware_upgrade_state"] = result
+                elif self.firmware_target_version and st["firmware_upgrade_state"] == "pending" and confirmed:
+                    st["firmware_upgrade_completed_at"] = at
+                    if self.firmware_target_version == fw:
+                        st["firmware_upgrade_state"] = "success"
+                    elif st["firmware_upgrade_state"] != "failed":
+                        st["firmware_upgrade_state"] = "mismatch"
+
+            module_id = payload.get("module_id")
+            if module_id:
+                st["module_id"] = str(module_id)
+                st["last_seen"] = at
+
+            if payload.get("manual_override") is not None:
+                st["manual_override"] = bool(payload["manual_override"])
+                st["last_seen"] = at
+
+            if "delay_active" in payload:
+                st["last_seen"] = at
+                active = payload.get("delay_active")
+                if active is not None:
+                    st["delay_active"] = bool(active)
+                    if active:
+                        try:
+                            remaining = max(int(payload.get("delay_remaining_sec") or 0), 0)
+                        except Exception:
+                            remaining = 0
+                        if remaining > 0:
+                            st["delay_end_at"] = at + timedelta(seconds=remaining)
+                        if not st["delay_started_at"]:
+                            st["delay_started_at"] = at
+                    else:
+                        st["delay_started_at"] = False
+                        st["delay_end_at"] = False
+
+            if ota_state:
+                st["last_seen"] = at
+                if ota_state in ("failed", "no_update"):
+                    log = _pending_log()
+                    if log:
+                        log.write({"state": "failed", "completed_at": at, "note": (payload.get("ota_note") or "")[:255]})
+                        pending_log = None
+                    st["firmware_upgrade_state"] = "failed"
+                    st["firmware_upgrade_completed_at"] = at
+
+            if "schedule_version" in payload:
+                try:
+                    version = int(payload["schedule_version"]) if payload["schedule_version"] is not None else None
+                except Exception:
+                    version = None
+                if version is not None:
+                    st["schedule_applied_version"] = version
+                    st["schedule_last_sync_at"] = at
+                st["last_seen"] = at
+
+        return {name: value for name, value in st.items() if value != start[name]}
+
+    def _apply_reports(self, reports, last_seen_step_sec=0):
+        """Reduce ``reports`` and write the result with one UPDATE.
+
+        With ``last_seen_step_sec``, a delta that only moves ``last_seen`` by less
+        than that many seconds is dropped, so chatty telemetry does not rewrite
+        the device row on every sample.
+        """
+        self.ensure_one()
+        closed = []
+        vals = self._reduce_reports(reports, closed_intervals=closed)
+        if (
+            last_seen_step_sec
+            and set(vals) == {"last_seen"}
+            and self.last_seen
+            and (vals["last_seen"] - self.last_seen).total_seconds() < last_seen_step_sec
+        ):
+            return {}
+        if vals.get("module_id"):
+            self._release_module_key(vals["module_id"])
+        if vals:
+            self.with_context(**self._system_no_track_context()).write(vals)
+        if closed:
+            self.env["iot.device.state.interval"].sudo()._record_intervals([(self.id, start, end) for start, end in closed])
+        return vals
+
     def mark_schedule_dirty(self, auto_sync=False):
         if self:
             target = self.with_context(**self._system_no_track_context())
             self._run_with_serialization_retry(lambda: target.write({"schedule_dirty": True}))
         if auto_sync and self:
-            self._sync_schedule_payload(raise_on_error=False)
+            # The sync engine pushes online switches under its rate limit.
+            self._trigger_schedule_sync()
+
+    @api.model
+    def _trigger_schedule_sync(self, at=None):
+        cron = self.env.ref("iot_control_center.cron_iot_sync_dirty_schedules", raise_if_not_found=False)
+        if cron:
+            cron.sudo()._trigger(at)
+
+    def _presence_transition(self, state, at=None):
+        super()._presence_transition(state, at=at)
+        # Re-arm pushes only for switches that actually came back.
+        if state == "online" and any(rec.schedule_dirty for rec in self):
+            self._trigger_schedule_sync()
 
     def write(self, vals):
+        if vals and set(vals).issubset(self._runtime_fields()):
+            # Telemetry only touches the runtime rows, never the device row a
+            # user may be editing.
+            self.check_access("write")
+            target, moving = self._presence_pending(vals)
+            self.runtime_id.write(vals)
+            if moving:
+                moving._presence_transition(target)
+            return True
         needs_auto_sync = "group_ids" in vals
         runtime_only = bool(vals) and set(vals).issubset(self._runtime_no_track_fields())
         if runtime_only:
@@ -719,12 +1122,37 @@ class IoTDevice(models.Model):
             self.mark_schedule_dirty(auto_sync=True)
         return res
 
+    def unlink(self):
+        runtimes = self.runtime_id
+        res = super().unlink()
+        runtimes.sudo().unlink()
+        return res
+
+    def _register_hook(self):
+        super()._register_hook()
+        # In shared subscription mode every worker process subscribes, not only the
+        # one that happens to run the ensure cron.
+        try:
+            icp = self.env["ir.config_parameter"].sudo()
+            middleware_enabled = str(icp.get_param("iot_control_center.middleware_enabled", "False")).lower() in ("1", "true", "yes")
+            if not middleware_enabled and shared_subscription_enabled(self.env):
+                ensure_running(self.env)
+        except Exception as exc:
+            _logger.warning("IoT MQTT shared subscriber not started on registry load: %s", exc)
+        # Every worker competes for the queue processor role, so a live one takes
+        # over within a heartbeat when the current processor goes away.
+        try:
+            ensure_message_listener(self.env)
+        except Exception as exc:
+            _logger.warning("IoT MQTT message listener not started on registry load: %s", exc)
+
     @api.model
     def _cron_ensure_mqtt_service(self):
         icp = self.env["ir.config_parameter"].sudo()
         middleware_enabled = str(icp.get_param("iot_control_center.middleware_enabled", "False")).lower() in ("1", "true", "yes")
         if not middleware_enabled:
             ensure_running(self.env)
+        ensure_message_listener(self.env)
         now = fields.Datetime.now()
         expired = self.with_context(**self._system_no_track_context()).search(
             [("delay_active", "=", True), ("delay_end_at", "!=", False), ("delay_end_at", "<=", now)]
@@ -733,54 +1161,184 @@ class IoTDevice(models.Model):
             self._run_with_serialization_retry(
                 lambda: expired.write({"delay_active": False, "delay_started_at": False, "delay_end_at": False})
             )
-        self._cron_retry_dirty_schedule_sync()
 
     @api.model
-    def _cron_retry_dirty_schedule_sync(self):
-        """Retry schedule sync for online devices when previous push failed/offline."""
-        timeout = int(self.env["ir.config_parameter"].sudo().get_param("iot_control_center.online_timeout_sec", 300))
-        recent_cutoff = fields.Datetime.now() - timedelta(seconds=max(timeout, 60) * 2)
-        dirty_devices = self.with_context(**self._system_no_track_context()).search(
-            [
-                ("schedule_dirty", "=", True),
-                "|",
-                ("company_id", "!=", False),
-                ("schedule_version", ">", 0),
-                ("last_seen", ">=", recent_cutoff),
-            ],
-            limit=200,
+    def _schedule_sync_config(self):
+        icp = self.env["ir.config_parameter"].sudo()
+
+        def _int_param(key, default, minimum):
+            try:
+                return max(int(icp.get_param(f"iot_control_center.{key}", str(default)) or default), minimum)
+            except Exception:
+                return default
+
+        return {
+            "rate_per_sec": _int_param("schedule_sync_rate_per_sec", 20, 1),
+            "max_inflight": _int_param("schedule_sync_max_inflight", 200, 1),
+            "ack_timeout_sec": _int_param("schedule_sync_ack_timeout_sec", 600, 60),
+        }
+
+    @api.model
+    def _schedule_sync_inflight(self):
+        self.env.cr.execute(
+            "SELECT COUNT(*) FROM iot_device_command WHERE state = 'queued' AND coalesce_key = 'schedule'"
         )
-        if not dirty_devices:
-            return
-        self._run_with_serialization_retry(lambda: dirty_devices._sync_schedule_payload(raise_on_error=False))
+        return self.env.cr.fetchone()[0]
 
     @api.model
-    def _cron_update_live_uptime(self):
-        def _do_update():
-            devices = self.with_context(**self._system_no_track_context()).search(
-                [("relay_state", "=", "on"), ("on_since", "!=", False)]
-            )
-            if devices:
-                now = fields.Datetime.now()
-                devices._accumulate_on_minutes_until(now)
+    def _schedule_sync_candidates(self, limit):
+        """Dirty online switches without a queued push, most recently seen first."""
+        self.env.cr.execute(
+            """
+            SELECT d.id
+            FROM iot_device d
+            JOIN iot_device_runtime rt ON rt.id = d.runtime_id
+            WHERE d.schedule_dirty
+              AND d.active
+              AND d.presence_state = 'online'
+              AND (d.company_id IS NOT NULL OR d.schedule_version > 0)
+              AND NOT EXISTS (
+                  SELECT 1
+                  FROM iot_device_command cmd
+                  WHERE cmd.device_id = d.id
+                    AND cmd.state = 'queued'
+                    AND cmd.coalesce_key = 'schedule'
+              )
+            ORDER BY rt.last_seen DESC NULLS LAST, d.id
+            LIMIT %s
+            """,
+            [int(limit)],
+        )
+        return self.browse([row[0] for row in self.env.cr.fetchall()])
 
-        self._run_with_serialization_retry(_do_update)
+    @api.model
+    def _rearm_unacked_schedules(self, ack_timeout_sec):
+        """Mark online switches dirty again when a pushed version was never acknowledged."""
+        self.env.cr.execute(
+            """
+            UPDATE iot_device d
+            SET schedule_dirty = true
+            FROM iot_device_runtime rt
+            WHERE rt.id = d.runtime_id
+              AND NOT d.schedule_dirty
+              AND d.active
+              AND d.presence_state = 'online'
+              AND rt.schedule_applied_version < d.schedule_version
+              AND rt.schedule_last_push_at < %s
+            """,
+            [fields.Datetime.now() - timedelta(seconds=ack_timeout_sec)],
+        )
+        rearmed = self.env.cr.rowcount
+        if rearmed:
+            self.invalidate_model(["schedule_dirty", "schedule_sync_state"])
+        return rearmed
 
     @api.model
-    def _cron_dedupe_devices(self):
-        # Keep the latest row for each serial/module key to prevent table bloat if
-        # devices reconnect with inconsistent identifiers or under race conditions.
+    def get_schedule_sync_stats(self):
+        """Convergence of the fleet's schedules and an ETA at the observed push rate."""
+        window_sec = 300
+        self.env.cr.execute(
+            """
+            SELECT
+                COUNT(*) FILTER (WHERE d.schedule_dirty),
+                COUNT(*) FILTER (WHERE d.schedule_dirty AND d.presence_state = 'online'),
+                COUNT(*) FILTER (WHERE NOT d.schedule_dirty AND rt.schedule_applied_version < d.schedule_version),
+                COUNT(*) FILTER (WHERE NOT d.schedule_dirty AND rt.schedule_applied_version >= d.schedule_version)
+            FROM iot_device d
+            JOIN iot_device_runtime rt ON rt.id = d.runtime_id
+            WHERE d.active
+            """
+        )
+        dirty, dirty_online, awaiting_ack, in_sync = self.env.cr.fetchone()
+        self.env.cr.execute(
+            """
+            SELECT COUNT(*)
+            FROM iot_device_command
+            WHERE coalesce_key = 'schedule'
+              AND state = 'sent'
+              AND sent_at >= %s
+            """,
+            [fields.Datetime.now() - timedelta(seconds=window_sec)],
+        )
+        recent_pushes = self.env.cr.fetchone()[0]
+        rate_per_sec = recent_pushes / float(window_sec) or float(self._schedule_sync_config()["rate_per_sec"])
+        return {
+            "dirty": dirty,
+            "dirty_online": dirty_online,
+            "queued": self._schedule_sync_inflight(),
+            "awaiting_ack": awaiting_ack,
+            "in_sync": in_sync,
+            "push_rate_per_min": round(recent_pushes * 60.0 / window_sec, 1),
+            "eta_sec": int(dirty_online / rate_per_sec) if dirty_online else 0,
+        }
+
+    @api.model
+    def _cron_sync_dirty_schedules(self, time_budget_sec=50):
+        """Push dirty schedules to online switches with bounded in-flight pushes and a global rate.
+
+        Runs on one node at a time. Each wave drops switches whose schedule is
+        already in sync, takes tokens only for the real pushes, never lets more
+        than ``max_inflight`` schedule commands wait in the outbox, and commits
+        so the dispatcher can publish while the next wave is prepared. When the
+        rate bucket runs dry the rest stays dirty and the cron is re-triggered
+        for when tokens are back, instead of waiting inside the transaction.
+        """
+        with exclusive_job(self.env, "schedule_sync") as acquired:
+            if not acquired:
+                return
+            config = self._schedule_sync_config()
+            self._rearm_unacked_schedules(config["ack_timeout_sec"])
+            bucket = get_bucket(self.env.cr.dbname, "schedule_sync", config["rate_per_sec"])
+            deadline = time.monotonic() + max(int(time_budget_sec), 1)
+            pushed = 0
+            retry_at = None
+            while time.monotonic() < deadline:
+                room = config["max_inflight"] - self._schedule_sync_inflight()
+                if room <= 0:
+                    break
+                devices = self._schedule_sync_candidates(room).with_context(**self._system_no_track_context())
+                if not devices:
+                    break
+                changed, compiled = devices._split_schedule_changes()
+                granted = bucket.take(len(changed))
+                if granted:
+                    changed[:granted]._enqueue_schedule_payload(compiled)
+                    pushed += granted
+                self.env.cr.commit()
+                if granted < len(changed):
+                    retry_at = fields.Datetime.now() + timedelta(seconds=max(math.ceil(bucket.wait_time()), 1))
+                    break
+            stats = self.get_schedule_sync_stats()
+            if pushed or stats["dirty_online"]:
+                _logger.info(
+                    "IoT schedule sync pushed=%s dirty_online=%s queued=%s awaiting_ack=%s eta=%ss",
+                    pushed,
+                    stats["dirty_online"],
+                    stats["queued"],
+                    stats["awaiting_ack"],
+                    stats["eta_sec"],
+                )
+            if stats["dirty_online"]:
+                # Continue once tokens are back, or as soon as the dispatcher
+                # has drained the outbox.
+                self._trigger_schedule_sync(retry_at or fields.Datetime.now() + timedelta(seconds=10))
+
+    @api.model
+    def _dedupe_device_keys(self):
+        # One-off cleanup before the unique key indexes exist: keep the latest row
+        # for each serial/module key. Afterwards the indexes prevent duplicates.
         self.env.cr.execute(
             """
             WITH ranked AS (
                 SELECT
-                    id,
+                    d.id,
                     ROW_NUMBER() OVER (
-                        PARTITION BY lower(serial)
-                        ORDER BY last_seen DESC NULLS LAST, write_date DESC NULLS LAST, id DESC
+                        PARTITION BY d.serial_key
+                        ORDER BY rt.last_seen DESC NULLS LAST, d.write_date DESC NULLS LAST, d.id DESC
                     ) AS rn
-                FROM iot_device
-                WHERE serial IS NOT NULL AND btrim(serial) <> ''
+                FROM iot_device d
+                LEFT JOIN iot_device_runtime rt ON rt.id = d.runtime_id
+                WHERE d.serial_key IS NOT NULL
             )
             DELETE FROM iot_device d
             USING ranked r
@@ -791,17 +1349,18 @@ class IoTDevice(models.Model):
             """
             WITH ranked AS (
                 SELECT
-                    id,
+                    d.id,
                     ROW_NUMBER() OVER (
-                        PARTITION BY lower(module_id)
+                        PARTITION BY d.module_key
                         ORDER BY
-                            CASE WHEN company_id IS NULL THEN 1 ELSE 0 END,
-                            last_seen DESC NULLS LAST,
-                            write_date DESC NULLS LAST,
-                            id DESC
+                            CASE WHEN d.company_id IS NULL THEN 1 ELSE 0 END,
+                            rt.last_seen DESC NULLS LAST,
+                            d.write_date DESC NULLS LAST,
+                            d.id DESC
                     ) AS rn
-                FROM iot_device
-                WHERE module_id IS NOT NULL AND btrim(module_id) <> ''
+                FROM iot_device d
+                LEFT JOIN iot_device_runtime rt ON rt.id = d.runtime_id
+                WHERE d.module_key IS NOT NULL
             )
             DELETE FROM iot_device d
             USING ranked r
@@ -821,10 +1380,13 @@ class IoTDevice(models.Model):
         # Keep bound devices; purge only unbound stale rows to prevent table bloat.
         self.env.cr.execute(
             """
-            DELETE FROM iot_device
-            WHERE (company_id IS NULL)
-              AND (last_seen IS NULL OR last_seen < %s)
-              AND (firmware_upgrade_state IS NULL OR firmware_upgrade_state <> 'pending')
+            DELETE FROM iot_device d
+            USING iot_device_runtime rt
+            WHERE rt.id = d.runtime_id
+              AND (d.company_id IS NULL)
+              AND (rt.last_seen IS NULL OR rt.last_seen < %s)
+              AND (d.firmware_upgrade_state IS NULL OR d.firmware_upgrade_state <> 'pending')
             """,
             [cutoff],
         )
+        self.env["iot.device.runtime"]._purge_orphans()
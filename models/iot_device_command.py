@@ -0,0 +1,438 @@
+import json
+import logging
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from odoo import _, api, fields, models
+
+_logger = logging.getLogger(__name__)
+
+
+class IoTDeviceCommandJob(models.Model):
+    _name = "iot.device.command.job"
+    _description = "Switch Command Job"
+    _order = "id desc"
+
+    name = fields.Char(required=True)
+    command = fields.Char(index=True)
+    user_id = fields.Many2one("res.users", default=lambda self: self.env.user, index=True)
+    company_id = fields.Many2one("res.company", default=lambda self: self.env.company, index=True)
+    command_ids = fields.One2many("iot.device.command", "job_id", string="Commands")
+
+    total_count = fields.Integer(compute="_compute_progress")
+    queued_count = fields.Integer(compute="_compute_progress")
+    sent_count = fields.Integer(compute="_compute_progress")
+    failed_count = fields.Integer(compute="_compute_progress")
+    superseded_count = fields.Integer(compute="_compute_progress")
+    progress = fields.Float(compute="_compute_progress")
+    state = fields.Selection(
+        [("running", "Running"), ("done", "Done"), ("failed", "Done with Errors")],
+        compute="_compute_progress",
+    )
+
+    def _compute_progress(self):
+        counts = {}
+        if self.ids:
+            groups = self.env["iot.device.command"].sudo()._read_group(
+                [("job_id", "in", self.ids)],
+                ["job_id", "state"],
+                ["__count"],
+            )
+            for job, state, count in groups:
+                counts.setdefault(job.id, {})[state] = count
+        for rec in self:
+            by_state = counts.get(rec.id, {})
+            rec.queued_count = by_state.get("queued", 0)
+            rec.sent_count = by_state.get("sent", 0)
+            rec.failed_count = by_state.get("failed", 0)
+            rec.superseded_count = by_state.get("superseded", 0)
+            rec.total_count = sum(by_state.values())
+            finished = rec.total_count - rec.queued_count
+            rec.progress = round(100.0 * finished / rec.total_count, 2) if rec.total_count else 100.0
+            if rec.queued_count:
+                rec.state = "running"
+            elif rec.failed_count:
+                rec.state = "failed"
+            else:
+                rec.state = "done"
+
+
+class IoTDeviceCommand(models.Model):
+    _name = "iot.device.command"
+    _description = "Switch Command Outbox"
+    _order = "id desc"
+
+    job_id = fields.Many2one("iot.device.command.job", index=True, ondelete="cascade")
+    device_id = fields.Many2one("iot.device", required=True, index=True, ondelete="cascade")
+    company_id = fields.Many2one(related="device_id.company_id", store=True, index=True)
+    command = fields.Char(required=True, index=True)
+    payload = fields.Text()
+    retain = fields.Boolean(default=False)
+    coalesce_key = fields.Char(index=True)
+    firmware_id = fields.Many2one("iot.firmware", ondelete="set null")
+
+    state = fields.Selection(
+        [("queued", "Queued"), ("sent", "Sent"), ("failed", "Failed"), ("superseded", "Superseded")],
+        default="queued",
+        required=True,
+        index=True,
+    )
+    attempts = fields.Integer(default=0)
+    next_attempt_at = fields.Datetime()
+    sent_at = fields.Datetime()
+    error = fields.Char()
+
+    # Round-trip tracking: the firmware echoes ``cid`` in the next status publish.
+    correlation_id = fields.Char(index=True, copy=False, readonly=True)
+    sent_ts = fields.Float(string="Sent Timestamp", digits=(16, 3), copy=False)
+    firmware_version = fields.Char(copy=False)
+    acked_at = fields.Datetime(copy=False)
+    ack_latency_ms = fields.Integer(string="Ack Latency (ms)", copy=False, aggregator="avg")
+
+    @api.model
+    def init(self):
+        self.env.cr.execute(
+            """
+            CREATE INDEX IF NOT EXISTS iot_device_command_queued_idx
+            ON iot_device_command (next_attempt_at, id)
+            WHERE state = 'queued'
+            """
+        )
+        self.env.cr.execute(
+            """
+            CREATE INDEX IF NOT EXISTS iot_device_command_coalesce_idx
+            ON iot_device_command (device_id, coalesce_key, create_date DESC)
+            WHERE state = 'queued'
+            """
+        )
+
+    @api.model
+    def _new_correlation_id(self):
+        return uuid.uuid4().hex[:16]
+
+    @api.model
+    def _coalesce_key_for(self, command):
+        # Later commands of the same kind fully replace earlier ones; toggles do not.
+        return {
+            "relay": "relay",
+            "schedule_set": "schedule",
+            "schedule_clear": "schedule",
+            "upgrade": "upgrade",
+        }.get(command)
+
+    @api.model
+    def _int_param(self, key, default, minimum=1):
+        raw = self.env["ir.config_parameter"].sudo().get_param(key, str(default))
+        try:
+            return max(int(raw or default), minimum)
+        except Exception:
+            return default
+
+    def _payload_dict(self):
+        self.ensure_one()
+        try:
+            payload = json.loads(self.payload or "{}")
+        except Exception:
+            payload = {}
+        return payload if isinstance(payload, dict) else {}
+
+    @api.model
+    def enqueue(self, entries, retain=False, job_name=None):
+        """Queue ``(device, command, payload[, firmware])`` entries and return the job.
+
+        Rows are written in the caller's transaction, so a rolled back UI action never
+        publishes anything. Still-queued commands that a new one supersedes are
+        collapsed inside the coalescing window.
+        """
+        entries = list(entries)
+        if not entries:
+            return self.env["iot.device.command.job"]
+        commands = {entry[1] for entry in entries}
+        job = self.env["iot.device.command.job"].sudo().create(
+            {
+                "name": job_name or _("%(command)s x %(count)s", command=", ".join(sorted(commands)), count=len(entries)),
+                "command": next(iter(commands)) if len(commands) == 1 else False,
+            }
+        )
+        window = self._int_param("iot_control_center.command_coalesce_window_sec", 10, minimum=0)
+        superseded = {}
+        vals_list = []
+        for entry in entries:
+            device, command, payload = entry[0], entry[1], entry[2]
+            firmware = entry[3] if len(entry) > 3 else None
+            key = self._coalesce_key_for(command)
+            if key:
+                superseded.setdefault(key, set()).add(device.id)
+            vals_list.append(
+                {
+                    "job_id": job.id,
+                    "device_id": device.id,
+                    "command": command,
+                    "payload": json.dumps(payload or {}, ensure_ascii=False, separators=(",", ":")),
+                    "retain": bool(retain),
+                    "coalesce_key": key,
+                    "firmware_id": firmware.id if firmware else False,
+                    "correlation_id": self._new_correlation_id(),
+                }
+            )
+        if window:
+            cutoff = fields.Datetime.now() - timedelta(seconds=window)
+            for key, device_ids in superseded.items():
+                self.env.cr.execute(
+                    """
+                    UPDATE iot_device_command
+                    SET state = 'superseded', write_date = now() AT TIME ZONE 'UTC'
+                    WHERE state = 'queued'
+                      AND coalesce_key = %s
+                      AND device_id = ANY(%s)
+                      AND create_date >= %s
+                    """,
+                    [key, list(device_ids), cutoff],
+                )
+            self.invalidate_model(["state"])
+        self.sudo().create(vals_list)
+        self._trigger_dispatch()
+        return job
+
+    @api.model
+    def _trigger_dispatch(self):
+        cron = self.env.ref("iot_control_center.cron_iot_dispatch_device_commands", raise_if_not_found=False)
+        if cron:
+            cron.sudo()._trigger()
+
+    @api.model
+    def _claim_batch(self, limit):
+        self.env.cr.execute(
+            """
+            SELECT id
+            FROM iot_device_command
+            WHERE state = 'queued'
+              AND (next_attempt_at IS NULL OR next_attempt_at <= %s)
+            ORDER BY id
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+            """,
+            [fields.Datetime.now(), int(limit)],
+        )
+        return self.browse([row[0] for row in self.env.cr.fetchall()])
+
+    def _dispatch(self):
+        device_model = self.env["iot.device"].with_context(**self.env["iot.device"]._system_no_track_context())
+        max_attempts = self._int_param("iot_control_center.command_max_attempts", 5)
+        retry_base = self._int_param("iot_control_center.command_retry_base_sec", 5)
+        for retain in (False, True):
+            batch = self.filtered(lambda c: bool(c.retain) == retain)
+            if not batch:
+                continue
+            entries = [
+                (cmd.device_id, cmd.command, {**cmd._payload_dict(), "cid": cmd.correlation_id})
+                for cmd in batch
+            ]
+            sent_ts = time.time()
+            try:
+                _all_ok, results = device_model._publish_commands(
+                    entries,
+                    raise_on_fail=False,
+                    retain=retain,
+                    return_details=True,
+                    write_metadata=False,
+                )
+            except Exception as exc:
+                _logger.warning("IoT command dispatch failed for %s command(s): %s", len(batch), exc)
+                results = [False] * len(entries)
+            now = fields.Datetime.now()
+            # Judge each command by its own publish result: a device can have
+            # several commands in one batch.
+            for cmd, (device, command, payload), ok in zip(batch, entries, results):
+                if ok:
+                    cmd.write(
+                        {
+                            "state": "sent",
+                            "sent_at": now,
+                            "sent_ts": sent_ts,
+                            "firmware_version": device.firmware_version,
+                            "attempts": cmd.attempts + 1,
+                            "error": False,
+                        }
+                    )
+                    try:
+                        device_model._run_with_serialization_retry(
+                            lambda: device.with_env(device_model.env)._after_command_sent(command, payload, command_rec=cmd)
+                        )
+                    except Exception as exc:
+                        _logger.warning("Skip post-send update for %s due to contention: %s", device.display_name, exc)
+                    continue
+                attempts = cmd.attempts + 1
+                if attempts >= max_attempts:
+                    cmd.write({"state": "failed", "attempts": attempts, "error": _("MQTT publish failed")})
+                    device.with_env(device_model.env)._after_command_failed(command, payload)
+                else:
+                    delay = min(retry_base * (2 ** (attempts - 1)), 300)
+                    cmd.write(
+                        {
+                            "attempts": attempts,
+                            "next_attempt_at": now + timedelta(seconds=delay),
+                            "error": _("MQTT publish failed, retry %s/%s") % (attempts, max_attempts),
+                        }
+                    )
+
+    @api.model
+    def _log_direct_publish(self, entries, results, sent_ts):
+        """Record commands published outside the outbox so their acks can be matched."""
+        now = fields.Datetime.now()
+        vals_list = []
+        for (device, command, payload), ok in zip(entries, results):
+            if not ok or not payload.get("cid"):
+                continue
+            vals_list.append(
+                {
+                    "device_id": device.id,
+                    "command": command,
+                    "payload": json.dumps(payload, ensure_ascii=False, separators=(",", ":")),
+                    "state": "sent",
+                    "attempts": 1,
+                    "sent_at": now,
+                    "sent_ts": sent_ts,
+                    "correlation_id": payload["cid"],
+                    "firmware_version": device.firmware_version,
+                }
+            )
+        if vals_list:
+            self.sudo().create(vals_list)
+
+    @api.model
+    def _record_ack(self, device, correlation_id, ack_ts):
+        """Stamp the command matching an echoed ``cid``; the first echo wins."""
+        if not device or not correlation_id:
+            return False
+        self.env.cr.execute(
+            """
+            UPDATE iot_device_command
+            SET acked_at = %s,
+                ack_latency_ms = GREATEST(round((%s - sent_ts) * 1000), 0)
+            WHERE correlation_id = %s
+              AND device_id = %s
+              AND acked_at IS NULL
+              AND sent_ts IS NOT NULL
+            """,
+            [
+                datetime.fromtimestamp(ack_ts, tz=timezone.utc).replace(tzinfo=None, microsecond=0),
+                float(ack_ts),
+                str(correlation_id)[:32],
+                device.id,
+            ],
+        )
+        matched = self.env.cr.rowcount > 0
+        if matched:
+            self.invalidate_model(["acked_at", "ack_latency_ms"])
+        return matched
+
+    @api.model
+    def get_ack_latency_stats(self, group_by="device", days=7, device_ids=None, group_ids=None):
+        """Return command-to-ack latency percentiles over the last ``days``.
+
+        ``group_by`` is one of ``device``, ``group`` or ``firmware``. Each row is a
+        dict with ``key``, ``count``, ``p50_ms``, ``p95_ms``, ``p99_ms`` and
+        ``max_ms``.
+        """
+        self.check_access("read")
+        dimensions = {
+            "device": ("cmd.device_id", ""),
+            "group": ("rel.group_id", "JOIN iot_device_group_rel rel ON rel.device_id = cmd.device_id"),
+            "firmware": ("COALESCE(cmd.firmware_version, '')", ""),
+        }
+        if group_by not in dimensions:
+            raise ValueError(f"Unsupported latency dimension: {group_by}")
+        key_sql, join_sql = dimensions[group_by]
+        where = ["cmd.ack_latency_ms IS NOT NULL", "cmd.acked_at >= %s"]
+        params = [fields.Datetime.now() - timedelta(days=max(int(days or 1), 1))]
+        if device_ids is not None:
+            where.append("cmd.device_id = ANY(%s)")
+            params.append(list(device_ids))
+        if group_ids is not None:
+            if group_by != "group":
+                join_sql = "JOIN iot_device_group_rel rel ON rel.device_id = cmd.device_id"
+            where.append("rel.group_id = ANY(%s)")
+            params.append(list(group_ids))
+        self.env.cr.execute(
+            f"""
+            SELECT {key_sql} AS key,
+                   COUNT(*),
+                   percentile_cont(0.50) WITHIN GROUP (ORDER BY cmd.ack_latency_ms),
+                   percentile_cont(0.95) WITHIN GROUP (ORDER BY cmd.ack_latency_ms),
+                   percentile_cont(0.99) WITHIN GROUP (ORDER BY cmd.ack_latency_ms),
+                   MAX(cmd.ack_latency_ms)
+            FROM iot_device_command cmd
+            {join_sql}
+            WHERE {" AND ".join(where)}
+            GROUP BY 1
+            ORDER BY 1
+            """,
+            params,
+        )
+        return [
+            {
+                "key": key,
+                "count": count,
+                "p50_ms": int(round(p50 or 0)),
+                "p95_ms": int(round(p95 or 0)),
+                "p99_ms": int(round(p99 or 0)),
+                "max_ms": int(max_ms or 0),
+            }
+            for key, count, p50, p95, p99, max_ms in self.env.cr.fetchall()
+        ]
+
+    @api.model
+    def _cron_dispatch_commands(self, time_budget_sec=50):
+        concurrency = self._int_param("iot_control_center.command_dispatch_concurrency", 50)
+        deadline = time.monotonic() + max(int(time_budget_sec), 1)
+        while time.monotonic() < deadline:
+            batch = self._claim_batch(concurrency)
+            if not batch:
+                break
+            batch._dispatch()
+            self.env.cr.commit()
+        self.env.cr.execute(
+            "SELECT MIN(next_attempt_at) FROM iot_device_command WHERE state = 'queued' AND next_attempt_at IS NOT NULL"
+        )
+        next_retry = (self.env.cr.fetchone() or [None])[0]
+        if next_retry:
+            cron = self.env.ref("iot_control_center.cron_iot_dispatch_device_commands", raise_if_not_found=False)
+            if cron:
+                cron.sudo()._trigger(max(next_retry, fields.Datetime.now()))
+
+    @api.model
+    def _cron_purge_old_commands(self, batch_size=5000):
+        retention_days = self._int_param("iot_control_center.command_retention_days", 7)
+        cutoff = fields.Datetime.now() - timedelta(days=retention_days)
+        while True:
+            self.env.cr.execute(
+                """
+                WITH doomed AS (
+                    SELECT id
+                    FROM iot_device_command
+                    WHERE state <> 'queued'
+                      AND create_date < %s
+                    ORDER BY id
+                    LIMIT %s
+                )
+                DELETE FROM iot_device_command cmd
+                USING doomed
+                WHERE cmd.id = doomed.id
+                """,
+                [cutoff, int(batch_size)],
+            )
+            deleted = self.env.cr.rowcount
+            # Release each batch's locks instead of holding them for the whole purge.
+            self.env.cr.commit()
+            if deleted < int(batch_size):
+                break
+        self.env.cr.execute(
+            """
+            DELETE FROM iot_device_command_job job
+            WHERE job.create_date < %s
+              AND NOT EXISTS (SELECT 1 FROM iot_device_command cmd WHERE cmd.job_id = job.id)
+            """,
+            [cutoff],
+        )
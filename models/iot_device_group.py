@@ -22,12 +22,26 @@ class IoTDeviceGroup(models.Model):
         domain="[('company_id', '=', company_id), ('active', '=', True)]",
     )
     schedule_ids = fields.One2many("iot.schedule", "group_id", string="Schedules")
+    ack_latency_p50_ms = fields.Integer(string="Ack Latency p50 (ms)", compute="_compute_ack_latency")
+    ack_latency_p95_ms = fields.Integer(string="Ack Latency p95 (ms)", compute="_compute_ack_latency")
+    ack_latency_p99_ms = fields.Integer(string="Ack Latency p99 (ms)", compute="_compute_ack_latency")
+
+    def _compute_ack_latency(self):
+        stats = {}
+        if self.ids:
+            rows = self.env["iot.device.command"].sudo().get_ack_latency_stats("group", group_ids=self.ids)
+            stats = {row["key"]: row for row in rows}
+        for rec in self:
+            row = stats.get(rec.id, {})
+            rec.ack_latency_p50_ms = row.get("p50_ms", 0)
+            rec.ack_latency_p95_ms = row.get("p95_ms", 0)
+            rec.ack_latency_p99_ms = row.get("p99_ms", 0)
 
     def action_turn_on(self):
-        self.mapped("device_ids").action_turn_on()
+        return self.mapped("device_ids").action_turn_on()
 
     def action_turn_off(self):
-        self.mapped("device_ids").action_turn_off()
+        return self.mapped("device_ids").action_turn_off()
 
     def action_sync_schedule(self):
         devices = self.mapped("device_ids")
@@ -0,0 +1,43 @@
+from odoo import api, fields, models
+
+
+class IoTDeviceRuntime(models.Model):
+    _name = "iot.device.runtime"
+    _description = "IoT Relay Device Runtime State"
+    _log_access = False
+
+    # Written on nearly every status message and command; iot.device delegates
+    # these fields here so config edits and telemetry never update the same row.
+    relay_state = fields.Selection(
+        [("unknown", "Unknown"), ("off", "Off"), ("on", "On")],
+        default="unknown",
+        required=True,
+    )
+    last_seen = fields.Datetime()
+    on_since = fields.Datetime()
+    total_on_minutes = fields.Integer(default=0, help="Closed relay on intervals booked in the ledger since the last reset.")
+    delay_active = fields.Boolean(default=False)
+    delay_started_at = fields.Datetime()
+    delay_end_at = fields.Datetime()
+    last_command_at = fields.Datetime()
+    last_command_payload = fields.Text()
+    schedule_applied_version = fields.Integer(default=0)
+    schedule_last_push_at = fields.Datetime()
+    schedule_last_sync_at = fields.Datetime()
+
+    @api.model
+    def init(self):
+        # Free space on every page keeps updates heap-only (HOT); for the same
+        # reason none of these columns is indexed.
+        self.env.cr.execute("ALTER TABLE iot_device_runtime SET (fillfactor = 70)")
+
+    @api.model
+    def _purge_orphans(self):
+        # Rows left behind by raw device deletes or a lost create race.
+        self.env.cr.execute(
+            """
+            DELETE FROM iot_device_runtime rt
+            WHERE NOT EXISTS (SELECT 1 FROM iot_device d WHERE d.runtime_id = rt.id)
+            """
+        )
+        return self.env.cr.rowcount
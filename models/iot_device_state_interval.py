@@ -0,0 +1,96 @@
+from odoo import api, fields, models
+
+
+class IoTDeviceStateInterval(models.Model):
+    _name = "iot.device.state.interval"
+    _description = "IoT Relay On Interval"
+    _order = "started_at desc, id desc"
+    _log_access = False
+
+    # Append-only: one row per closed relay-on interval. The open interval of a
+    # switch that is on right now is its on_since.
+    device_id = fields.Many2one("iot.device", required=True, readonly=True, ondelete="cascade")
+    started_at = fields.Datetime(required=True, readonly=True)
+    ended_at = fields.Datetime(required=True, readonly=True)
+    duration_sec = fields.Integer(string="Duration (sec)", readonly=True)
+
+    @api.model
+    def init(self):
+        self.env.cr.execute(
+            """
+            CREATE INDEX IF NOT EXISTS iot_device_state_interval_device_started_idx
+            ON iot_device_state_interval (device_id, started_at)
+            """
+        )
+
+    @api.model
+    def _record_intervals(self, intervals):
+        """Append ``(device_id, started_at, ended_at)`` intervals and fold them into the daily rollup.
+
+        Both happen in one statement; an interval crossing midnight is split
+        over the UTC days it covers.
+        """
+        intervals = [(device_id, start, end) for device_id, start, end in intervals if start and end and end > start]
+        if not intervals:
+            return
+        device_ids, starts, ends = zip(*intervals)
+        self.env.cr.execute(
+            """
+            WITH added AS (
+                INSERT INTO iot_device_state_interval (device_id, started_at, ended_at, duration_sec)
+                SELECT device_id, started_at, ended_at, EXTRACT(EPOCH FROM ended_at - started_at)::integer
+                FROM unnest(%s::integer[], %s::timestamp[], %s::timestamp[]) AS src(device_id, started_at, ended_at)
+                RETURNING device_id, started_at, ended_at
+            ), split AS (
+                SELECT added.device_id,
+                       day::date AS day,
+                       EXTRACT(EPOCH FROM LEAST(added.ended_at, day + interval '1 day') - GREATEST(added.started_at, day)) AS seconds
+                FROM added
+                CROSS JOIN LATERAL generate_series(date_trunc('day', added.started_at), added.ended_at, interval '1 day') AS day
+            )
+            INSERT INTO iot_device_state_daily (device_id, day, on_seconds, on_hours, interval_count)
+            SELECT device_id, day, SUM(seconds)::integer, round(SUM(seconds) / 3600.0, 2), COUNT(*)
+            FROM split
+            WHERE seconds > 0
+            GROUP BY device_id, day
+            ON CONFLICT (device_id, day) DO UPDATE
+            SET on_seconds = iot_device_state_daily.on_seconds + EXCLUDED.on_seconds,
+                on_hours = round((iot_device_state_daily.on_seconds + EXCLUDED.on_seconds) / 3600.0, 2),
+                interval_count = iot_device_state_daily.interval_count + EXCLUDED.interval_count
+            """,
+            [list(device_ids), list(starts), list(ends)],
+        )
+
+
+class IoTDeviceStateDaily(models.Model):
+    _name = "iot.device.state.daily"
+    _description = "IoT Relay Daily On Time"
+    _order = "day desc, device_id"
+    _log_access = False
+
+    device_id = fields.Many2one("iot.device", required=True, readonly=True, ondelete="cascade")
+    day = fields.Date(required=True, readonly=True, help="UTC day.")
+    on_seconds = fields.Integer(readonly=True)
+    on_hours = fields.Float(readonly=True, digits=(16, 2))
+    interval_count = fields.Integer(readonly=True, help="Closed on intervals that overlap this day.")
+
+    _sql_constraints = [
+        ("iot_device_state_daily_device_day_uniq", "unique(device_id, day)", "One rollup row per switch and day."),
+    ]
+
+    @api.model
+    def get_on_seconds(self, device_ids, date_from, date_to):
+        """Relay on time of closed intervals per device over the UTC days ``date_from``..``date_to``."""
+        if not device_ids:
+            return {}
+        self.env.cr.execute(
+            """
+            SELECT device_id, SUM(on_seconds)
+            FROM iot_device_state_daily
+            WHERE device_id = ANY(%s)
+              AND day BETWEEN %s AND %s
+            GROUP BY device_id
+            """,
+            [list(device_ids), fields.Date.to_date(date_from), fields.Date.to_date(date_to)],
+        )
+        return {device_id: int(seconds or 0) for device_id, seconds in self.env.cr.fetchall()}
@@ -0,0 +1,40 @@
+from odoo import api, fields, models
+
+
+class IoTDeviceTelemetry(models.Model):
+    _name = "iot.device.telemetry"
+    _description = "IoT Device Last Telemetry"
+    _order = "received_at desc"
+    _log_access = False
+
+    # One row per device key, overwritten in place by the last-value telemetry mode.
+    serial_key = fields.Char(required=True, readonly=True)
+    device_id = fields.Many2one("iot.device", readonly=True, index=True, ondelete="cascade")
+    topic = fields.Char(readonly=True)
+    payload = fields.Text(readonly=True)
+    payload_hash = fields.Char(readonly=True)
+    received_at = fields.Datetime(readonly=True)
+    sample_count = fields.Integer(readonly=True, help="Telemetry samples folded into this row.")
+
+    _sql_constraints = [
+        ("iot_device_telemetry_serial_key_uniq", "unique(serial_key)", "Telemetry key must be unique."),
+    ]
+
+    @api.model
+    def _upsert_last_value(self, serial_key, device, topic, payload_text, fingerprint):
+        self.env.cr.execute(
+            """
+            INSERT INTO iot_device_telemetry (serial_key, device_id, topic, payload, payload_hash, received_at, sample_count)
+            VALUES (%s, %s, %s, %s, %s, now() AT TIME ZONE 'UTC', 1)
+            ON CONFLICT (serial_key) DO UPDATE
+            SET device_id = EXCLUDED.device_id,
+                topic = EXCLUDED.topic,
+                payload = EXCLUDED.payload,
+                payload_hash = EXCLUDED.payload_hash,
+                received_at = EXCLUDED.received_at,
+                sample_count = iot_device_telemetry.sample_count + 1
+            RETURNING id
+            """,
+            [serial_key, device.id or None, topic, payload_text, fingerprint],
+        )
+        return self.browse(self.env.cr.fetchone()[0])
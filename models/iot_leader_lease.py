@@ -0,0 +1,18 @@
+from odoo import fields, models
+
+
+class IoTLeaderLease(models.Model):
+    _name = "iot.leader.lease"
+    _description = "IoT Cluster Leader Lease"
+    _order = "role"
+
+    # Rows are maintained by services.leader_election on its own connection.
+    role = fields.Char(required=True, readonly=True)
+    epoch = fields.Integer(readonly=True, help="Fencing token, incremented on every takeover.")
+    holder = fields.Char(readonly=True, help="host:pid of the process holding the role.")
+    acquired_at = fields.Datetime(readonly=True)
+    heartbeat_at = fields.Datetime(readonly=True)
+
+    _sql_constraints = [
+        ("iot_leader_lease_role_uniq", "unique(role)", "Leader role must be unique."),
+    ]
@@ -1,9 +1,28 @@
 import json
+import logging
+import re
+import time
 from datetime import datetime
 from datetime import timedelta
+from datetime import timezone
 
+import psycopg2
 from odoo import api, fields, models
 
+from ..services.dedupe_cache import PayloadFingerprintCache, payload_fingerprint
+from ..services.leader_election import check_lease, exclusive_job
+from ..services.message_listener import CHANNEL as NEW_MESSAGE_CHANNEL
+
+_logger = logging.getLogger(__name__)
+
+PARTITION_DEFAULT = "iot_mqtt_message_pdefault"
+# Pre-partitioning table while its rows are moved over.
+PARTITION_LEGACY = "iot_mqtt_message_legacy"
+PARTITION_NAME_RE = re.compile(r"^iot_mqtt_message_p(\d{8})(\d{2})?$")
+
+# Shared by every writer thread and HTTP worker of this process.
+_fingerprint_cache = PayloadFingerprintCache()
+
 
 class IoTMQTTMessage(models.Model):
     _name = "iot.mqtt.message"
@@ -13,6 +32,7 @@ class IoTMQTTMessage(models.Model):
     state = fields.Selection([("new", "New"), ("done", "Done"), ("error", "Error")], default="new", required=True, index=True)
     topic = fields.Char(required=True, index=True)
     payload = fields.Text(required=True)
+    payload_hash = fields.Char(readonly=True)
     error = fields.Text()
     received_at = fields.Datetime(default=fields.Datetime.now, required=True)
     processed_at = fields.Datetime()
@@ -25,8 +45,19 @@ class IoTMQTTMessage(models.Model):
     )
     device_id = fields.Many2one("iot.device")
 
+    # Parsed once at insert time; processing and fleet queries read these.
+    payload_json = fields.Json(readonly=True)
+    relay_state = fields.Char(readonly=True)
+    firmware_version = fields.Char(readonly=True)
+    schedule_version = fields.Integer(readonly=True)
+    ota_state = fields.Char(readonly=True)
+    module_id = fields.Char(readonly=True)
+    reported_at = fields.Datetime(readonly=True)
+
     @api.model
     def init(self):
+        if self._is_partitioned():
+            self._ensure_partitioned_columns()
         self.env.cr.execute(
             """
             CREATE INDEX IF NOT EXISTS iot_mqtt_message_state_id_idx
@@ -51,6 +82,79 @@ class IoTMQTTMessage(models.Model):
             ON iot_mqtt_message (lower(device_serial), message_type, topic, received_at DESC, id DESC)
             """
         )
+        self.env.cr.execute(
+            """
+            CREATE INDEX IF NOT EXISTS iot_mqtt_message_dedupe_hash_idx
+            ON iot_mqtt_message (lower(device_serial), message_type, topic, payload_hash, id DESC)
+            WHERE payload_hash IS NOT NULL
+            """
+        )
+        self.env.cr.execute(
+            """
+            CREATE INDEX IF NOT EXISTS iot_mqtt_message_firmware_version_idx
+            ON iot_mqtt_message (firmware_version, lower(device_serial))
+            WHERE firmware_version IS NOT NULL
+            """
+        )
+        self._backfill_payload_fields()
+
+    @api.model
+    def _backfill_payload_fields(self, batch_size=1000):
+        """Store the parsed payload of queued rows written before it was stored parsed."""
+        cr = self.env.cr
+        last_id = 0
+        while True:
+            cr.execute(
+                """
+                SELECT id, payload
+                FROM iot_mqtt_message
+                WHERE payload_json IS NULL
+                  AND state IN ('new', 'error')
+                  AND id > %s
+                ORDER BY id
+                LIMIT %s
+                """,
+                [last_id, batch_size],
+            )
+            rows = cr.fetchall()
+            if not rows:
+                return
+            last_id = rows[-1][0]
+            for msg_id, payload_text in rows:
+                extracted = self._extract_payload_fields(payload_text)
+                column = {key: None if value is False else value for key, value in extracted.items()}
+                cr.execute(
+                    """
+                    UPDATE iot_mqtt_message
+                    SET payload_json = %s::jsonb,
+                        relay_state = COALESCE(relay_state, %s),
+                        firmware_version = COALESCE(firmware_version, %s),
+                        schedule_version = COALESCE(schedule_version, %s),
+                        ota_state = COALESCE(ota_state, %s),
+                        module_id = COALESCE(module_id, %s),
+                        reported_at = COALESCE(reported_at, %s)
+                    WHERE id = %s
+                    """,
+                    [
+                        json.dumps(column["payload_json"]),
+                        column["relay_state"],
+                        column["firmware_version"],
+                        column["schedule_version"],
+                        column["ota_state"],
+                        column["module_id"],
+                        column["reported_at"],
+                        msg_id,
+                    ],
+                )
+
+    @api.model
+    def _ensure_partitioned_columns(self):
+        # Odoo does not manage the schema of a partitioned table; add new stored
+        # fields by hand so upgrades keep working.
+        for name, field in self._fields.items():
+            if not field.store or not field.column_type:
+                continue
+            self.env.cr.execute(f'ALTER TABLE iot_mqtt_message ADD COLUMN IF NOT EXISTS "{name}" {field.column_type[1]}')
 
     @api.model
     def _normalize_device_key(self, value):
@@ -76,7 +180,122 @@ class IoTMQTTMessage(models.Model):
             return 60
 
     @api.model
-    def _find_recent_duplicate(self, serial_key, message_type, topic, payload_text, now_value):
+    def _telemetry_mode(self):
+        mode = self.env["ir.config_parameter"].sudo().get_param("iot_control_center.mqtt_telemetry_mode", "queue")
+        return mode if mode in ("queue", "last_value") else "queue"
+
+    @api.model
+    def _fingerprint_cache_size(self):
+        raw = self.env["ir.config_parameter"].sudo().get_param("iot_control_center.mqtt_dedupe_cache_size", "10000")
+        try:
+            return max(int(raw or 10000), 100)
+        except Exception:
+            return 10000
+
+    @api.model
+    def _remember_fingerprint_after_commit(self, cache_key, fingerprint, msg_id, seen_at):
+        # Only cache rows that are durable; a rolled back id must never be reused.
+        size = self._fingerprint_cache_size()
+        self.env.cr.postcommit.add(
+            lambda: (_fingerprint_cache.resize(size), _fingerprint_cache.remember(cache_key, fingerprint, msg_id, seen_at))
+        )
+
+    @api.model
+    def _notify_new_message(self):
+        # Delivered on commit; Postgres folds identical notifications of one
+        # transaction, so a batch wakes the listener once.
+        if self.env.context.get("iot_mqtt_inline_processing"):
+            return
+        self.env.cr.execute("SELECT pg_notify(%s, %s)", [NEW_MESSAGE_CHANNEL, ""])
+
+    @api.model
+    def _find_cached_duplicate(self, cache_key, message_type, topic, payload_text, fingerprint, now_ts):
+        """Resolve duplicates and telemetry slots from the process-local cache.
+
+        A duplicate inside the window is dropped in memory and returns an empty
+        recordset: its row is queued or processed already. Returns the rewritten
+        telemetry slot, or None when the database has to decide.
+        """
+        entry = _fingerprint_cache.get(cache_key)
+        if entry is None:
+            return None
+        cached_hash, seen_at, msg_id, synced_at = entry
+        age = now_ts - seen_at
+        window = self._dedupe_window_seconds(message_type)
+        if cached_hash == fingerprint and age <= window:
+            if now_ts - synced_at < window:
+                _fingerprint_cache.touch(cache_key, now_ts)
+                return self.browse()
+            # Once per window, carry the sliding window over to received_at so
+            # the database lookup still matches after eviction. The row may
+            # have been purged or failed meanwhile; then the database decides.
+            self.env.cr.execute(
+                """
+                UPDATE iot_mqtt_message
+                SET received_at = %s
+                WHERE id = %s
+                  AND topic = %s
+                  AND payload_hash = %s
+                RETURNING state
+                """,
+                [fields.Datetime.now(), msg_id, topic, fingerprint],
+            )
+            row = self.env.cr.fetchone()
+            if not row or row[0] == "error":
+                _fingerprint_cache.forget(cache_key)
+                return None
+            self.invalidate_model(["received_at"])
+            _fingerprint_cache.touch(cache_key, now_ts, synced=True)
+            return self.browse()
+        if message_type == "telemetry" and age <= self._telemetry_sample_window_seconds():
+            extracted = self._extract_payload_fields(payload_text)
+            column = {key: None if value is False else value for key, value in extracted.items()}
+            self.env.cr.execute(
+                """
+                UPDATE iot_mqtt_message
+                SET payload = %s,
+                    payload_hash = %s,
+                    payload_json = %s::jsonb,
+                    relay_state = %s,
+                    firmware_version = %s,
+                    schedule_version = %s,
+                    ota_state = %s,
+                    module_id = %s,
+                    reported_at = %s,
+                    received_at = %s,
+                    state = 'new',
+                    processed_at = NULL,
+                    error = NULL,
+                    write_date = now() AT TIME ZONE 'UTC'
+                WHERE id = %s
+                  AND topic = %s
+                RETURNING id
+                """,
+                [
+                    payload_text,
+                    fingerprint,
+                    json.dumps(column["payload_json"]),
+                    column["relay_state"],
+                    column["firmware_version"],
+                    column["schedule_version"],
+                    column["ota_state"],
+                    column["module_id"],
+                    column["reported_at"],
+                    fields.Datetime.now(),
+                    msg_id,
+                    topic,
+                ],
+            )
+            if self.env.cr.fetchone():
+                self.invalidate_model(["payload", "payload_hash", "received_at", "state", "processed_at", "error"] + list(extracted))
+                self._remember_fingerprint_after_commit(cache_key, fingerprint, msg_id, now_ts)
+                self._notify_new_message()
+                return self.browse(msg_id)
+            _fingerprint_cache.forget(cache_key)
+        return None
+
+    @api.model
+    def _find_recent_duplicate(self, serial_key, message_type, topic, payload_text, now_value, fingerprint=None):
         if not serial_key or not self._is_noise_prone_message_type(message_type):
             return self.browse()
         self.env.cr.execute(
@@ -86,7 +305,7 @@ class IoTMQTTMessage(models.Model):
             WHERE lower(device_serial) = %s
               AND message_type = %s
               AND topic = %s
-              AND payload = %s
+              AND payload_hash = %s
               AND (
                     state = 'new'
                     OR (
@@ -101,7 +320,7 @@ class IoTMQTTMessage(models.Model):
                 serial_key,
                 message_type,
                 topic,
-                payload_text,
+                fingerprint or payload_fingerprint(payload_text),
                 now_value - timedelta(seconds=self._dedupe_window_seconds(message_type)),
             ],
         )
@@ -134,45 +353,8 @@ class IoTMQTTMessage(models.Model):
 
     @api.model
     def _find_or_create_device_by_key(self, key):
-        key = self._normalize_device_key(key)
-        if not key:
-            return self.env["iot.device"].browse()
         device_model = self.env["iot.device"].sudo()
-        no_track_ctx = device_model._system_no_track_context()
-        device_model = device_model.with_context(**no_track_ctx)
-
-        # Prefer exact serial match over module_id match to avoid route ambiguity
-        # when legacy rows still carry old serial values.
-        device = device_model.search(
-            [("serial", "=ilike", key)],
-            order="company_id desc, last_seen desc, id desc",
-            limit=1,
-        )
-        if not device:
-            device = device_model.search(
-                [("module_id", "=ilike", key)],
-                order="company_id desc, last_seen desc, id desc",
-                limit=1,
-            )
-        if device:
-            return device
-
-        # Serialize create-per-key to avoid duplicate rows under concurrent cron workers.
-        self.env.cr.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", [f"iot.device:{key}"])
-        device = device_model.search(
-            [("serial", "=ilike", key)],
-            order="company_id desc, last_seen desc, id desc",
-            limit=1,
-        )
-        if not device:
-            device = device_model.search(
-                [("module_id", "=ilike", key)],
-                order="company_id desc, last_seen desc, id desc",
-                limit=1,
-            )
-        if device:
-            return device
-        return device_model.create({"name": key, "serial": key})
+        return device_model.with_context(**device_model._system_no_track_context())._upsert_by_key(key)
 
     @api.model
     def create_from_mqtt(self, topic, payload_text):
@@ -183,47 +365,142 @@ class IoTMQTTMessage(models.Model):
             serial = parts[-2]
             msg_type = parts[-1] if parts[-1] in ("status", "telemetry") else "unknown"
         serial_key = self._normalize_device_key(serial)
+        fingerprint = payload_fingerprint(payload_text)
+        if msg_type == "telemetry" and serial_key and self._telemetry_mode() == "last_value":
+            return self._ingest_last_value_telemetry(serial_key, topic, payload_text, fingerprint)
+        cache_key = None
         if serial_key and self._is_noise_prone_message_type(msg_type):
+            cache_key = (self.env.cr.dbname, serial_key, msg_type, topic)
+            now_ts = time.time()
+            cached = self._find_cached_duplicate(cache_key, msg_type, topic, payload_text, fingerprint, now_ts)
+            if cached is not None:
+                return cached
             self.env.cr.execute(
                 "SELECT pg_advisory_xact_lock(hashtext(%s))",
                 [f"iot.mqtt.message:{serial_key}:{msg_type}"],
             )
             now_value = fields.Datetime.now()
-            duplicate = self._find_recent_duplicate(serial_key, msg_type, topic, payload_text, now_value)
+            duplicate = self._find_recent_duplicate(serial_key, msg_type, topic, payload_text, now_value, fingerprint)
             if duplicate:
                 duplicate.sudo().write({"received_at": now_value})
-                return duplicate
+                self._remember_fingerprint_after_commit(cache_key, fingerprint, duplicate.id, now_ts)
+                return duplicate.filtered(lambda msg: msg.state == "new")
             if msg_type == "telemetry":
                 slot = self._find_recent_telemetry_slot(serial_key, topic, now_value)
                 if slot:
                     slot.sudo().write(
                         {
                             "payload": payload_text,
+                            "payload_hash": fingerprint,
                             "received_at": now_value,
                             "state": "new",
                             "processed_at": False,
                             "error": False,
+                            **self._extract_payload_fields(payload_text),
                         }
                     )
+                    self._remember_fingerprint_after_commit(cache_key, fingerprint, slot.id, now_ts)
+                    self._notify_new_message()
                     return slot
         vals = {
             "topic": topic,
             "payload": payload_text,
+            "payload_hash": fingerprint,
             "device_serial": serial,
             "message_type": msg_type,
+            **self._extract_payload_fields(payload_text),
         }
-        return self.sudo().create(vals)
+        msg = self.sudo().create(vals)
+        if cache_key:
+            self._remember_fingerprint_after_commit(cache_key, fingerprint, msg.id, now_ts)
+        self._notify_new_message()
+        return msg
 
     def _parse_payload(self):
         self.ensure_one()
+        # The ORM reads a NULL column as False: rows queued before payloads were
+        # stored parsed, or whose payload parsed to nothing, are parsed again.
+        if isinstance(self.payload_json, (dict, list)):
+            return self.payload_json
+        return self._parse_payload_text(self.payload)
+
+    @api.model
+    def _extract_payload_fields(self, payload_text):
+        """Parsed payload and its hot fields, as column values for the queue row."""
+        payload = self._parse_payload_text(payload_text)
+        data = payload if isinstance(payload, dict) else {}
+
+        def _text(key):
+            value = data.get(key)
+            return str(value)[:64] if value not in (None, "", False) else False
+
+        try:
+            schedule_version = int(data["schedule_version"]) if data.get("schedule_version") is not None else False
+        except Exception:
+            schedule_version = False
+        reported_at = False
+        if data.get("reported_at"):
+            try:
+                reported_at = datetime.fromisoformat(str(data["reported_at"]).replace("Z", "+00:00")).replace(tzinfo=None)
+            except Exception:
+                reported_at = False
+        return {
+            "payload_json": payload,
+            "relay_state": _text("state"),
+            "firmware_version": _text("firmware_version"),
+            "schedule_version": schedule_version,
+            "ota_state": _text("ota_state"),
+            "module_id": _text("module_id"),
+            "reported_at": reported_at,
+        }
+
+    @api.model
+    def _parse_payload_text(self, payload_text):
         try:
-            return json.loads(self.payload)
+            return json.loads(payload_text)
         except Exception:
-            v = (self.payload or "").strip().lower()
+            v = (payload_text or "").strip().lower()
             if v in ("on", "off"):
                 return {"state": v}
             return {}
 
+    @api.model
+    def _ingest_last_value_telemetry(self, serial_key, topic, payload_text, fingerprint):
+        """Apply telemetry from memory and keep only its last value per device.
+
+        No queue row is written; the sample overwrites the device's row in
+        ``iot.device.telemetry``. A sample that fails to apply is queued as an
+        ``error`` message so it stays visible.
+        """
+        try:
+            with self.env.cr.savepoint():
+                device = self._find_or_create_device_by_key(serial_key)
+                self.env["iot.device.telemetry"].sudo()._upsert_last_value(serial_key, device, topic, payload_text, fingerprint)
+                payload = self._parse_payload_text(payload_text)
+                cid = payload.get("cid") if isinstance(payload, dict) else None
+                if cid:
+                    self.env["iot.device.command"].sudo()._record_ack(device, cid, time.time())
+                device._apply_reports(
+                    [(payload, self._parse_reported_at(payload))],
+                    last_seen_step_sec=self._dedupe_window_seconds("telemetry"),
+                )
+        except psycopg2.errors.SerializationFailure:
+            raise
+        except Exception as exc:
+            self.sudo().create(
+                {
+                    "topic": topic,
+                    "payload": payload_text,
+                    "payload_hash": fingerprint,
+                    "device_serial": serial_key,
+                    "message_type": "telemetry",
+                    "state": "error",
+                    "error": str(exc),
+                    "processed_at": fields.Datetime.now(),
+                }
+            )
+        return self.browse()
+
     def _parse_reported_at(self, payload):
         value = payload.get("reported_at") if isinstance(payload, dict) else None
         if not value:
@@ -233,46 +510,77 @@ class IoTMQTTMessage(models.Model):
         except Exception:
             return fields.Datetime.now()
 
+    def _record_command_ack(self, device, payload, ack_ts=None):
+        self.ensure_one()
+        cid = payload.get("cid") if isinstance(payload, dict) else None
+        if not cid or not device:
+            return False
+        # The MQTT writer passes the broker delivery time; rows processed later by the
+        # queue workers fall back to their (second precision) receive time.
+        if not ack_ts:
+            ack_ts = self.received_at.replace(tzinfo=timezone.utc).timestamp()
+        return self.env["iot.device.command"].sudo()._record_ack(device, cid, ack_ts)
+
     def _process_one(self, preloaded_device=None):
         self.ensure_one()
-        payload = self._parse_payload()
-        device_model = self.env["iot.device"]
-        no_track_ctx = device_model._system_no_track_context()
-        device = preloaded_device or device_model.browse()
-        if not device and self.device_serial:
-            device = self._find_or_create_device_by_key(self.device_serial)
-        done_vals = {
-            "state": "done",
-            "processed_at": fields.Datetime.now(),
-        }
-        if device:
-            done_vals["device_id"] = device.id
-            device = device.with_context(**no_track_ctx)
-            state = payload.get("state") if isinstance(payload, dict) else None
-            ota_state = payload.get("ota_state") if isinstance(payload, dict) else None
-            ota_note = payload.get("ota_note") if isinstance(payload, dict) else None
-            reported_at = self._parse_reported_at(payload)
-            if state in ("on", "off", "unknown"):
-                device.apply_state_report(state, reported_at=reported_at)
+        device_map = None
+        if preloaded_device:
+            device_map = {self._normalize_device_key(self.device_serial): preloaded_device}
+        return self._process_messages(device_map=device_map)
+
+    def _process_messages(self, device_map=None, received_ts=None):
+        """Apply queued messages with one reduced device write per device.
+
+        Messages of a device are folded in id order, so intermediate reports (an
+        on/off flap, a delay start) still count, but the device row is updated
+        once. A failing device only marks its own messages as errors.
+        """
+        no_track_ctx = self.env["iot.device"]._system_no_track_context()
+        received_ts = received_ts or {}
+        if device_map is None:
+            device_map = self._preload_devices(self.mapped("device_serial"))
+        now = fields.Datetime.now()
+        groups = {}
+        orphans = self.browse()
+        for msg in self.sorted("id"):
+            key = self._normalize_device_key(msg.device_serial)
+            device = device_map.get(key) if key else None
+            if device:
+                groups.setdefault(device.id, (device, []))[1].append(msg)
             else:
-                device.last_seen = fields.Datetime.now()
-
-            fw = payload.get("firmware_version") if isinstance(payload, dict) else None
-            if fw:
-                device.apply_firmware_report(fw, reported_at=reported_at, ota_state=ota_state)
-            module_id = payload.get("module_id") if isinstance(payload, dict) else None
-            if module_id:
-                device.apply_identity_report(str(module_id), reported_at=reported_at)
-            if isinstance(payload, dict) and "manual_override" in payload:
-                device.apply_manual_override_report(payload, reported_at=reported_at)
-            if isinstance(payload, dict) and "delay_active" in payload:
-                device.apply_delay_report(payload, reported_at=reported_at)
-            if ota_state:
-                device.apply_firmware_upgrade_feedback(ota_state, note=ota_note, reported_at=reported_at)
-            if isinstance(payload, dict) and "schedule_version" in payload:
-                device.apply_schedule_report(payload, reported_at=reported_at)
-
-        self.with_context(**no_track_ctx).write(done_vals)
+                orphans |= msg
+        if orphans:
+            orphans.with_context(**no_track_ctx).write({"state": "done", "processed_at": now})
+        for device, msgs in groups.values():
+            batch = self.browse([msg.id for msg in msgs]).with_context(**no_track_ctx)
+            device = device.with_context(**no_track_ctx)
+            try:
+                with self.env.cr.savepoint():
+                    reports = []
+                    for msg in msgs:
+                        payload = msg._parse_payload()
+                        msg._record_command_ack(device, payload, ack_ts=received_ts.get(msg.id))
+                        reports.append((payload, msg.reported_at or msg._parse_reported_at(payload)))
+                    device._apply_reports(reports)
+                    batch.write({"state": "done", "processed_at": now, "device_id": device.id})
+            except psycopg2.errors.SerializationFailure:
+                raise
+            except Exception as exc:
+                batch.write({"state": "error", "error": str(exc), "processed_at": now})
+                batch._forget_fingerprints_after_commit()
+        return len(self)
+
+    def _forget_fingerprints_after_commit(self):
+        # A failed message must be retried by its next duplicate, as the
+        # database lookup does; other processes notice on their next write-back.
+        dbname = self.env.cr.dbname
+        keys = {
+            (dbname, self._normalize_device_key(msg.device_serial), msg.message_type, msg.topic)
+            for msg in self
+            if msg.device_serial and self._is_noise_prone_message_type(msg.message_type)
+        }
+        if keys:
+            self.env.cr.postcommit.add(lambda: _fingerprint_cache.forget_many(keys))
 
     @api.model
     def _preload_devices(self, serials):
@@ -284,37 +592,24 @@ class IoTMQTTMessage(models.Model):
         no_track_ctx = device_model._system_no_track_context()
         device_model = device_model.with_context(**no_track_ctx)
 
-        devices = self.env["iot.device"].browse()
-        try:
-            self.env.cr.execute(
-                """
-                SELECT id
-                FROM iot_device
-                WHERE lower(serial) = ANY(%s)
-                   OR lower(module_id) = ANY(%s)
-                """,
-                (list(key_set), list(key_set)),
-            )
-            devices = device_model.browse([row[0] for row in self.env.cr.fetchall()])
-        except Exception:
-            devices = self.env["iot.device"].browse()
-            for key in key_set:
-                dev = device_model.search(
-                    ["|", ("serial", "=ilike", key), ("module_id", "=ilike", key)],
-                    order="last_seen desc, id desc",
-                    limit=1,
-                )
-                devices |= dev
+        self.env.cr.execute(
+            """
+            SELECT id
+            FROM iot_device
+            WHERE serial_key = ANY(%s)
+               OR module_key = ANY(%s)
+            """,
+            (list(key_set), list(key_set)),
+        )
+        devices = device_model.browse([row[0] for row in self.env.cr.fetchall()])
 
         serial_map = {}
         module_map = {}
         for dev in devices:
-            serial_key = self._normalize_device_key(dev.serial)
-            module_key = self._normalize_device_key(dev.module_id)
-            if serial_key and serial_key in key_set and serial_key not in serial_map:
-                serial_map[serial_key] = dev
-            if module_key and module_key in key_set and module_key not in module_map:
-                module_map[module_key] = dev
+            if dev.serial_key in key_set:
+                serial_map[dev.serial_key] = dev
+            if dev.module_key in key_set:
+                module_map[dev.module_key] = dev
 
         device_map = {}
         for key in key_set:
@@ -328,54 +623,149 @@ class IoTMQTTMessage(models.Model):
                 device_map[key] = dev
         return device_map
 
+    @api.model
+    def _processing_config(self):
+        icp = self.env["ir.config_parameter"].sudo()
+        try:
+            workers = min(max(int(icp.get_param("iot_control_center.mqtt_process_workers", "4") or 4), 1), 64)
+        except Exception:
+            workers = 4
+        try:
+            budget = max(float(icp.get_param("iot_control_center.mqtt_process_time_budget_sec", "50") or 50), 1.0)
+        except Exception:
+            budget = 50.0
+        return {"workers": workers, "time_budget_sec": budget}
+
+    @api.model
+    def _shard_sql(self):
+        # Masked rather than abs(): abs(hashtext()) overflows for -2^31.
+        return "(hashtext(lower(coalesce(device_serial, ''))) & 2147483647) %% %s"
+
     @api.model
     def _cron_process_new_messages(self, limit=500):
-        no_track_ctx = self.env["iot.device"]._system_no_track_context()
-        messages = self.with_context(**no_track_ctx).search(
-            [("state", "=", "new")],
-            limit=limit,
-            order="id asc",
+        config = self._processing_config()
+        deadline = time.monotonic() + config["time_budget_sec"]
+        backlog = False
+        for shard in range(config["workers"]):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                backlog = True
+                break
+            status, _processed = self._process_shard(shard, config["workers"], limit=limit, time_budget_sec=remaining)
+            backlog = backlog or status == "budget"
+        stats = self.get_backlog_stats(config["workers"])
+        if stats["oldest_lag_sec"] > 60:
+            _logger.warning(
+                "IoT MQTT backlog: %s new message(s), oldest %.0fs behind, %s shard(s)",
+                stats["total"],
+                stats["oldest_lag_sec"],
+                config["workers"],
+            )
+        if backlog:
+            # Run again right away instead of waiting for the next interval.
+            self.env.ref("iot_control_center.cron_iot_process_mqtt_messages")._trigger()
+
+    @api.model
+    def _process_shard(self, shard, shards, limit=500, time_budget_sec=50.0, lease=None):
+        """Drain one shard until it is empty or the time budget is spent.
+
+        Returns ``(status, processed)`` where status is ``"busy"`` when another
+        worker owns the shard, ``"budget"`` when it stopped on the deadline with
+        rows left, and ``"done"`` otherwise. ``lease`` is the ``(role, epoch)``
+        of an elected caller; every batch transaction is fenced on it.
+        """
+        deadline = time.monotonic() + time_budget_sec
+        processed = 0
+        with exclusive_job(self.env, f"mqtt_process_shard:{shard}") as acquired:
+            if not acquired:
+                return "busy", 0
+            while True:
+                if lease:
+                    check_lease(self.env.cr, *lease)
+                count = self._process_new_messages(limit=limit, shard=shard, shards=shards)
+                self.env.cr.commit()
+                processed += count
+                if count < limit:
+                    return "done", processed
+                if time.monotonic() >= deadline:
+                    return "budget", processed
+
+    @api.model
+    def _claim_new_messages(self, limit, shard=None, shards=1):
+        where = ["state = 'new'"]
+        params = []
+        if shards > 1 and shard is not None:
+            where.append(f"{self._shard_sql()} = %s")
+            params += [shards, shard]
+        self.env.cr.execute(
+            f"""
+            SELECT id
+            FROM iot_mqtt_message
+            WHERE {" AND ".join(where)}
+            ORDER BY id
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+            """,
+            params + [limit],
         )
-        if not messages:
-            return
+        return self.browse([row[0] for row in self.env.cr.fetchall()])
 
-        # Keep only the latest message per (device_serial, message_type) in this batch.
-        # Older duplicates are marked as done directly to reduce write amplification.
-        latest_by_key = {}
-        for msg in messages:
-            serial_key = (msg.device_serial or "").strip().lower()
-            if serial_key:
-                key = (serial_key, msg.message_type or "unknown")
-            else:
-                key = (f"__msg_{msg.id}", msg.message_type or "unknown")
-            latest_by_key[key] = msg
+    @api.model
+    def get_backlog_stats(self, shards=None):
+        """Queue depth and age of the oldest ``new`` row, overall and per shard."""
+        shards = shards or self._processing_config()["workers"]
+        self.env.cr.execute(
+            f"""
+            SELECT {self._shard_sql()} AS shard,
+                   count(*),
+                   EXTRACT(EPOCH FROM (now() AT TIME ZONE 'UTC') - min(received_at))
+            FROM iot_mqtt_message
+            WHERE state = 'new'
+            GROUP BY 1
+            ORDER BY 1
+            """,
+            [shards],
+        )
+        per_shard = [
+            {"shard": shard, "count": count, "oldest_lag_sec": float(lag or 0.0)}
+            for shard, count, lag in self.env.cr.fetchall()
+        ]
+        return {
+            "shards": shards,
+            "total": sum(row["count"] for row in per_shard),
+            "oldest_lag_sec": max((row["oldest_lag_sec"] for row in per_shard), default=0.0),
+            "per_shard": per_shard,
+        }
 
-        selected = self.browse([m.id for m in latest_by_key.values()])
-        skipped = messages - selected
-        if skipped:
-            skipped.with_context(**no_track_ctx).write(
-                {
-                    "state": "done",
-                    "processed_at": fields.Datetime.now(),
-                }
-            )
-        serials = selected.mapped("device_serial")
-        device_map = self._preload_devices(serials)
-        for msg in selected:
-            try:
-                key = self._normalize_device_key(msg.device_serial)
-                msg._process_one(preloaded_device=device_map.get(key))
-            except Exception as exc:
-                msg.with_context(**no_track_ctx).write(
-                    {
-                        "state": "error",
-                        "error": str(exc),
-                        "processed_at": fields.Datetime.now(),
-                    }
-                )
+    @api.model
+    def _process_new_messages(self, limit=500, shard=None, shards=1):
+        no_track_ctx = self.env["iot.device"]._system_no_track_context()
+        # Rows stay locked until the caller commits; other shard workers and the
+        # sweep skip them instead of queueing behind.
+        messages = self.with_context(**no_track_ctx)._claim_new_messages(limit, shard=shard, shards=shards)
+        if not messages:
+            return 0
+        return messages._process_messages()
 
     @api.model
-    def _delete_in_batches(self, where_sql, params, batch_size):
+    def get_reported_firmware_counts(self, hours=24):
+        """Devices per reported firmware version over the last ``hours``, from the hot column."""
+        since = fields.Datetime.now() - timedelta(hours=max(int(hours or 24), 1))
+        self.env.cr.execute(
+            """
+            SELECT firmware_version, count(DISTINCT lower(device_serial))
+            FROM iot_mqtt_message
+            WHERE firmware_version IS NOT NULL
+              AND received_at >= %s
+            GROUP BY firmware_version
+            ORDER BY 2 DESC, 1
+            """,
+            [since],
+        )
+        return [{"firmware_version": version, "devices": count} for version, count in self.env.cr.fetchall()]
+
+    @api.model
+    def _delete_in_batches(self, where_sql, params, batch_size, table="iot_mqtt_message"):
         batch_size = max(int(batch_size or 5000), 100)
         total_deleted = 0
         while True:
@@ -383,12 +773,12 @@ class IoTMQTTMessage(models.Model):
                 f"""
                 WITH doomed AS (
                     SELECT id
-                    FROM iot_mqtt_message
+                    FROM {table}
                     WHERE {where_sql}
                     ORDER BY id
                     LIMIT %s
                 )
-                DELETE FROM iot_mqtt_message msg
+                DELETE FROM {table} msg
                 USING doomed
                 WHERE msg.id = doomed.id
                 """,
@@ -421,8 +811,234 @@ class IoTMQTTMessage(models.Model):
             [telemetry_cutoff],
             batch_size,
         )
+        if self._is_partitioned():
+            # Whole partitions go at once; only the catch-all partition is trimmed row by row.
+            self._drop_expired_partitions(cutoff)
+            self._delete_in_batches("received_at < %s", [cutoff], batch_size, table=PARTITION_DEFAULT)
+            return
         self._delete_in_batches(
             "received_at < %s",
             [cutoff],
             batch_size,
         )
+
+    # -- partitioning -------------------------------------------------------------------
+
+    @api.model
+    def _partition_config(self):
+        icp = self.env["ir.config_parameter"].sudo()
+        granularity = icp.get_param("iot_control_center.mqtt_message_partition_granularity", "day")
+        try:
+            ahead = min(max(int(icp.get_param("iot_control_center.mqtt_message_partitions_ahead", "3") or 3), 1), 72)
+        except Exception:
+            ahead = 3
+        return {
+            "enabled": str(icp.get_param("iot_control_center.mqtt_message_partitioning", "False")).lower() in ("1", "true", "yes"),
+            "granularity": granularity if granularity in ("day", "hour") else "day",
+            "ahead": ahead,
+        }
+
+    @api.model
+    def _is_partitioned(self):
+        self.env.cr.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass('iot_mqtt_message')")
+        row = self.env.cr.fetchone()
+        return bool(row and row[0] == "p")
+
+    @api.model
+    def _partition_range(self, at, granularity):
+        """``(name, lower, upper)`` of the partition holding ``at``."""
+        if granularity == "hour":
+            lower = at.replace(minute=0, second=0, microsecond=0)
+            return f"iot_mqtt_message_p{lower:%Y%m%d%H}", lower, lower + timedelta(hours=1)
+        lower = at.replace(hour=0, minute=0, second=0, microsecond=0)
+        return f"iot_mqtt_message_p{lower:%Y%m%d}", lower, lower + timedelta(days=1)
+
+    @api.model
+    def _list_partitions(self):
+        """``{name: upper_bound}`` of the time partitions, parsed from their names."""
+        self.env.cr.execute(
+            """
+            SELECT c.relname
+            FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = 'iot_mqtt_message'::regclass
+            """
+        )
+        out = {}
+        for (name,) in self.env.cr.fetchall():
+            match = PARTITION_NAME_RE.match(name)
+            if not match:
+                continue
+            if match.group(2):
+                out[name] = datetime.strptime(match.group(1) + match.group(2), "%Y%m%d%H") + timedelta(hours=1)
+            else:
+                out[name] = datetime.strptime(match.group(1), "%Y%m%d") + timedelta(days=1)
+        return out
+
+    @api.model
+    def _ensure_partitions(self, start, end, granularity):
+        """Create the partitions covering ``[start, end]``; returns how many were added."""
+        existing = self._list_partitions()
+        created = 0
+        at = start
+        while at <= end:
+            name, lower, upper = self._partition_range(at, granularity)
+            at = upper
+            if name in existing:
+                continue
+            try:
+                with self.env.cr.savepoint():
+                    self.env.cr.execute(
+                        f"""
+                        CREATE TABLE {name}
+                        PARTITION OF iot_mqtt_message
+                        FOR VALUES FROM (%s) TO (%s)
+                        """,
+                        [lower, upper],
+                    )
+                created += 1
+            except psycopg2.Error as exc:
+                # Overlaps a partition of the other granularity, or rows for this
+                # range already sit in the default partition.
+                _logger.info("IoT MQTT partition %s skipped: %s", name, exc)
+        return created
+
+    @api.model
+    def _drop_expired_partitions(self, cutoff):
+        dropped = []
+        for name, upper in sorted(self._list_partitions().items(), key=lambda item: item[1]):
+            if upper <= cutoff:
+                self.env.cr.execute(f"DROP TABLE IF EXISTS {name}")
+                dropped.append(name)
+        if dropped:
+            _logger.info("IoT MQTT message partitions dropped: %s", ", ".join(dropped))
+        return dropped
+
+    @api.model
+    def _convert_to_partitioned(self, granularity):
+        """Swap in an empty ``iot_mqtt_message`` partitioned by ``received_at``.
+
+        Only metadata changes happen under the exclusive lock: the table is
+        renamed to ``PARTITION_LEGACY``, and columns, defaults, foreign keys and
+        the id sequence carry over to the new parent. ``init()`` recreates the
+        indexes on it, which Postgres cascades to every partition. The primary
+        key becomes ``(id, received_at)`` because it must contain the partition
+        key. The rows follow with ``_move_legacy_messages``.
+        """
+        cr = self.env.cr
+        cr.execute("LOCK TABLE iot_mqtt_message IN ACCESS EXCLUSIVE MODE")
+        if self._is_partitioned():
+            return False
+        cr.execute("SELECT min(received_at) FROM iot_mqtt_message")
+        oldest = cr.fetchone()[0] or fields.Datetime.now()
+        cr.execute(
+            """
+            SELECT conname, pg_get_constraintdef(oid)
+            FROM pg_constraint
+            WHERE conrelid = 'iot_mqtt_message'::regclass AND contype = 'f'
+            """
+        )
+        foreign_keys = cr.fetchall()
+        cr.execute(f"ALTER TABLE iot_mqtt_message RENAME TO {PARTITION_LEGACY}")
+        cr.execute(f"ALTER TABLE {PARTITION_LEGACY} RENAME CONSTRAINT iot_mqtt_message_pkey TO {PARTITION_LEGACY}_pkey")
+        for name, _definition in foreign_keys:
+            cr.execute(f"ALTER TABLE {PARTITION_LEGACY} DROP CONSTRAINT {name}")
+        # Free the index names for init(); draining only needs the primary key.
+        cr.execute(
+            "SELECT indexrelid::regclass::text FROM pg_index WHERE indrelid = %s::regclass AND NOT indisprimary",
+            [PARTITION_LEGACY],
+        )
+        for (index_name,) in cr.fetchall():
+            cr.execute(f"DROP INDEX {index_name}")
+        cr.execute(
+            f"""
+            CREATE TABLE iot_mqtt_message (
+                LIKE {PARTITION_LEGACY} INCLUDING DEFAULTS INCLUDING CONSTRAINTS INCLUDING STORAGE INCLUDING COMMENTS
+            ) PARTITION BY RANGE (received_at)
+            """
+        )
+        cr.execute("ALTER TABLE iot_mqtt_message ADD CONSTRAINT iot_mqtt_message_pkey PRIMARY KEY (id, received_at)")
+        cr.execute(f"CREATE TABLE {PARTITION_DEFAULT} PARTITION OF iot_mqtt_message DEFAULT")
+        now = fields.Datetime.now()
+        self._ensure_partitions(oldest, now + self._partition_ahead_delta(granularity), granularity)
+        cr.execute("ALTER SEQUENCE IF EXISTS iot_mqtt_message_id_seq OWNED BY iot_mqtt_message.id")
+        for name, definition in foreign_keys:
+            cr.execute(f"ALTER TABLE iot_mqtt_message ADD CONSTRAINT {name} {definition}")
+        self.init()
+        _logger.info("IoT MQTT message table switched to %s partitions (oldest row %s)", granularity, oldest)
+        return True
+
+    @api.model
+    def _move_legacy_messages(self, batch_size=5000, time_budget_sec=60):
+        """Move the rows of ``PARTITION_LEGACY`` into the partitions, newest first.
+
+        Every batch commits, so writers only wait for one batch at a time, and
+        the queued recent rows are back before the old ones. Returns whether
+        rows are left; the legacy table is dropped once it is empty.
+        """
+        cr = self.env.cr
+        cr.execute("SELECT to_regclass(%s)", [PARTITION_LEGACY])
+        if not cr.fetchone()[0]:
+            return False
+        deadline = time.monotonic() + max(int(time_budget_sec), 1)
+        while time.monotonic() < deadline:
+            cr.execute(
+                f"""
+                WITH doomed AS (
+                    SELECT id
+                    FROM {PARTITION_LEGACY}
+                    ORDER BY id DESC
+                    LIMIT %s
+                ), moved AS (
+                    DELETE FROM {PARTITION_LEGACY} msg
+                    USING doomed
+                    WHERE msg.id = doomed.id
+                    RETURNING msg.*
+                )
+                INSERT INTO iot_mqtt_message
+                SELECT * FROM moved
+                """,
+                [batch_size],
+            )
+            moved = cr.rowcount
+            cr.commit()
+            if moved < batch_size:
+                break
+        cr.execute(f"SELECT EXISTS (SELECT 1 FROM {PARTITION_LEGACY})")
+        if cr.fetchone()[0]:
+            return True
+        cr.execute(f"DROP TABLE {PARTITION_LEGACY}")
+        cr.commit()
+        _logger.info("IoT MQTT message rows moved into partitions")
+        return False
+
+    @api.model
+    def _run_partition_conversion(self, granularity):
+        """Convert the table and move its rows; returns False when maintenance holds the lock."""
+        with exclusive_job(self.env, "mqtt_message_partitions") as acquired:
+            if not acquired:
+                return False
+            if not self._is_partitioned():
+                self._convert_to_partitioned(granularity)
+                self.env.cr.commit()
+            return {"rows_left": self._move_legacy_messages()}
+
+    @api.model
+    def _partition_ahead_delta(self, granularity, ahead=None):
+        ahead = ahead if ahead is not None else self._partition_config()["ahead"]
+        return timedelta(hours=ahead) if granularity == "hour" else timedelta(days=ahead)
+
+    @api.model
+    def _cron_maintain_partitions(self):
+        config = self._partition_config()
+        if not self._is_partitioned():
+            if config["enabled"]:
+                # The conversion is started from the settings, never from here.
+                _logger.warning("IoT MQTT message partitioning is enabled but the table is not converted yet")
+            return
+        with exclusive_job(self.env, "mqtt_message_partitions") as acquired:
+            if not acquired:
+                return
+            now = fields.Datetime.now()
+            self._ensure_partitions(now, now + self._partition_ahead_delta(config["granularity"], config["ahead"]), config["granularity"])
+            self.env.cr.commit()
@@ -11,7 +11,8 @@ from odoo.exceptions import UserError
 class IoTOpenwrtAP(models.Model):
     _name = "iot.openwrt.ap"
     _description = "OpenWrt Access Point"
-    _inherit = ["mail.thread"]
+    _inherit = ["mail.thread", "iot.presence.mixin"]
+    _presence_timeout_param = "iot_control_center.openwrt_online_timeout_sec"
 
     _LIVE_TELEMETRY_FIELDS = {
         "client_count_total",
@@ -89,7 +90,6 @@ class IoTOpenwrtAP(models.Model):
     locate_active = fields.Boolean(readonly=True, tracking=True)
     heartbeat_fail_count = fields.Integer(readonly=True, default=0)
     last_error = fields.Text(readonly=True)
-    online = fields.Boolean(compute="_compute_online", store=False)
 
     job_ids = fields.One2many("iot.openwrt.job", "ap_id")
     job_count = fields.Integer(compute="_compute_job_count")
@@ -98,16 +98,18 @@ class IoTOpenwrtAP(models.Model):
         ("iot_openwrt_ap_host_port_uniq", "unique(host, ssh_port)", "AP host + SSH port must be unique."),
     ]
 
-    @api.depends("last_seen")
-    def _compute_online(self):
-        timeout = int(self.env["ir.config_parameter"].sudo().get_param("iot_control_center.openwrt_online_timeout_sec", 300))
-        now = fields.Datetime.now()
-        for rec in self:
-            rec.online = bool(
-                rec.status == "online"
-                and rec.last_seen
-                and (now - rec.last_seen).total_seconds() <= timeout
-            )
+    @api.model
+    def _presence_online_sql(self):
+        return "status = 'online'"
+
+    @api.model
+    def _presence_target_state(self, vals):
+        # A failed heartbeat takes the AP offline without waiting for the sweep.
+        if vals.get("status") in ("offline", "error"):
+            return "offline"
+        if "status" in vals and vals["status"] != "online":
+            return None
+        return super()._presence_target_state(vals)
 
     @api.depends("job_ids")
     def _compute_job_count(self):
@@ -0,0 +1,235 @@
+from datetime import timedelta
+
+from odoo import api, fields, models
+
+from ..services.leader_election import exclusive_job
+
+PRESENCE_STATES = [("unknown", "Unknown"), ("online", "Online"), ("offline", "Offline")]
+
+
+class IoTPresenceMixin(models.AbstractModel):
+    """Stored online/offline state for anything that reports a last-seen time.
+
+    Ingest writes to the seen field flip a record online immediately; the
+    presence sweep flips stale records offline in one statement per model.
+    Every flip is logged as an ``iot.presence.event``.
+    """
+
+    _name = "iot.presence.mixin"
+    _description = "IoT Presence State"
+
+    _presence_seen_field = "last_seen"
+    _presence_timeout_param = "iot_control_center.online_timeout_sec"
+    _presence_timeout_default = 300
+
+    presence_state = fields.Selection(PRESENCE_STATES, default="unknown", required=True, readonly=True, copy=False)
+    presence_changed_at = fields.Datetime(readonly=True, copy=False)
+    online = fields.Boolean(compute="_compute_online", search="_search_online")
+
+    def init(self):
+        super().init()
+        if self._abstract:
+            return
+        table = self._table
+        source_sql, seen_sql = self._presence_source_sql()
+        cutoff = fields.Datetime.now() - timedelta(seconds=self._presence_timeout())
+        # Seed rows that existed before the column; no events for the initial state.
+        self.env.cr.execute(
+            f"""
+            UPDATE {table} t
+            SET presence_state = CASE WHEN src.seen >= %s AND src.reachable THEN 'online' ELSE 'offline' END,
+                presence_changed_at = src.seen
+            FROM (
+                SELECT {table}.id, {seen_sql} AS seen, ({self._presence_online_sql()}) AS reachable
+                FROM {source_sql}
+            ) src
+            WHERE t.id = src.id
+              AND t.presence_state = 'unknown'
+              AND src.seen IS NOT NULL
+            """,
+            [cutoff],
+        )
+        seen_field = self._fields[self._presence_seen_field]
+        if not seen_field.inherited:
+            self.env.cr.execute(
+                f"CREATE INDEX IF NOT EXISTS {table}_presence_idx ON {table} (presence_state, {self._presence_seen_field})"
+            )
+
+    @api.depends("presence_state")
+    def _compute_online(self):
+        for rec in self:
+            rec.online = rec.presence_state == "online"
+
+    def _search_online(self, operator, value):
+        if operator not in ("=", "!="):
+            return NotImplemented
+        positive = bool(value) == (operator == "=")
+        return [("presence_state", "=" if positive else "!=", "online")]
+
+    @api.model
+    def _presence_timeout(self):
+        raw = self.env["ir.config_parameter"].sudo().get_param(self._presence_timeout_param, str(self._presence_timeout_default))
+        try:
+            return max(int(raw or self._presence_timeout_default), 1)
+        except Exception:
+            return self._presence_timeout_default
+
+    @api.model
+    def _presence_source_sql(self):
+        """FROM clause and seen-time expression the presence SQL reads."""
+        return self._table, f"{self._table}.{self._presence_seen_field}"
+
+    @api.model
+    def _presence_online_sql(self):
+        """Extra SQL predicate a fresh row must also satisfy to count as online."""
+        return "TRUE"
+
+    @api.model
+    def _presence_target_state(self, vals):
+        seen = vals.get(self._presence_seen_field)
+        if not seen:
+            return None
+        seen = fields.Datetime.to_datetime(seen)
+        if fields.Datetime.now() - seen > timedelta(seconds=self._presence_timeout()):
+            # Late or replayed report; the sweep owns stale rows.
+            return None
+        return "online"
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        for vals in vals_list:
+            if "presence_state" not in vals and self._presence_target_state(vals) == "online":
+                vals["presence_state"] = "online"
+                vals["presence_changed_at"] = fields.Datetime.now()
+        return super().create(vals_list)
+
+    def write(self, vals):
+        target, moving = self._presence_pending(vals)
+        res = super().write(vals)
+        if moving:
+            moving._presence_transition(target)
+        return res
+
+    def _presence_pending(self, vals):
+        """Return the state ``vals`` moves records to, and the records that change."""
+        target = None if "presence_state" in vals else self._presence_target_state(vals)
+        if not target:
+            return None, self.browse()
+        return target, self.filtered(lambda rec: rec.presence_state != target)
+
+    def _presence_transition(self, state, at=None):
+        at = at or fields.Datetime.now()
+        events = [
+            {
+                "res_model": self._name,
+                "res_id": rec.id,
+                "name": rec.name,
+                "previous_state": rec.presence_state,
+                "state": state,
+                "changed_at": at,
+                "company_id": rec.company_id.id,
+            }
+            for rec in self
+        ]
+        self.write({"presence_state": state, "presence_changed_at": at})
+        self.env["iot.presence.event"].sudo().create(events)
+
+    @api.model
+    def _presence_sweep(self):
+        """Flip every row whose state disagrees with its seen time; returns the flip count."""
+        table = self._table
+        source_sql, seen = self._presence_source_sql()
+        online_sql = self._presence_online_sql()
+        now = fields.Datetime.now()
+        cutoff = now - timedelta(seconds=self._presence_timeout())
+        self.env.cr.execute(
+            f"""
+            WITH flips AS (
+                SELECT {table}.id,
+                       {table}.presence_state AS previous_state,
+                       CASE WHEN {table}.presence_state = 'online' THEN 'offline' ELSE 'online' END AS state
+                FROM {source_sql}
+                WHERE ({table}.presence_state = 'online' AND ({seen} IS NULL OR {seen} < %(cutoff)s OR NOT ({online_sql})))
+                   OR ({table}.presence_state <> 'online' AND {seen} >= %(cutoff)s AND ({online_sql}))
+                FOR UPDATE OF {table} SKIP LOCKED
+            ), changed AS (
+                UPDATE {table} t
+                SET presence_state = flips.state,
+                    presence_changed_at = %(now)s
+                FROM flips
+                WHERE t.id = flips.id
+                RETURNING t.id, t.name, t.company_id, flips.previous_state, flips.state
+            )
+            INSERT INTO iot_presence_event (res_model, res_id, name, previous_state, state, changed_at, company_id)
+            SELECT %(model)s, id, name, previous_state, state, %(now)s, company_id
+            FROM changed
+            """,
+            {"cutoff": cutoff, "now": now, "model": self._name},
+        )
+        flipped = self.env.cr.rowcount
+        if flipped:
+            self.invalidate_model(["presence_state", "presence_changed_at", "online"])
+        return flipped
+
+
+class IoTPresenceEvent(models.Model):
+    _name = "iot.presence.event"
+    _description = "IoT Presence Transition"
+    _order = "changed_at desc, id desc"
+    _log_access = False
+
+    res_model = fields.Char(string="Model", required=True, readonly=True, index=True)
+    res_id = fields.Many2oneReference(string="Record ID", model_field="res_model", required=True, readonly=True)
+    name = fields.Char(readonly=True)
+    previous_state = fields.Selection(PRESENCE_STATES, readonly=True)
+    state = fields.Selection(PRESENCE_STATES, required=True, readonly=True)
+    changed_at = fields.Datetime(required=True, readonly=True, index=True)
+    company_id = fields.Many2one("res.company", readonly=True, index=True)
+
+    @api.model
+    def _presence_models(self):
+        return [
+            name
+            for name in self.env.registry.descendants(["iot.presence.mixin"], "_inherit")
+            if not self.env[name]._abstract
+        ]
+
+    @api.model
+    def _cron_sweep_presence(self):
+        with exclusive_job(self.env, "presence_sweep") as acquired:
+            if not acquired:
+                return 0
+            flipped = 0
+            for model_name in self._presence_models():
+                flipped += self.env[model_name].sudo()._presence_sweep()
+                self.env.cr.commit()
+            return flipped
+
+    @api.model
+    def _cron_purge_old_events(self, batch_size=5000):
+        raw = self.env["ir.config_parameter"].sudo().get_param("iot_control_center.presence_event_retention_days", "90")
+        try:
+            retention_days = max(int(raw or 90), 1)
+        except Exception:
+            retention_days = 90
+        cutoff = fields.Datetime.now() - timedelta(days=retention_days)
+        while True:
+            self.env.cr.execute(
+                """
+                WITH doomed AS (
+                    SELECT id
+                    FROM iot_presence_event
+                    WHERE changed_at < %s
+                    ORDER BY id
+                    LIMIT %s
+                )
+                DELETE FROM iot_presence_event ev
+                USING doomed
+                WHERE ev.id = doomed.id
+                """,
+                [cutoff, int(batch_size)],
+            )
+            deleted = self.env.cr.rowcount
+            self.env.cr.commit()
+            if deleted < int(batch_size):
+                break
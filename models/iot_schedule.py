@@ -1,4 +1,8 @@
+import hashlib
+import json
 import math
+from collections import defaultdict
+from datetime import datetime, timedelta
 
 import pytz
 
@@ -55,6 +59,68 @@ class IoTSchedule(models.Model):
             out.append(6)
         return out
 
+    def _compiled_entries(self, offsets):
+        """Firmware entries of these schedules; ``offsets`` memoizes UTC offsets by timezone."""
+        entries = []
+        for rec in self:
+            tz_name = rec.timezone or "UTC"
+            if tz_name not in offsets:
+                tz = pytz.timezone(tz_name)
+                offsets[tz_name] = int((datetime.now(tz).utcoffset() or timedelta()).total_seconds() // 60)
+            for weekday in rec.get_enabled_weekdays():
+                entries.append(
+                    {
+                        "weekday": weekday,  # Monday=0 .. Sunday=6
+                        "hour": rec.hour,
+                        "minute": rec.minute,
+                        "action": rec.command,
+                        "offset_min": offsets[tz_name],
+                    }
+                )
+        return entries
+
+    @api.model
+    def _canonical_entries(self, entries):
+        return sorted(entries, key=lambda e: (e["weekday"], e["hour"], e["minute"], e["offset_min"], e["action"]))
+
+    @api.model
+    def _entries_hash(self, entries):
+        raw = json.dumps(self._canonical_entries(entries), sort_keys=True, separators=(",", ":"))
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    @api.model
+    def _compile_for_devices(self, devices):
+        """Return ``{device_id: entries}`` in canonical order for ``devices``.
+
+        One search covers the whole recordset, and each group's schedules are
+        compiled once and shared by all of its member switches.
+        """
+        schedules = self.search(
+            [
+                ("active", "=", True),
+                "|",
+                ("device_id", "in", devices.ids),
+                ("group_id", "in", devices.group_ids.ids),
+            ],
+            order="id asc",
+        )
+        by_device = defaultdict(lambda: self.browse())
+        by_group = defaultdict(lambda: self.browse())
+        for rec in schedules:
+            if rec.device_id:
+                by_device[rec.device_id.id] |= rec
+            else:
+                by_group[rec.group_id.id] |= rec
+        offsets = {}
+        group_entries = {group_id: recs._compiled_entries(offsets) for group_id, recs in by_group.items()}
+        compiled = {}
+        for device in devices:
+            entries = by_device[device.id]._compiled_entries(offsets) if device.id in by_device else []
+            for group_id in device.group_ids.ids:
+                entries.extend(group_entries.get(group_id, []))
+            compiled[device.id] = self._canonical_entries(entries)
+        return compiled
+
     @api.depends("device_id.company_id", "group_id.company_id")
     def _compute_company_id(self):
         for rec in self:
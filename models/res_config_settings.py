@@ -7,6 +7,7 @@ from pathlib import Path
 from odoo import SUPERUSER_ID, api, fields, models
 from odoo.tools import config as odoo_config
 
+from ..services.message_listener import ensure_running as ensure_message_listener
 from ..services.tcp_service import ensure_running as ensure_tcp_running
 
 _logger = logging.getLogger(__name__)
@@ -33,22 +34,210 @@ class ResConfigSettings(models.TransientModel):
         config_parameter="iot_control_center.mqtt_telemetry_sample_window_seconds",
         default=60,
     )
+    iot_mqtt_telemetry_mode = fields.Selection(
+        [
+            ("queue", "Message Queue"),
+            ("last_value", "Last Value Only"),
+        ],
+        config_parameter="iot_control_center.mqtt_telemetry_mode",
+        default="queue",
+    )
+    iot_mqtt_message_partitioning = fields.Boolean(
+        config_parameter="iot_control_center.mqtt_message_partitioning",
+        default=False,
+    )
+    iot_mqtt_message_partition_granularity = fields.Selection(
+        [
+            ("day", "Daily"),
+            ("hour", "Hourly"),
+        ],
+        config_parameter="iot_control_center.mqtt_message_partition_granularity",
+        default="day",
+    )
+    iot_mqtt_message_partitions_ahead = fields.Integer(
+        config_parameter="iot_control_center.mqtt_message_partitions_ahead",
+        default=3,
+    )
+    iot_mqtt_shared_subscription = fields.Boolean(
+        config_parameter="iot_control_center.mqtt_shared_subscription",
+        default=False,
+    )
+    iot_mqtt_shared_group = fields.Char(
+        config_parameter="iot_control_center.mqtt_shared_group",
+    )
+    iot_mqtt_dedupe_cache_size = fields.Integer(
+        config_parameter="iot_control_center.mqtt_dedupe_cache_size",
+        default=10000,
+    )
+    iot_mqtt_notify_enabled = fields.Boolean(
+        config_parameter="iot_control_center.mqtt_notify_enabled",
+        default=True,
+    )
+    iot_mqtt_notify_batch_size = fields.Integer(
+        config_parameter="iot_control_center.mqtt_notify_batch_size",
+        default=200,
+    )
+    iot_mqtt_notify_batch_window_ms = fields.Integer(
+        config_parameter="iot_control_center.mqtt_notify_batch_window_ms",
+        default=20,
+    )
+    iot_mqtt_process_workers = fields.Integer(
+        config_parameter="iot_control_center.mqtt_process_workers",
+        default=4,
+    )
+    iot_mqtt_process_time_budget_sec = fields.Integer(
+        config_parameter="iot_control_center.mqtt_process_time_budget_sec",
+        default=50,
+    )
+    iot_mqtt_ingest_queue_size = fields.Integer(
+        config_parameter="iot_control_center.mqtt_ingest_queue_size",
+        default=10000,
+    )
+    iot_mqtt_ingest_batch_size = fields.Integer(
+        config_parameter="iot_control_center.mqtt_ingest_batch_size",
+        default=200,
+    )
+    iot_mqtt_ingest_batch_ms = fields.Integer(
+        config_parameter="iot_control_center.mqtt_ingest_batch_ms",
+        default=200,
+    )
+    iot_mqtt_ingest_writers = fields.Integer(
+        config_parameter="iot_control_center.mqtt_ingest_writers",
+        default=1,
+    )
+    iot_mqtt_ingest_overflow_policy = fields.Selection(
+        [
+            ("drop_oldest", "Drop Oldest"),
+            ("drop_newest", "Drop Newest"),
+            ("block", "Block Briefly"),
+        ],
+        config_parameter="iot_control_center.mqtt_ingest_overflow_policy",
+        default="drop_oldest",
+    )
+    iot_ingest_spool_enabled = fields.Boolean(
+        config_parameter="iot_control_center.ingest_spool_enabled",
+        default=True,
+    )
+    iot_ingest_spool_dir = fields.Char(
+        config_parameter="iot_control_center.ingest_spool_dir",
+    )
+    iot_ingest_spool_max_mb = fields.Integer(
+        config_parameter="iot_control_center.ingest_spool_max_mb",
+        default=512,
+    )
+    iot_ingest_spool_fsync = fields.Selection(
+        [
+            ("always", "Every Write"),
+            ("batch", "Once per Second"),
+            ("never", "Leave to OS"),
+        ],
+        config_parameter="iot_control_center.ingest_spool_fsync",
+        default="batch",
+    )
+    iot_ingest_latency_budget_ms = fields.Integer(
+        config_parameter="iot_control_center.ingest_latency_budget_ms",
+        default=2000,
+    )
+    iot_command_dispatch_concurrency = fields.Integer(
+        config_parameter="iot_control_center.command_dispatch_concurrency",
+        default=50,
+    )
+    iot_command_max_attempts = fields.Integer(
+        config_parameter="iot_control_center.command_max_attempts",
+        default=5,
+    )
+    iot_command_retry_base_sec = fields.Integer(
+        config_parameter="iot_control_center.command_retry_base_sec",
+        default=5,
+    )
+    iot_command_coalesce_window_sec = fields.Integer(
+        config_parameter="iot_control_center.command_coalesce_window_sec",
+        default=10,
+    )
+    iot_command_retention_days = fields.Integer(
+        config_parameter="iot_control_center.command_retention_days",
+        default=7,
+    )
     iot_device_retention_days = fields.Integer(
         config_parameter="iot_control_center.device_retention_days",
         default=30,
     )
     iot_online_timeout_sec = fields.Integer(config_parameter="iot_control_center.online_timeout_sec", default=300)
+    iot_schedule_sync_rate_per_sec = fields.Integer(
+        config_parameter="iot_control_center.schedule_sync_rate_per_sec",
+        default=20,
+    )
+    iot_schedule_sync_max_inflight = fields.Integer(
+        config_parameter="iot_control_center.schedule_sync_max_inflight",
+        default=200,
+    )
+    iot_schedule_sync_ack_timeout_sec = fields.Integer(
+        config_parameter="iot_control_center.schedule_sync_ack_timeout_sec",
+        default=600,
+    )
+    iot_presence_event_retention_days = fields.Integer(
+        config_parameter="iot_control_center.presence_event_retention_days",
+        default=90,
+    )
     iot_firmware_base_url = fields.Char(
         config_parameter="iot_control_center.firmware_base_url",
         default="iot.imytest.com",
     )
     iot_th_tcp_host = fields.Char(config_parameter="iot_control_center.th_tcp_host", default="0.0.0.0")
     iot_th_tcp_port = fields.Integer(config_parameter="iot_control_center.th_tcp_port", default=9910)
+    iot_th_tcp_idle_timeout_sec = fields.Integer(
+        config_parameter="iot_control_center.th_tcp_idle_timeout_sec",
+        default=300,
+    )
+    iot_th_tcp_max_buffer_bytes = fields.Integer(
+        config_parameter="iot_control_center.th_tcp_max_buffer_bytes",
+        default=65536,
+    )
+    iot_th_tcp_ingest_queue_size = fields.Integer(
+        config_parameter="iot_control_center.th_tcp_ingest_queue_size",
+        default=10000,
+    )
+    iot_th_tcp_ingest_writers = fields.Integer(
+        config_parameter="iot_control_center.th_tcp_ingest_writers",
+        default=4,
+    )
+    iot_th_tcp_ingest_batch_size = fields.Integer(
+        config_parameter="iot_control_center.th_tcp_ingest_batch_size",
+        default=500,
+    )
+    iot_th_tcp_ingest_batch_ms = fields.Integer(
+        config_parameter="iot_control_center.th_tcp_ingest_batch_ms",
+        default=200,
+    )
+    iot_th_tcp_resolve_cache_size = fields.Integer(
+        config_parameter="iot_control_center.th_tcp_resolve_cache_size",
+        default=50000,
+    )
     iot_th_online_timeout_sec = fields.Integer(config_parameter="iot_control_center.th_online_timeout_sec", default=300)
+    iot_th_sensor_online_timeout_sec = fields.Integer(
+        config_parameter="iot_control_center.iot_th_online_timeout_sec",
+        default=900,
+    )
     iot_th_raw_retention_days = fields.Integer(
         config_parameter="iot_control_center.th_raw_retention_days",
         default=15,
     )
+    iot_th_alert_temperature_hysteresis = fields.Float(
+        config_parameter="iot_control_center.th_alert_temperature_hysteresis",
+        default=0.0,
+    )
+    iot_th_alert_humidity_hysteresis = fields.Float(
+        config_parameter="iot_control_center.th_alert_humidity_hysteresis",
+        default=0.0,
+    )
+    iot_th_alert_debounce_samples = fields.Integer(
+        config_parameter="iot_control_center.th_alert_debounce_samples",
+        default=1,
+    )
+    iot_th_alert_debounce_sec = fields.Integer(
+        config_parameter="iot_control_center.th_alert_debounce_sec",
+        default=0,
+    )
     iot_middleware_enabled = fields.Boolean(config_parameter="iot_control_center.middleware_enabled", default=False)
     iot_middleware_base_url = fields.Char(config_parameter="iot_control_center.middleware_base_url", default="http://127.0.0.1:8099")
     iot_middleware_token = fields.Char(config_parameter="iot_control_center.middleware_token", default="imytest-middleware-token")
@@ -148,6 +337,30 @@ class ResConfigSettings(models.TransientModel):
             },
         }
 
+    def action_convert_mqtt_message_partitions(self):
+        self.ensure_one()
+        granularity = self.iot_mqtt_message_partition_granularity or "day"
+        icp = self.env["ir.config_parameter"].sudo()
+        icp.set_param("iot_control_center.mqtt_message_partitioning", "True")
+        icp.set_param("iot_control_center.mqtt_message_partition_granularity", granularity)
+        result = self.env["iot.mqtt.message"].sudo()._run_partition_conversion(granularity)
+        if not result:
+            message, kind = "Partition maintenance is running, try again in a minute.", "warning"
+        elif result["rows_left"]:
+            message, kind = "Partitions are in place; older messages are still being moved. Run again to continue.", "warning"
+        else:
+            message, kind = "The message queue is partitioned and all messages are moved.", "success"
+        return {
+            "type": "ir.actions.client",
+            "tag": "display_notification",
+            "params": {
+                "title": "MQTT Message Partitioning",
+                "message": message,
+                "type": kind,
+                "sticky": False,
+            },
+        }
+
     def _run_iot_services_after_commit(self):
         dbname = self.env.cr.dbname
         registry = self.env.registry
@@ -162,6 +375,7 @@ class ResConfigSettings(models.TransientModel):
                         env["iot.device"]._cron_ensure_mqtt_service()
                         env["iot.th.gateway"]._cron_ensure_tcp_service()
                         ensure_tcp_running(env)
+                    ensure_message_listener(env)
                     cr.commit()
                 except Exception:
                     cr.rollback()
@@ -1,4 +1,9 @@
-from odoo import fields, models
+from collections import defaultdict
+
+from odoo import api, fields, models
+
+from ..services.th_alert_state import AlertPolicy, SensorAlertState
+from ..services.th_resolve_cache import notify_changed
 
 
 class IoTTHAlert(models.Model):
@@ -27,3 +32,142 @@ class IoTTHAlert(models.Model):
     state = fields.Selection([("open", "Open"), ("closed", "Closed")], default="open", index=True)
     closed_at = fields.Datetime()
     note = fields.Text()
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        records = super().create(vals_list)
+        records._notify_state_machines()
+        return records
+
+    def write(self, vals):
+        res = super().write(vals)
+        self._notify_state_machines()
+        return res
+
+    def unlink(self):
+        self._notify_state_machines()
+        return super().unlink()
+
+    def _notify_state_machines(self):
+        # Any change not made through the cached machines themselves (users,
+        # imports, uncached ingest paths) makes them stale.
+        if not self.env.context.get("iot_th_alert_machine"):
+            notify_changed(self.env, "alert")
+
+    @api.model
+    def _alert_policy(self):
+        icp = self.env["ir.config_parameter"].sudo()
+
+        def _param(key, default, cast):
+            try:
+                return max(cast(icp.get_param(f"iot_control_center.{key}", default) or default), cast(0))
+            except (TypeError, ValueError):
+                return default
+
+        return AlertPolicy(
+            temperature_hysteresis=_param("th_alert_temperature_hysteresis", 0.0, float),
+            humidity_hysteresis=_param("th_alert_humidity_hysteresis", 0.0, float),
+            debounce_samples=max(_param("th_alert_debounce_samples", 1, int), 1),
+            debounce_sec=_param("th_alert_debounce_sec", 0, int),
+        )
+
+    @api.model
+    def _load_alert_states(self, sensor_ids):
+        """Rebuild the state machines of ``sensor_ids`` from their open alerts."""
+        self.flush_model(["sensor_id", "alert_type", "state", "occurred_at"])
+        self.env.cr.execute(
+            """
+            SELECT sensor_id, id, alert_type
+            FROM iot_th_alert
+            WHERE sensor_id = ANY(%s)
+              AND state = 'open'
+            ORDER BY occurred_at, id
+            """,
+            [list(sensor_ids)],
+        )
+        open_alerts = defaultdict(list)
+        for sensor_id, alert_id, alert_type in self.env.cr.fetchall():
+            open_alerts[sensor_id].append((alert_id, alert_type))
+        return {sensor_id: SensorAlertState.from_open_alerts(open_alerts[sensor_id]) for sensor_id in sensor_ids}
+
+    @api.model
+    def _evaluate_readings(self, by_sensor, thresholds, alert_cache=None, generation=None):
+        """Feed each sensor's readings through its alert state machines; only transitions are written.
+
+        ``by_sensor`` maps sensor ids to ``(sensor_id, temperature, humidity,
+        reported_at, battery_voltage)`` rows in reading order and ``thresholds``
+        maps them to ``(t_low, t_high, h_low, h_high)``. With an active
+        ``alert_cache`` the machines are kept across batches, so a batch without
+        transitions runs no query. Without it they are rebuilt from the open
+        alerts; debounce progress is not stored, so every sample counts as
+        debounced there.
+        """
+        policy = self._alert_policy()
+        bands = {"temperature": policy.temperature_hysteresis, "humidity": policy.humidity_hysteresis}
+        cache_active = bool(alert_cache) and alert_cache.is_active()
+        if cache_active:
+            cached, missing = alert_cache.get_many("alert", list(by_sensor))
+        else:
+            policy = policy._replace(debounce_samples=1, debounce_sec=0)
+            cached, missing = {}, list(by_sensor)
+        # Work on copies: the cache only learns the new states once they are committed.
+        states = {sensor_id: state.copy() for sensor_id, state in cached.items()}
+        if missing:
+            loaded = self._load_alert_states(missing)
+            if cache_active:
+                # Alert notifications drop the machines, not their debounce progress.
+                progress, _unknown = alert_cache.get_many("alert_progress", missing)
+                for sensor_id, previous in progress.items():
+                    loaded[sensor_id].adopt_progress(previous)
+            states.update(loaded)
+
+        # Records share one prefetch set; gateways are only read when an alert opens.
+        sensors = {rec.id: rec for rec in self.env["iot.th.sensor"].browse(list(by_sensor))}
+        now = fields.Datetime.now()
+        new_alerts = []
+        to_close = []
+        for sensor_id, rows in by_sensor.items():
+            t_low, t_high, h_low, h_high = thresholds[sensor_id]
+            limits = {"temperature": (t_low, t_high), "humidity": (h_low, h_high)}
+            state = states[sensor_id]
+            opened_here = {}
+            for _sensor_id, temperature, humidity, reported_at, _voltage in rows:
+                values = {"temperature": temperature, "humidity": humidity}
+                for metric, machine in state.metrics.items():
+                    low, high = limits[metric]
+                    closed_ids, opened = machine.step(metric, values[metric], low, high, bands[metric], policy, reported_at)
+                    if closed_ids:
+                        to_close.extend(closed_ids)
+                    elif closed_ids is not None and metric in opened_here:
+                        # Opened and cleared within this batch.
+                        opened_here.pop(metric).update({"state": "closed", "closed_at": now})
+                    if opened:
+                        alert_type, threshold, occurred_at = opened
+                        opened_here[metric] = {
+                            "sensor_id": sensor_id,
+                            "gateway_id": sensors[sensor_id].gateway_id.id,
+                            "alert_type": alert_type,
+                            "threshold_value": threshold,
+                            "actual_value": values[metric],
+                            "occurred_at": occurred_at,
+                        }
+                        new_alerts.append((state.metrics[metric], opened_here[metric]))
+
+        # Only the owner of ``alert_cache`` learns its transitions on commit;
+        # every other writer has to tell the ingest process.
+        machine_model = self.with_context(iot_th_alert_machine=True) if alert_cache else self
+        if new_alerts:
+            created = machine_model.create([vals for _machine, vals in new_alerts])
+            for (machine, vals), alert in zip(new_alerts, created):
+                if vals.get("state") != "closed":
+                    machine.open_ids.append(alert.id)
+        if to_close:
+            # Rows deleted meanwhile also invalidated the cache; skip them.
+            machine_model.browse(to_close).exists().write({"state": "closed", "closed_at": now})
+        if alert_cache:
+
+            def _remember_states():
+                alert_cache.put_many("alert", states, generation)
+                alert_cache.put_many("alert_progress", states, None)
+
+            self.env.cr.postcommit.add(_remember_states)
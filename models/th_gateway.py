@@ -1,13 +1,14 @@
-from datetime import timedelta
-
 from odoo import api, fields, models
 
 from ..services.tcp_service import ensure_running as ensure_tcp_running
+from ..services.th_resolve_cache import GATEWAY_CACHE_FIELDS, notify_changed
 
 
 class IoTTHGateway(models.Model):
     _name = "iot.th.gateway"
     _description = "Temperature/Humidity Gateway"
+    _inherit = ["iot.presence.mixin"]
+    _presence_timeout_param = "iot_control_center.th_online_timeout_sec"
 
     name = fields.Char(required=True)
     serial = fields.Char(string="Gateway ID", required=True, index=True)
@@ -23,12 +24,21 @@ class IoTTHGateway(models.Model):
     statistics_window_hours = fields.Integer(default=24, help="Default analysis window in hours.")
 
     last_seen = fields.Datetime()
-    online = fields.Boolean(compute="_compute_online", store=False)
 
     sensor_ids = fields.One2many("iot.th.sensor", "gateway_id")
     sensor_count = fields.Integer(compute="_compute_counts")
     alert_count = fields.Integer(compute="_compute_counts")
 
+    def write(self, vals):
+        res = super().write(vals)
+        if GATEWAY_CACHE_FIELDS.intersection(vals):
+            notify_changed(self.env, "gateway")
+        return res
+
+    def unlink(self):
+        notify_changed(self.env, "gateway")
+        return super().unlink()
+
     @api.depends("sensor_ids")
     def _compute_counts(self):
         alert_model = self.env["iot.th.alert"]
@@ -36,13 +46,6 @@ class IoTTHGateway(models.Model):
             rec.sensor_count = len(rec.sensor_ids)
             rec.alert_count = alert_model.search_count([("gateway_id", "=", rec.id), ("state", "=", "open")])
 
-    @api.depends("last_seen")
-    def _compute_online(self):
-        timeout = int(self.env["ir.config_parameter"].sudo().get_param("iot_control_center.th_online_timeout_sec", 300))
-        now = fields.Datetime.now()
-        for rec in self:
-            rec.online = bool(rec.last_seen and (now - rec.last_seen) <= timedelta(seconds=timeout))
-
     @api.model
     def _cron_ensure_tcp_service(self):
         icp = self.env["ir.config_parameter"].sudo()
@@ -3,6 +3,8 @@ from datetime import timedelta
 from odoo import api, fields, models
 from odoo.osv import expression
 
+from ..services.leader_election import exclusive_job
+
 
 class IoTTHReading(models.Model):
     _name = "iot.th.reading"
@@ -125,6 +127,14 @@ class IoTTHReading(models.Model):
 
     @api.model
     def _cron_rollup_old_readings(self, retention_days=None, batch_size=500):
+        with exclusive_job(self.env, "th_rollup_old_readings") as acquired:
+            if not acquired:
+                # Another node is already rolling up.
+                return
+            self._rollup_old_readings(retention_days=retention_days, batch_size=batch_size)
+
+    @api.model
+    def _rollup_old_readings(self, retention_days=None, batch_size=500):
         icp = self.env["ir.config_parameter"].sudo()
         if retention_days is None:
             retention_days = icp.get_param("iot_control_center.th_raw_retention_days", "15")
@@ -1,12 +1,19 @@
+from collections import defaultdict
 from datetime import timedelta
 
 from odoo import api, fields, models
 from odoo.exceptions import UserError
 
+from ..services.th_resolve_cache import SENSOR_CACHE_FIELDS, notify_changed
+
 
 class IoTTHSensor(models.Model):
     _name = "iot.th.sensor"
     _description = "Node Sensor Channel (Temp+Humidity)"
+    _inherit = ["iot.presence.mixin"]
+    _presence_seen_field = "last_reported_at"
+    _presence_timeout_param = "iot_control_center.iot_th_online_timeout_sec"
+    _presence_timeout_default = 900
 
     name = fields.Char(required=True)
     probe_code = fields.Char(string="Sensor Channel", required=True, index=True)
@@ -87,7 +94,14 @@ class IoTTHSensor(models.Model):
             v["node_id"] = str(v["node_id"]).strip().upper()
         if v.get("probe_code"):
             v["probe_code"] = str(v["probe_code"]).strip().upper()
-        return super().write(v)
+        res = super().write(v)
+        if SENSOR_CACHE_FIELDS.intersection(v):
+            notify_changed(self.env, "sensor")
+        return res
+
+    def unlink(self):
+        notify_changed(self.env, "sensor")
+        return super().unlink()
 
     @api.model
     def find_bind_candidates(self, node_id, probe_code=None, require_online=False):
@@ -175,59 +189,67 @@ class IoTTHSensor(models.Model):
                 raise UserError("Sensor Group company must match the sensor company.")
 
     def apply_reading(self, temperature, humidity, reported_at, battery_voltage=None):
-        alert_model = self.env["iot.th.alert"]
-        for rec in self:
-            rec.last_temperature = temperature
-            rec.last_humidity = humidity
-            if battery_voltage is not None:
-                rec.last_battery_voltage = battery_voltage
-            rec.last_reported_at = reported_at
-            rec.reading_count += 1
+        self._apply_readings([(rec.id, temperature, humidity, reported_at, battery_voltage) for rec in self])
 
-            t_low, t_high, h_low, h_high = rec._get_effective_threshold_values()
-            checks = []
-            if temperature > t_high:
-                checks.append(("temp_high", t_high, temperature))
-            elif temperature < t_low:
-                checks.append(("temp_low", t_low, temperature))
+    @api.model
+    def _apply_readings(self, readings, thresholds=None, alert_cache=None, generation=None):
+        """Apply ``(sensor_id, temperature, humidity, reported_at, battery_voltage)`` readings in one pass.
 
-            if humidity > h_high:
-                checks.append(("hum_high", h_high, humidity))
-            elif humidity < h_low:
-                checks.append(("hum_low", h_low, humidity))
+        Last values and reading counts of all sensors are set by one statement,
+        then the readings go through the alert state machines. ``thresholds``
+        maps sensor ids to known effective thresholds; the others are resolved
+        here. ``alert_cache`` and ``generation`` are handed to
+        ``iot.th.alert._evaluate_readings``.
+        """
+        by_sensor = defaultdict(list)
+        for reading in readings:
+            by_sensor[reading[0]].append(reading)
+        if not by_sensor:
+            return
+        latest = []
+        for sensor_id, rows in by_sensor.items():
+            rows.sort(key=lambda row: row[3])
+            _sensor_id, temperature, humidity, reported_at, _voltage = rows[-1]
+            voltage = next((row[4] for row in reversed(rows) if row[4] is not None), None)
+            latest.append((sensor_id, temperature, humidity, reported_at, voltage, len(rows)))
 
-            open_alerts = alert_model.search(
-                [
-                    ("sensor_id", "=", rec.id),
-                    ("state", "=", "open"),
-                ]
-            )
-            open_types = set(open_alerts.mapped("alert_type"))
-            for alert_type, threshold, actual in checks:
-                if alert_type not in open_types:
-                    alert_model.create(
-                        {
-                            "sensor_id": rec.id,
-                            "gateway_id": rec.gateway_id.id,
-                            "alert_type": alert_type,
-                            "threshold_value": threshold,
-                            "actual_value": actual,
-                            "occurred_at": reported_at,
-                        }
-                    )
-
-            # Close opposite alerts once value returns to normal range.
-            close_types = set()
-            if t_low <= temperature <= t_high:
-                close_types.update(["temp_high", "temp_low"])
+        self.flush_model()
+        ids, temperatures, humidities, reported, voltages, counts = (list(column) for column in zip(*latest))
+        self.env.cr.execute(
+            """
+            UPDATE iot_th_sensor s
+            SET last_temperature = src.temperature,
+                last_humidity = src.humidity,
+                last_battery_voltage = COALESCE(src.battery_voltage, s.last_battery_voltage),
+                last_reported_at = src.reported_at,
+                reading_count = COALESCE(s.reading_count, 0) + src.readings,
+                write_date = now() AT TIME ZONE 'UTC'
+            FROM unnest(%s::integer[], %s::float8[], %s::float8[], %s::timestamp[], %s::float8[], %s::integer[])
+                AS src(id, temperature, humidity, reported_at, battery_voltage, readings)
+            WHERE s.id = src.id
+            RETURNING s.id, s.presence_state
+            """,
+            [ids, temperatures, humidities, reported, voltages, counts],
+        )
+        states = self.env.cr.fetchall()
+        self.invalidate_model(
+            ["last_temperature", "last_humidity", "last_battery_voltage", "last_reported_at", "reading_count", "write_date"]
+        )
 
-            if h_low <= humidity <= h_high:
-                close_types.update(["hum_high", "hum_low"])
+        seen = dict(zip(ids, reported))
+        moving = [
+            sensor_id
+            for sensor_id, presence_state in states
+            if presence_state != "online"
+            and self._presence_target_state({self._presence_seen_field: seen[sensor_id]}) == "online"
+        ]
+        if moving:
+            self.browse(moving)._presence_transition("online")
 
-            if close_types:
-                to_close = open_alerts.filtered(lambda a: a.alert_type in close_types)
-                if to_close:
-                    to_close.write({"state": "closed", "closed_at": fields.Datetime.now()})
+        thresholds = dict(thresholds or {})
+        for rec in self.browse([sensor_id for sensor_id in by_sensor if sensor_id not in thresholds]):
+            thresholds[rec.id] = rec._get_effective_threshold_values()
+        self.env["iot.th.alert"]._evaluate_readings(by_sensor, thresholds, alert_cache=alert_cache, generation=generation)
 
     @api.depends(
         "group_id",
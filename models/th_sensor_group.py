@@ -1,5 +1,7 @@
 from odoo import fields, models
 
+from ..services.th_resolve_cache import SENSOR_GROUP_CACHE_FIELDS, notify_changed
+
 
 class IoTTHSensorGroup(models.Model):
     _name = "iot.th.sensor.group"
@@ -24,6 +26,17 @@ class IoTTHSensorGroup(models.Model):
     sensor_ids = fields.One2many("iot.th.sensor", "group_id", string="Sensors")
     sensor_count = fields.Integer(compute="_compute_sensor_count")
 
+    def write(self, vals):
+        res = super().write(vals)
+        if SENSOR_GROUP_CACHE_FIELDS.intersection(vals):
+            # Cached sensor entries carry the effective group thresholds.
+            notify_changed(self.env, "sensor")
+        return res
+
+    def unlink(self):
+        notify_changed(self.env, "sensor")
+        return super().unlink()
+
     def _compute_sensor_count(self):
         for rec in self:
             rec.sensor_count = len(rec.sensor_ids)
@@ -0,0 +1,79 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+
+def payload_fingerprint(payload_text):
+    return hashlib.blake2b((payload_text or "").encode("utf-8"), digest_size=16).hexdigest()
+
+
+class PayloadFingerprintCache:
+    """Thread-safe LRU of the last message seen per (dbname, serial, type, topic).
+
+    Each entry keeps the payload fingerprint, the wall-clock time it was last seen,
+    the id of the queued row it was folded into and when that row's received_at was
+    last written. Entries are only written after the creating transaction commits,
+    so a cached id always points at a real row.
+    """
+
+    def __init__(self, maxsize=10000):
+        self.maxsize = max(int(maxsize or 1), 1)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def resize(self, maxsize):
+        with self._lock:
+            self.maxsize = max(int(maxsize or 1), 1)
+            self._evict()
+
+    def _evict(self):
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self._stats["evictions"] += 1
+
+    def get(self, key):
+        """Return ``(fingerprint, seen_at, msg_id, synced_at)`` or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return entry
+
+    def remember(self, key, fingerprint, msg_id, seen_at=None):
+        with self._lock:
+            seen_at = seen_at if seen_at is not None else time.time()
+            self._entries[key] = (fingerprint, seen_at, msg_id, seen_at)
+            self._entries.move_to_end(key)
+            self._evict()
+
+    def touch(self, key, seen_at=None, synced=False):
+        """Slide the window of ``key``; ``synced`` also records the received_at write."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                seen_at = seen_at if seen_at is not None else time.time()
+                self._entries[key] = (entry[0], seen_at, entry[2], seen_at if synced else entry[3])
+
+    def forget_many(self, keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def forget(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            out = dict(self._stats)
+            out.update({"size": len(self._entries), "capacity": self.maxsize})
+        return out
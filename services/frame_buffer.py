@@ -0,0 +1,81 @@
+import struct
+from functools import lru_cache
+
+JSON_LINE = "json"
+BINARY_FRAME = "binary"
+
+FRAME_HEADER = b"\xFA\xCE"
+# Header (8 bytes) + checksum; the data area adds data_count 16-bit words.
+MIN_FRAME_BYTES = 9
+JSON_START = (ord("{"), ord("["))
+
+
+@lru_cache(maxsize=None)
+def channel_struct(pair_count):
+    """Big-endian (signed temperature, unsigned humidity) word pairs of one frame."""
+    return struct.Struct(">" + "hH" * pair_count)
+
+
+class FrameBuffer:
+    """Receive buffer of one gateway connection for the mixed JSON-line / binary stream.
+
+    Consumed bytes only advance a read cursor. The consumed prefix is dropped
+    on ``feed`` once it passes ``compact_bytes`` or covers the whole buffer,
+    so a burst of frames costs one memmove instead of one per frame.
+    """
+
+    def __init__(self, compact_bytes=65536):
+        self.compact_bytes = max(int(compact_bytes or 1), 1)
+        self._buf = bytearray()
+        self._pos = 0
+
+    def __len__(self):
+        return len(self._buf) - self._pos
+
+    def feed(self, data):
+        if self._pos and (self._pos >= self.compact_bytes or self._pos == len(self._buf)):
+            del self._buf[: self._pos]
+            self._pos = 0
+        self._buf.extend(data)
+
+    def clear(self):
+        self._buf.clear()
+        self._pos = 0
+
+    def frames(self):
+        """Yield ``(kind, view)`` for every complete JSON line and binary frame.
+
+        Each view is a zero-copy slice of the buffer, released as soon as the
+        generator resumes; decode it before asking for the next one. The frame
+        is consumed before it is yielded, so a failing consumer never sees it
+        again.
+        """
+        buf = self._buf
+        with memoryview(buf) as view:
+            while self._pos < len(buf):
+                pos = self._pos
+                # JSON-line mode (legacy compatibility)
+                if buf[pos] in JSON_START:
+                    nl = buf.find(b"\n", pos)
+                    if nl < 0:
+                        return
+                    self._pos = nl + 1
+                    with view[pos:nl] as line:
+                        yield JSON_LINE, line
+                    continue
+
+                # Binary frame mode.
+                idx = buf.find(FRAME_HEADER, pos)
+                if idx < 0:
+                    # Keep the last byte in case it is a partial frame header.
+                    self._pos = max(len(buf) - 1, pos)
+                    return
+                pos = self._pos = idx
+                if len(buf) - pos < MIN_FRAME_BYTES:
+                    return
+                frame_len = MIN_FRAME_BYTES + buf[pos + 7] * 2
+                if len(buf) - pos < frame_len:
+                    return
+                self._pos = pos + frame_len
+                with view[pos : pos + frame_len] as frame:
+                    yield BINARY_FRAME, frame
@@ -0,0 +1,189 @@
+import logging
+import queue
+import threading
+import time
+import zlib
+
+_logger = logging.getLogger(__name__)
+
+OVERFLOW_POLICIES = ("drop_newest", "drop_oldest", "block")
+
+
+def partition_for(key, partitions):
+    # crc32 is stable across processes (unlike hash()), so the same serial always
+    # lands on the same writer and per-device ordering is kept.
+    if partitions <= 1 or not key:
+        return 0
+    return zlib.crc32(str(key).strip().lower().encode("utf-8")) % partitions
+
+
+class BatchIngestQueue:
+    """Bounded in-memory queue drained by writer threads in batches.
+
+    Items are routed to one of ``writers`` partitions by key, each partition owns a
+    bounded queue and a writer thread. A writer collects up to ``batch_size`` items
+    or waits at most ``batch_ms`` before handing the batch to ``handler``.
+    """
+
+    def __init__(
+        self,
+        name,
+        handler,
+        writers=1,
+        maxsize=10000,
+        batch_size=200,
+        batch_ms=200,
+        overflow_policy="drop_oldest",
+        block_timeout=1.0,
+    ):
+        self.name = name
+        self.handler = handler
+        self.writers = max(int(writers or 1), 1)
+        self.maxsize = max(int(maxsize or 1), self.writers)
+        self.batch_size = max(int(batch_size or 1), 1)
+        self.batch_ms = max(int(batch_ms or 0), 0)
+        self.overflow_policy = overflow_policy if overflow_policy in OVERFLOW_POLICIES else "drop_oldest"
+        self.block_timeout = block_timeout
+        per_partition = max(self.maxsize // self.writers, 1)
+        self._queues = [queue.Queue(maxsize=per_partition) for _ in range(self.writers)]
+        self._threads = []
+        self._stop_event = threading.Event()
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "enqueued": 0,
+            "processed": 0,
+            "dropped": 0,
+            "overflow": 0,
+            "batches": 0,
+            "failed_batches": 0,
+            "max_depth": 0,
+        }
+
+    def _bump(self, key, value=1):
+        with self._stats_lock:
+            self._stats[key] += value
+
+    def start(self):
+        if self._threads:
+            return
+        self._stop_event.clear()
+        for index in range(self.writers):
+            thread = threading.Thread(
+                target=self._run_writer,
+                args=(index,),
+                name=f"{self.name}-writer-{index}",
+                daemon=True,
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, drain=True, timeout=5.0):
+        self._stop_event.set()
+        deadline = time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(max(deadline - time.monotonic(), 0.0))
+        self._threads = []
+        if drain:
+            for index in range(self.writers):
+                self._flush_partition(index)
+
+    def depth(self):
+        return sum(q.qsize() for q in self._queues)
+
+    def stats(self):
+        with self._stats_lock:
+            out = dict(self._stats)
+        out.update(
+            {
+                "depth": self.depth(),
+                "capacity": self.maxsize,
+                "writers": self.writers,
+                "overflow_policy": self.overflow_policy,
+            }
+        )
+        return out
+
+    def put(self, item, key=None):
+        """Enqueue one item; returns False when the item was dropped."""
+        q = self._queues[partition_for(key, self.writers)]
+        try:
+            q.put_nowait(item)
+        except queue.Full:
+            self._bump("overflow")
+            if not self._handle_overflow(q, item):
+                self._bump("dropped")
+                return False
+        self._bump("enqueued")
+        depth = self.depth()
+        with self._stats_lock:
+            if depth > self._stats["max_depth"]:
+                self._stats["max_depth"] = depth
+        return True
+
+    def _handle_overflow(self, q, item):
+        if self.overflow_policy == "block":
+            try:
+                q.put(item, timeout=self.block_timeout)
+                return True
+            except queue.Full:
+                return False
+        if self.overflow_policy == "drop_oldest":
+            try:
+                q.get_nowait()
+                self._bump("dropped")
+            except queue.Empty:
+                pass
+            try:
+                q.put_nowait(item)
+                return True
+            except queue.Full:
+                return False
+        return False
+
+    def _collect_batch(self, q, first_timeout):
+        try:
+            first = q.get(timeout=first_timeout)
+        except queue.Empty:
+            return []
+        batch = [first]
+        deadline = time.monotonic() + (self.batch_ms / 1000.0)
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining <= 0:
+                    batch.append(q.get_nowait())
+                else:
+                    batch.append(q.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _dispatch(self, batch):
+        try:
+            self.handler(batch)
+            self._bump("processed", len(batch))
+        except Exception:
+            self._bump("failed_batches")
+            _logger.exception("%s batch handler failed (size=%s)", self.name, len(batch))
+        finally:
+            self._bump("batches")
+
+    def _run_writer(self, index):
+        q = self._queues[index]
+        while not self._stop_event.is_set():
+            batch = self._collect_batch(q, first_timeout=0.5)
+            if batch:
+                self._dispatch(batch)
+
+    def _flush_partition(self, index):
+        q = self._queues[index]
+        while True:
+            batch = []
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(q.get_nowait())
+                except queue.Empty:
+                    break
+            if not batch:
+                return
+            self._dispatch(batch)
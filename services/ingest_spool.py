@@ -0,0 +1,517 @@
+import errno
+import fcntl
+import json
+import logging
+import mmap
+import os
+import shutil
+import socket
+import struct
+import threading
+import time
+import zlib
+from pathlib import Path
+
+import psycopg2
+
+from .leader_election import LeaseLost
+
+_logger = logging.getLogger(__name__)
+
+FSYNC_POLICIES = ("always", "batch", "never")
+SPOOL_OVERFLOW_POLICIES = ("drop_oldest", "drop_newest")
+
+# Record frame: payload length, crc32 of the payload, payload (UTF-8 JSON).
+_HEADER = struct.Struct("<II")
+_SEGMENT_SUFFIX = ".seg"
+
+
+def load_spool_config(icp, dbname, kind):
+    """Spool settings for one ingest path (``mqtt`` or ``th_tcp``) of ``dbname``."""
+
+    def _int(key, default, minimum=0):
+        try:
+            return max(int(icp.get_param(key, default) or default), minimum)
+        except (TypeError, ValueError):
+            return default
+
+    base_dir = (icp.get_param("iot_control_center.ingest_spool_dir") or "").strip()
+    if base_dir in ("False", "false"):
+        base_dir = ""
+    if not base_dir:
+        from odoo.tools import config
+
+        base_dir = os.path.join(config["data_dir"], "iot_spool")
+    fsync_policy = icp.get_param("iot_control_center.ingest_spool_fsync", "batch")
+    return {
+        "enabled": str(icp.get_param("iot_control_center.ingest_spool_enabled", "True")).lower() in ("1", "true", "yes"),
+        "base_dir": os.path.join(base_dir, dbname, kind),
+        "max_bytes": _int("iot_control_center.ingest_spool_max_mb", 512, minimum=32) * 1024 * 1024,
+        "fsync_policy": fsync_policy if fsync_policy in FSYNC_POLICIES else "batch",
+        "latency_budget_ms": _int("iot_control_center.ingest_latency_budget_ms", 2000),
+    }
+
+
+def is_db_unavailable_error(exc):
+    """Errors after which the write should be spooled and replayed later.
+
+    A fenced writer spools too: its records are replayed once this process
+    leads again, or by the new leader when it adopts the spool of a dead process.
+    """
+    if isinstance(exc, (psycopg2.OperationalError, psycopg2.InterfaceError, LeaseLost)):
+        return True
+    # Pool exhaustion and connection failures surface as plain exceptions in Odoo.
+    return type(exc).__name__ in ("PoolError", "ConnectionError", "TimeoutError")
+
+
+class IngestSpool:
+    """Append-only, segment-file spool for ingest records.
+
+    Segments are pre-allocated files written through a shared memory map; a zero
+    length header marks the end of written data. A record becomes visible only once
+    its header is written after the payload, so the replay reader never sees a
+    half-written record, and a torn tail after a crash fails its crc and is
+    overwritten. The replay position is kept in a small cursor file, consumed
+    segments are deleted, and disk usage is capped at ``max_bytes``.
+    """
+
+    def __init__(
+        self,
+        directory,
+        segment_bytes=16 * 1024 * 1024,
+        max_bytes=512 * 1024 * 1024,
+        fsync_policy="batch",
+        fsync_interval_ms=1000,
+        overflow_policy="drop_oldest",
+    ):
+        self.directory = Path(directory)
+        self.segment_bytes = max(int(segment_bytes or 0), 64 * 1024)
+        self.max_segments = max(int(max_bytes or 0) // self.segment_bytes, 2)
+        self.fsync_policy = fsync_policy if fsync_policy in FSYNC_POLICIES else "batch"
+        self.fsync_interval = max(int(fsync_interval_ms or 0), 0) / 1000.0
+        self.overflow_policy = overflow_policy if overflow_policy in SPOOL_OVERFLOW_POLICIES else "drop_oldest"
+        self._lock = threading.RLock()
+        self._replay_lock = threading.Lock()
+        self._lock_fd = None
+        self._active_seq = None
+        self._active_file = None
+        self._active_map = None
+        self._write_offset = 0
+        self._last_sync = 0.0
+        self._cursor = (0, 0)
+        self._pending = 0
+        self._stats = {
+            "appended": 0,
+            "replayed": 0,
+            "rejected": 0,
+            "dropped_segments": 0,
+            "dropped_records": 0,
+            "fsyncs": 0,
+            "replay_errors": 0,
+        }
+
+    # -- lifecycle --------------------------------------------------------------------
+
+    def open(self, blocking=True):
+        """Take ownership of the directory; False when another process owns it."""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        fd = os.open(str(self.directory / "LOCK"), os.O_CREAT | os.O_RDWR, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except OSError as exc:
+            os.close(fd)
+            if exc.errno in (errno.EAGAIN, errno.EACCES):
+                return False
+            raise
+        self._lock_fd = fd
+        with self._lock:
+            self._cursor = self._read_cursor()
+            segments = self._segments()
+            if segments and self._cursor[0] < segments[0]:
+                self._cursor = (segments[0], 0)
+            self._pending = sum(self._count_records(seq, self._cursor[1] if seq == self._cursor[0] else 0) for seq in segments)
+            if segments:
+                self._open_segment(segments[-1], recover=True)
+        return True
+
+    def close(self):
+        with self._lock:
+            self._close_active(sync=True)
+            if self._lock_fd is not None:
+                try:
+                    fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+                finally:
+                    os.close(self._lock_fd)
+                self._lock_fd = None
+
+    # -- segments ---------------------------------------------------------------------
+
+    def _segment_path(self, seq):
+        return self.directory / f"{seq:020d}{_SEGMENT_SUFFIX}"
+
+    def _segments(self):
+        out = []
+        for path in self.directory.glob(f"*{_SEGMENT_SUFFIX}"):
+            try:
+                out.append(int(path.stem))
+            except ValueError:
+                continue
+        return sorted(out)
+
+    def _scan(self, buf, offset):
+        """Yield ``(offset, next_offset, payload)`` for valid records from ``offset``."""
+        size = len(buf)
+        while offset + _HEADER.size <= size:
+            length, crc = _HEADER.unpack_from(buf, offset)
+            if not length or offset + _HEADER.size + length > size:
+                return
+            start = offset + _HEADER.size
+            payload = bytes(buf[start : start + length])
+            if zlib.crc32(payload) != crc:
+                return
+            yield offset, start + length, payload
+            offset = start + length
+
+    def _map_readonly(self, seq):
+        path = self._segment_path(seq)
+        with open(path, "rb") as fh:
+            if os.fstat(fh.fileno()).st_size == 0:
+                return None
+            return mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _count_records(self, seq, offset):
+        buf = self._map_readonly(seq)
+        if buf is None:
+            return 0
+        try:
+            return sum(1 for _record in self._scan(buf, offset))
+        finally:
+            buf.close()
+
+    def _open_segment(self, seq, recover=False):
+        path = self._segment_path(seq)
+        fh = open(path, "r+b" if path.exists() else "w+b")
+        if os.fstat(fh.fileno()).st_size < self.segment_bytes:
+            fh.truncate(self.segment_bytes)
+        mm = mmap.mmap(fh.fileno(), self.segment_bytes, access=mmap.ACCESS_WRITE)
+        offset = 0
+        if recover:
+            for _start, end, _payload in self._scan(mm, 0):
+                offset = end
+            # Wipe a torn tail so stale bytes never look like a record.
+            tail = min(self.segment_bytes - offset, 64 * 1024)
+            if tail > 0:
+                mm[offset : offset + tail] = b"\0" * tail
+        self._active_seq = seq
+        self._active_file = fh
+        self._active_map = mm
+        self._write_offset = offset
+
+    def _close_active(self, sync=True):
+        if self._active_map is not None:
+            if sync and self.fsync_policy != "never":
+                self._active_map.flush()
+            self._active_map.close()
+        if self._active_file is not None:
+            self._active_file.close()
+        self._active_seq = None
+        self._active_file = None
+        self._active_map = None
+        self._write_offset = 0
+
+    def _roll(self):
+        next_seq = (self._active_seq or 0) + 1
+        self._close_active(sync=True)
+        segments = self._segments()
+        while len(segments) >= self.max_segments:
+            if self.overflow_policy == "drop_newest":
+                return False
+            oldest = segments.pop(0)
+            dropped = self._count_records(oldest, self._cursor[1] if oldest == self._cursor[0] else 0)
+            self._segment_path(oldest).unlink(missing_ok=True)
+            self._stats["dropped_segments"] += 1
+            self._stats["dropped_records"] += dropped
+            if self._cursor[0] <= oldest:
+                self._write_cursor((segments[0] if segments else next_seq, 0))
+            self._pending = sum(
+                self._count_records(seq, self._cursor[1] if seq == self._cursor[0] else 0) for seq in segments
+            )
+            _logger.error("IoT ingest spool %s full, dropped oldest segment with %s record(s)", self.directory, dropped)
+        self._open_segment(next_seq)
+        return True
+
+    # -- writing ----------------------------------------------------------------------
+
+    def append(self, record):
+        return self.append_many([record]) == 1
+
+    def append_many(self, records):
+        """Append JSON-serializable records in order; returns how many were stored."""
+        stored = 0
+        with self._lock:
+            for record in records:
+                payload = json.dumps(record, separators=(",", ":"), default=str).encode("utf-8")
+                needed = _HEADER.size + len(payload)
+                if needed + _HEADER.size > self.segment_bytes:
+                    _logger.error("IoT ingest spool record of %s bytes exceeds segment size, rejected", len(payload))
+                    self._stats["rejected"] += 1
+                    continue
+                if self._active_map is None:
+                    segments = self._segments()
+                    self._open_segment(segments[-1] if segments else 1, recover=bool(segments))
+                if self._write_offset + needed + _HEADER.size > self.segment_bytes and not self._roll():
+                    self._stats["rejected"] += 1
+                    continue
+                offset = self._write_offset
+                self._active_map[offset + _HEADER.size : offset + needed] = payload
+                _HEADER.pack_into(self._active_map, offset, len(payload), zlib.crc32(payload))
+                self._write_offset = offset + needed
+                self._pending += 1
+                self._stats["appended"] += 1
+                stored += 1
+            if stored:
+                self._maybe_sync()
+        return stored
+
+    def _maybe_sync(self, force=False):
+        if self.fsync_policy == "never" and not force:
+            return
+        now = time.monotonic()
+        if force or self.fsync_policy == "always" or now - self._last_sync >= self.fsync_interval:
+            self._active_map.flush()
+            self._last_sync = now
+            self._stats["fsyncs"] += 1
+
+    # -- replay -----------------------------------------------------------------------
+
+    def _read_cursor(self):
+        try:
+            data = json.loads((self.directory / "cursor.json").read_text())
+            return int(data["segment"]), int(data["offset"])
+        except (OSError, ValueError, KeyError, TypeError):
+            return (0, 0)
+
+    def _write_cursor(self, cursor):
+        tmp = self.directory / "cursor.json.tmp"
+        with open(tmp, "w") as fh:
+            json.dump({"segment": cursor[0], "offset": cursor[1]}, fh)
+            if self.fsync_policy != "never":
+                fh.flush()
+                os.fsync(fh.fileno())
+        os.replace(tmp, self.directory / "cursor.json")
+        self._cursor = cursor
+
+    def pending(self):
+        return self._pending
+
+    def replay(self, handler, batch_size=200, max_batches=None):
+        """Feed spooled records, oldest first, to ``handler`` in batches.
+
+        The cursor only advances after ``handler`` returns, so records are delivered
+        at least once. Exceptions from ``handler`` stop the replay and propagate.
+        """
+        replayed = 0
+        batches = 0
+        with self._replay_lock:
+            while self._pending and (max_batches is None or batches < max_batches):
+                with self._lock:
+                    segments = self._segments()
+                    if not segments:
+                        self._pending = 0
+                        break
+                    seq, offset = self._cursor
+                    if seq not in segments:
+                        seq, offset = segments[0], 0
+                # The writer's shared map and this read map see the same page cache.
+                buf = self._map_readonly(seq)
+                batch = []
+                next_offset = offset
+                try:
+                    if buf is not None:
+                        for _start, end, payload in self._scan(buf, offset):
+                            batch.append(json.loads(payload.decode("utf-8")))
+                            next_offset = end
+                            if len(batch) >= batch_size:
+                                break
+                finally:
+                    if buf is not None:
+                        buf.close()
+                if batch:
+                    try:
+                        handler(batch)
+                    except Exception:
+                        self._stats["replay_errors"] += 1
+                        raise
+                    with self._lock:
+                        self._write_cursor((seq, next_offset))
+                        self._pending = max(self._pending - len(batch), 0)
+                        self._stats["replayed"] += len(batch)
+                    replayed += len(batch)
+                    batches += 1
+                    continue
+                with self._lock:
+                    if seq == self._active_seq:
+                        # Caught up with the writer.
+                        break
+                    later = [s for s in self._segments() if s > seq]
+                    self._segment_path(seq).unlink(missing_ok=True)
+                    self._write_cursor((later[0], 0) if later else (seq + 1, 0))
+        return replayed
+
+    def disk_bytes(self):
+        return sum(self._segment_path(seq).stat().st_size for seq in self._segments() if self._segment_path(seq).exists())
+
+    def stats(self):
+        with self._lock:
+            out = dict(self._stats)
+            out.update(
+                {
+                    "pending": self._pending,
+                    "segments": len(self._segments()),
+                    "disk_bytes": self.disk_bytes(),
+                    "max_bytes": self.max_segments * self.segment_bytes,
+                    "fsync_policy": self.fsync_policy,
+                    "directory": str(self.directory),
+                }
+            )
+        return out
+
+
+class SpooledSink:
+    """Write batches to the database, falling back to an :class:`IngestSpool`.
+
+    A batch is spooled when the writer fails with a database availability error,
+    and once a write exceeds ``latency_budget_ms`` the sink stays in spool mode
+    until the replay thread has drained the backlog with fast writes again. While
+    anything is spooled new batches are spooled too, so replay keeps arrival order.
+    Spools left behind by dead processes in ``base_dir`` are adopted and replayed.
+    """
+
+    def __init__(self, name, base_dir, writer, latency_budget_ms=2000, replay_batch=200, retry_sec=2.0, **spool_options):
+        self.name = name
+        self.base_dir = Path(base_dir)
+        self.writer = writer
+        self.latency_budget = max(int(latency_budget_ms or 0), 0) / 1000.0
+        self.replay_batch = max(int(replay_batch or 1), 1)
+        self.retry_sec = retry_sec
+        self.spool_options = spool_options
+        self.spool = IngestSpool(self.base_dir / f"{socket.gethostname()}-{os.getpid()}", **spool_options)
+        self._degraded = False
+        self._wake = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._stats_lock = threading.Lock()
+        self._stats = {"direct_batches": 0, "spooled_batches": 0, "slow_batches": 0, "lost_records": 0}
+
+    def _bump(self, key, value=1):
+        with self._stats_lock:
+            self._stats[key] += value
+
+    def start(self):
+        if self._thread:
+            return
+        self.spool.open()
+        self._degraded = bool(self.spool.pending())
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run_replay, name=f"{self.name}-spool-replay", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5.0):
+        self._stop_event.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout)
+        self._thread = None
+        self.spool.close()
+
+    def _spool(self, records):
+        stored = self.spool.append_many(records)
+        if stored < len(records):
+            self._bump("lost_records", len(records) - stored)
+        self._bump("spooled_batches")
+        self._wake.set()
+
+    def submit(self, records):
+        """Persist ``records`` now or spool them; never raises for DB outages."""
+        records = list(records)
+        if not records:
+            return
+        if self._degraded or self.spool.pending():
+            self._spool(records)
+            return
+        started = time.monotonic()
+        try:
+            self.writer(records)
+        except Exception as exc:
+            if not is_db_unavailable_error(exc):
+                raise
+            _logger.warning("%s database unavailable, spooling %s record(s): %s", self.name, len(records), exc)
+            self._degraded = True
+            self._spool(records)
+            return
+        self._bump("direct_batches")
+        if self.latency_budget and time.monotonic() - started > self.latency_budget:
+            _logger.warning("%s write exceeded latency budget, spooling until the database catches up", self.name)
+            self._bump("slow_batches")
+            self._degraded = True
+            self._wake.set()
+
+    def _replay_handler(self, records):
+        try:
+            self.writer(records)
+        except Exception as exc:
+            if is_db_unavailable_error(exc):
+                raise
+            # A poison batch must not block the spool forever.
+            _logger.exception("%s dropped %s spooled record(s) that cannot be written", self.name, len(records))
+            self._bump("lost_records", len(records))
+
+    def _replay_one(self, spool):
+        started = time.monotonic()
+        replayed = spool.replay(self._replay_handler, batch_size=self.replay_batch, max_batches=1)
+        return replayed, time.monotonic() - started
+
+    def _adopt_orphans(self):
+        own = self.spool.directory.resolve()
+        for path in sorted(self.base_dir.glob("*")):
+            if not path.is_dir() or path.resolve() == own:
+                continue
+            orphan = IngestSpool(path, **self.spool_options)
+            if not orphan.open(blocking=False):
+                continue
+            try:
+                if orphan.pending():
+                    _logger.info("%s adopting %s spooled record(s) from %s", self.name, orphan.pending(), path)
+                while orphan.pending() and not self._stop_event.is_set():
+                    self._replay_one(orphan)
+                drained = not orphan.pending()
+            finally:
+                orphan.close()
+            if drained:
+                shutil.rmtree(path, ignore_errors=True)
+
+    def _run_replay(self):
+        while not self._stop_event.is_set():
+            self._wake.wait(self.retry_sec)
+            self._wake.clear()
+            try:
+                while self.spool.pending() and not self._stop_event.is_set():
+                    _replayed, elapsed = self._replay_one(self.spool)
+                    if self.latency_budget and elapsed > self.latency_budget:
+                        # Still slow: keep spooling, but keep draining.
+                        continue
+                if not self.spool.pending():
+                    self._degraded = False
+                self._adopt_orphans()
+            except Exception as exc:
+                if is_db_unavailable_error(exc):
+                    _logger.info("%s replay paused, database unavailable: %s", self.name, exc)
+                else:
+                    _logger.exception("%s replay failed", self.name)
+
+    def stats(self):
+        with self._stats_lock:
+            out = dict(self._stats)
+        out["degraded"] = self._degraded
+        out.update(self.spool.stats())
+        return out
@@ -0,0 +1,243 @@
+import contextlib
+import logging
+import os
+import socket
+import threading
+
+import psycopg2
+from odoo.sql_db import connection_info_for
+
+_logger = logging.getLogger(__name__)
+
+_electors = {}
+_electors_lock = threading.Lock()
+
+ROLE_MQTT_SUBSCRIBER = "mqtt_subscriber"
+ROLE_TH_TCP_LISTENER = "th_tcp_listener"
+
+
+class LeaseLost(Exception):
+    """The leadership a write was made under has been taken over."""
+
+
+def _lock_key_sql():
+    return "hashtext('iot_control_center.leader:' || %s)"
+
+
+class LeaderElector:
+    """Cluster-wide role ownership backed by session-level advisory locks.
+
+    The locks live on one dedicated connection per process and database, so they
+    are released by Postgres the moment the holding process (or its node) dies.
+    A heartbeat thread keeps the session alive, retries roles it does not hold and
+    bumps a fencing epoch in ``iot_leader_lease`` on every takeover. The server
+    side idle timeout ends a hung leader's session, so followers take over within
+    a few heartbeats. Leader-owned writers fence their transactions with
+    ``check_lease``.
+    """
+
+    def __init__(self, dbname, heartbeat_sec=2.0, session_timeout_sec=10):
+        self.dbname = dbname
+        self.heartbeat_sec = max(float(heartbeat_sec or 2.0), 0.5)
+        self.session_timeout_sec = max(int(session_timeout_sec or 10), int(self.heartbeat_sec * 3))
+        self.holder = f"{socket.gethostname()}:{os.getpid()}"
+        self._conn = None
+        self._roles = {}
+        self._held = {}
+        self._lock = threading.RLock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._pid = os.getpid()
+
+    # -- connection -----------------------------------------------------------------
+
+    def _connect(self):
+        _db, info = connection_info_for(self.dbname)
+        conn = psycopg2.connect(**info)
+        conn.autocommit = True
+        with conn.cursor() as cr:
+            cr.execute("SET application_name = %s", [f"iot_leader:{self.holder}"])
+            # Let the server notice a dead or hung leader quickly.
+            for setting, value in (
+                ("idle_session_timeout", f"{self.session_timeout_sec}s"),
+                # A lease row share-locked by a writer must not stall the heartbeat.
+                ("lock_timeout", "1s"),
+                ("tcp_keepalives_idle", "5"),
+                ("tcp_keepalives_interval", "2"),
+                ("tcp_keepalives_count", "3"),
+            ):
+                try:
+                    cr.execute(f"SET {setting} = %s", [value])
+                except psycopg2.Error:
+                    pass
+        return conn
+
+    def _drop_connection(self):
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except Exception:
+                pass
+        self._conn = None
+        lost = list(self._held)
+        self._held.clear()
+        for role in lost:
+            self._notify(role, acquired=False)
+
+    # -- roles ----------------------------------------------------------------------
+
+    def register(self, role, on_acquire=None, on_lost=None):
+        """Compete for ``role``; callbacks run on the heartbeat thread."""
+        with self._lock:
+            self._roles[role] = (on_acquire, on_lost)
+        self.start()
+        self.tick()
+
+    def is_leader(self, role):
+        return role in self._held
+
+    def fencing_token(self, role):
+        """Epoch of the current leadership, or None when the role is not held."""
+        return self._held.get(role)
+
+    def _notify(self, role, acquired):
+        on_acquire, on_lost = self._roles.get(role, (None, None))
+        callback = on_acquire if acquired else on_lost
+        if not callback:
+            return
+        try:
+            callback()
+        except Exception:
+            _logger.exception("IoT leader callback failed role=%s acquired=%s db=%s", role, acquired, self.dbname)
+
+    def _try_acquire(self, cr, role):
+        cr.execute(f"SELECT pg_try_advisory_lock({_lock_key_sql()})", [role])
+        if not cr.fetchone()[0]:
+            return None
+        try:
+            cr.execute(
+                """
+                INSERT INTO iot_leader_lease (role, epoch, holder, acquired_at, heartbeat_at)
+                VALUES (%s, 1, %s, now() AT TIME ZONE 'UTC', now() AT TIME ZONE 'UTC')
+                ON CONFLICT (role) DO UPDATE
+                SET epoch = iot_leader_lease.epoch + 1,
+                    holder = EXCLUDED.holder,
+                    acquired_at = EXCLUDED.acquired_at,
+                    heartbeat_at = EXCLUDED.heartbeat_at
+                RETURNING epoch
+                """,
+                [role, self.holder],
+            )
+        except psycopg2.errors.LockNotAvailable:
+            # A write of the former leader is still in flight; retry next tick.
+            cr.execute(f"SELECT pg_advisory_unlock({_lock_key_sql()})", [role])
+            return None
+        return cr.fetchone()[0]
+
+    def _heartbeat(self, cr, role, epoch):
+        try:
+            cr.execute(
+                """
+                UPDATE iot_leader_lease
+                SET heartbeat_at = now() AT TIME ZONE 'UTC'
+                WHERE role = %s AND epoch = %s
+                """,
+                [role, epoch],
+            )
+        except psycopg2.errors.LockNotAvailable:
+            # Our own writers hold the row; they only got it under our epoch.
+            return True
+        return cr.rowcount > 0
+
+    def tick(self):
+        with self._lock:
+            try:
+                if self._conn is None or self._conn.closed:
+                    self._drop_connection()
+                    self._conn = self._connect()
+                with self._conn.cursor() as cr:
+                    for role in list(self._roles):
+                        epoch = self._held.get(role)
+                        if epoch is not None:
+                            if not self._heartbeat(cr, role, epoch):
+                                # A newer epoch exists: we were fenced off.
+                                _logger.warning("IoT leader fenced role=%s epoch=%s db=%s", role, epoch, self.dbname)
+                                cr.execute(f"SELECT pg_advisory_unlock({_lock_key_sql()})", [role])
+                                self._held.pop(role, None)
+                                self._notify(role, acquired=False)
+                            continue
+                        epoch = self._try_acquire(cr, role)
+                        if epoch is not None:
+                            self._held[role] = epoch
+                            _logger.info("IoT leader acquired role=%s epoch=%s holder=%s db=%s", role, epoch, self.holder, self.dbname)
+                            self._notify(role, acquired=True)
+            except psycopg2.Error as exc:
+                _logger.warning("IoT leader heartbeat failed db=%s: %s", self.dbname, exc)
+                self._drop_connection()
+
+    def _run(self):
+        while not self._stop_event.wait(self.heartbeat_sec):
+            self.tick()
+
+    def start(self):
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._run, name=f"iot-leader-{self.dbname}", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        with self._lock:
+            self._drop_connection()
+
+
+def get_elector(dbname):
+    with _electors_lock:
+        elector = _electors.get(dbname)
+        if elector and elector._pid != os.getpid():
+            # Inherited from a preloading parent: its thread and connection are not ours.
+            elector = None
+        if not elector:
+            elector = LeaderElector(dbname)
+            _electors[dbname] = elector
+    return elector
+
+
+def check_lease(cr, role, epoch):
+    """Fence a leader-owned write: raise ``LeaseLost`` unless ``epoch`` still holds ``role``.
+
+    Call in the writing transaction before it writes. The share lock on the
+    lease row keeps a takeover from bumping the epoch until the transaction
+    ends, so a former leader resuming after a pause cannot commit anything.
+    """
+    if epoch is None:
+        raise LeaseLost(f"role {role} is not held")
+    cr.execute("SELECT 1 FROM iot_leader_lease WHERE role = %s AND epoch = %s FOR SHARE", [role, epoch])
+    if not cr.fetchone():
+        raise LeaseLost(f"role {role} epoch {epoch} was taken over")
+
+
+@contextlib.contextmanager
+def exclusive_job(env, name):
+    """Run a heavy job on at most one node; yields False when another node has it.
+
+    Uses a session lock on the job's own cursor so it survives intermediate
+    commits, and is released on exit or when the session dies. The lock lives
+    on the writing session itself, so unlike a leader role it cannot be lost
+    while that session can still commit, and needs no epoch check.
+    """
+    cr = env.cr
+    cr.execute(f"SELECT pg_try_advisory_lock({_lock_key_sql()})", [f"job:{name}"])
+    acquired = bool(cr.fetchone()[0])
+    try:
+        yield acquired
+    finally:
+        if acquired:
+            try:
+                cr.execute(f"SELECT pg_advisory_unlock({_lock_key_sql()})", [f"job:{name}"])
+            except psycopg2.Error:
+                # Aborted transaction: roll back first, the pooled session must not keep the lock.
+                cr.rollback()
+                cr.execute(f"SELECT pg_advisory_unlock({_lock_key_sql()})", [f"job:{name}"])
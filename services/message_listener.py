@@ -0,0 +1,214 @@
+import logging
+import os
+import select
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import psycopg2
+from odoo import SUPERUSER_ID, api
+from odoo.modules.registry import Registry
+from odoo.sql_db import connection_info_for
+
+from .leader_election import LeaseLost, get_elector
+
+_logger = logging.getLogger(__name__)
+
+_instances = {}
+_instances_lock = threading.Lock()
+
+CHANNEL = "iot_mqtt_message_new"
+ROLE_MQTT_PROCESSOR = "mqtt_processor"
+
+
+class MessageNotifyListener:
+    """Process queued MQTT rows as soon as their insert commits.
+
+    ``create_from_mqtt`` fires ``NOTIFY iot_mqtt_message_new`` for rows it leaves
+    in state ``new``. The elected processor LISTENs on a dedicated connection,
+    waits ``batch_window_ms`` to coalesce a burst and drains every shard in
+    parallel, one worker thread and cursor per shard. Shards are owned through
+    the same advisory locks as the cron sweep, so the two never overlap.
+    """
+
+    def __init__(self, dbname, config):
+        self.dbname = dbname
+        self.config = config
+        self._thread = None
+        self._stop_event = threading.Event()
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._stats = {"notifications": 0, "drains": 0, "processed": 0, "busy_shards": 0, "last_latency_ms": None}
+
+    # -- connection -----------------------------------------------------------------
+
+    def _connect(self):
+        _db, info = connection_info_for(self.dbname)
+        conn = psycopg2.connect(**info)
+        conn.autocommit = True
+        with conn.cursor() as cr:
+            cr.execute("SET application_name = %s", [f"iot_mqtt_listener:{os.getpid()}"])
+            cr.execute(f"LISTEN {CHANNEL}")
+        return conn
+
+    @staticmethod
+    def _close(conn):
+        if conn is not None:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    # -- loop -----------------------------------------------------------------------
+
+    @staticmethod
+    def _collect(conn, timeout):
+        if timeout and select.select([conn], [], [], timeout) == ([], [], []):
+            return 0
+        conn.poll()
+        count = len(conn.notifies)
+        conn.notifies.clear()
+        return count
+
+    def _drain_shard(self, shard):
+        lease = (ROLE_MQTT_PROCESSOR, get_elector(self.dbname).fencing_token(ROLE_MQTT_PROCESSOR))
+        try:
+            with Registry(self.dbname).cursor() as cr:
+                env = api.Environment(cr, SUPERUSER_ID, {})
+                return env["iot.mqtt.message"]._process_shard(
+                    shard,
+                    self.config["workers"],
+                    limit=self.config["batch_size"],
+                    time_budget_sec=self.config["time_budget_sec"],
+                    lease=lease,
+                )
+        except LeaseLost as exc:
+            # The rows stay queued for the new processor.
+            _logger.warning("IoT MQTT processor fenced off db=%s: %s", self.dbname, exc)
+            return "fenced", 0
+
+    def _drain(self, pool):
+        started = time.monotonic()
+        results = list(pool.map(self._drain_shard, range(self.config["workers"])))
+        with self._lock:
+            self._stats["drains"] += 1
+            self._stats["processed"] += sum(processed for _status, processed in results)
+            # A busy shard is being drained by the cron sweep or another node.
+            self._stats["busy_shards"] += sum(1 for status, _processed in results if status == "busy")
+            self._stats["last_latency_ms"] = round((time.monotonic() - started) * 1000, 1)
+
+    def _run(self, stop_event):
+        conn = None
+        backoff = 1.0
+        window = self.config["batch_window_ms"] / 1000.0
+        pool = ThreadPoolExecutor(max_workers=self.config["workers"], thread_name_prefix=f"iot-mqtt-shard-{self.dbname}")
+        while not stop_event.is_set():
+            try:
+                if conn is None or conn.closed:
+                    conn = self._connect()
+                    backoff = 1.0
+                    # Rows committed while nobody was listening.
+                    self._drain(pool)
+                received = self._collect(conn, self.config["idle_timeout_sec"])
+                if not received:
+                    continue
+                if window:
+                    # Let a burst land before opening a cursor.
+                    time.sleep(window)
+                    received += self._collect(conn, 0)
+                with self._lock:
+                    self._stats["notifications"] += received
+                self._drain(pool)
+            except Exception as exc:
+                _logger.warning("IoT MQTT listener error db=%s: %s; reconnecting in %.0fs", self.dbname, exc, backoff)
+                self._close(conn)
+                conn = None
+                stop_event.wait(backoff)
+                backoff = min(backoff * 2, 30.0)
+        self._close(conn)
+        pool.shutdown(wait=False)
+
+    def start(self):
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return True
+            # A fresh event per run: a stopped thread still blocked in select()
+            # exits on its own without delaying the leader heartbeat.
+            self._stop_event = threading.Event()
+            self._thread = threading.Thread(
+                target=self._run,
+                args=(self._stop_event,),
+                name=f"iot-mqtt-listener-{self.dbname}",
+                daemon=True,
+            )
+            self._thread.start()
+        _logger.info("IoT MQTT message listener started db=%s", self.dbname)
+        return True
+
+    def stop(self):
+        with self._lock:
+            self._stop_event.set()
+            self._thread = None
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+
+def _load_config(env):
+    icp = env["ir.config_parameter"].sudo()
+
+    def _int_param(key, default, minimum):
+        try:
+            return max(int(icp.get_param(f"iot_control_center.{key}", str(default)) or default), minimum)
+        except Exception:
+            return default
+
+    return {
+        "enabled": str(icp.get_param("iot_control_center.mqtt_notify_enabled", "True")).lower() in ("1", "true", "yes"),
+        "batch_size": _int_param("mqtt_notify_batch_size", 200, 1),
+        "batch_window_ms": _int_param("mqtt_notify_batch_window_ms", 20, 0),
+        "workers": min(_int_param("mqtt_process_workers", 4, 1), 64),
+        "time_budget_sec": _int_param("mqtt_process_time_budget_sec", 50, 1),
+        "idle_timeout_sec": 5,
+    }
+
+
+def notify_enabled(env):
+    return _load_config(env)["enabled"]
+
+
+def ensure_running(env):
+    dbname = env.cr.dbname
+    config = _load_config(env)
+    with _instances_lock:
+        current = _instances.get(dbname)
+        if current and current._pid != os.getpid():
+            _instances.pop(dbname, None)
+            current = None
+        if current and current.config != config:
+            current.stop()
+            _instances.pop(dbname, None)
+            current = None
+        if not config["enabled"]:
+            return None
+        if not current:
+            current = MessageNotifyListener(dbname, config)
+            _instances[dbname] = current
+
+    # One processor per cluster; leadership changes start/stop it.
+    get_elector(dbname).register(
+        ROLE_MQTT_PROCESSOR,
+        on_acquire=lambda: _with_instance(dbname, "start"),
+        on_lost=lambda: _with_instance(dbname, "stop"),
+    )
+    if get_elector(dbname).is_leader(ROLE_MQTT_PROCESSOR):
+        current.start()
+    return current
+
+
+def _with_instance(dbname, method):
+    with _instances_lock:
+        current = _instances.get(dbname)
+    if current:
+        getattr(current, method)()
@@ -1,21 +1,25 @@
 import logging
 import os
+import socket
 import threading
 import time
 import uuid
-from pathlib import Path
-
-import fcntl
 
 import paho.mqtt.client as mqtt
 import psycopg2
 from odoo import SUPERUSER_ID, api
 from odoo.modules.registry import Registry
 
+from .ingest_queue import OVERFLOW_POLICIES, BatchIngestQueue
+from .ingest_spool import SpooledSink, load_spool_config
+from .leader_election import ROLE_MQTT_SUBSCRIBER, check_lease, get_elector
+
 _logger = logging.getLogger(__name__)
 
 _instances = {}
 _instances_lock = threading.Lock()
+_publishers = {}
+_publishers_lock = threading.Lock()
 
 
 class MQTTService:
@@ -25,42 +29,48 @@ class MQTTService:
         self._client = None
         self._started = False
         self._lock = threading.Lock()
-        self._singleton_fd = None
-
-    def _singleton_lock_path(self):
-        safe_dbname = "".join(ch if ch.isalnum() or ch in ("_", "-") else "_" for ch in self.dbname)
-        return Path("/tmp") / f"iot_mqtt_subscriber_{safe_dbname}.lock"
-
-    def _acquire_singleton_lock(self):
-        if self._singleton_fd:
-            return True
-        lock_path = self._singleton_lock_path()
-        fd = os.open(str(lock_path), os.O_CREAT | os.O_RDWR, 0o644)
-        try:
-            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
-        except OSError:
-            os.close(fd)
-            return False
-        self._singleton_fd = fd
-        return True
-
-    def _release_singleton_lock(self):
-        if not self._singleton_fd:
-            return
-        try:
-            fcntl.flock(self._singleton_fd, fcntl.LOCK_UN)
-        except OSError:
-            pass
-        try:
-            os.close(self._singleton_fd)
-        except OSError:
-            pass
-        self._singleton_fd = None
+        # Threads do not survive a fork; a service inherited from a preloading parent is stale.
+        self._pid = os.getpid()
+        spool = config.get("spool") or {}
+        self._sink = None
+        if spool.get("enabled"):
+            # Batches the database cannot take now are spooled to disk and replayed in order.
+            self._sink = SpooledSink(
+                f"iot-mqtt-ingest-{dbname}",
+                spool["base_dir"],
+                self._write_batch,
+                latency_budget_ms=spool["latency_budget_ms"],
+                replay_batch=config.get("ingest_batch_size", 200),
+                max_bytes=spool["max_bytes"],
+                fsync_policy=spool["fsync_policy"],
+            )
+        self._ingest = BatchIngestQueue(
+            f"iot-mqtt-ingest-{dbname}",
+            self._sink.submit if self._sink else self._write_batch,
+            writers=config.get("ingest_writers", 1),
+            maxsize=config.get("ingest_queue_size", 10000),
+            batch_size=config.get("ingest_batch_size", 200),
+            batch_ms=config.get("ingest_batch_ms", 200),
+            overflow_policy=config.get("ingest_overflow_policy", "drop_oldest"),
+        )
+
+    @property
+    def shared(self):
+        return bool(self.config.get("shared_subscription"))
+
+    def _subscription_topics(self):
+        topic_root = self.config["topic_root"]
+        topics = [f"{topic_root}/+/status", f"{topic_root}/+/telemetry"]
+        if self.shared:
+            # The broker load-balances a shared group across every subscribed worker.
+            group = self.config.get("shared_group") or f"odoo-iot-{self.dbname}"
+            topics = [f"$share/{group}/{topic}" for topic in topics]
+        return topics
 
     def _make_client(self):
-        # Use process-unique client_id to avoid cross-worker broker kick-out
-        # loops when multiple Odoo workers ensure MQTT service concurrently.
-        client_id = f"odoo-iot-{self.dbname}-{os.getpid()}"
+        # Use a host and process unique client_id to avoid broker kick-out loops
+        # when several Odoo workers (or nodes) ensure the MQTT service concurrently.
+        client_id = f"odoo-iot-{self.dbname}-{socket.gethostname()}-{os.getpid()}"
         client = mqtt.Client(client_id=client_id, clean_session=True)
         # Backoff reconnect attempts to avoid hot reconnect loops under broker/network issues.
         client.reconnect_delay_set(min_delay=2, max_delay=30)
@@ -71,14 +81,16 @@ class MQTTService:
 
         def on_connect(c, userdata, flags, rc):
             if rc == 0:
-                topic_root = self.config["topic_root"]
-                c.subscribe(f"{topic_root}/+/status", qos=1)
-                c.subscribe(f"{topic_root}/+/telemetry", qos=1)
-                _logger.info("IoT MQTT connected and subscribed on %s", topic_root)
+                topics = self._subscription_topics()
+                for topic in topics:
+                    c.subscribe(topic, qos=1)
+                _logger.info("IoT MQTT connected and subscribed on %s", ", ".join(topics))
             else:
                 _logger.error("IoT MQTT connect failed rc=%s", rc)
 
         def on_message(c, userdata, msg):
+            # Runs on paho's network thread: only hand off to the ingest queue so
+            # keepalives are never blocked by database work.
             payload_text = msg.payload.decode("utf-8", errors="ignore")
             self._enqueue_message(msg.topic, payload_text)
 
@@ -93,39 +105,85 @@ class MQTTService:
         client.on_disconnect = on_disconnect
         return client
 
+    @staticmethod
+    def _topic_serial(topic):
+        parts = (topic or "").split("/")
+        return parts[-2] if len(parts) >= 3 else ""
+
     def _enqueue_message(self, topic, payload_text):
+        if not self._ingest.put((topic, payload_text, time.time()), key=self._topic_serial(topic)):
+            _logger.debug("IoT MQTT ingest queue full, dropped message topic=%s", topic)
+
+    def _write_batch(self, batch):
         registry = Registry(self.dbname)
         for attempt in range(3):
             try:
                 with registry.cursor() as cr:
+                    if not self.shared:
+                        check_lease(cr, ROLE_MQTT_SUBSCRIBER, get_elector(self.dbname).fencing_token(ROLE_MQTT_SUBSCRIBER))
                     env = api.Environment(cr, SUPERUSER_ID, {})
-                    msg = env["iot.mqtt.message"].create_from_mqtt(topic, payload_text)
-                    try:
-                        msg._process_one()
-                    except Exception as exc:
-                        _logger.exception("IoT MQTT message process failed topic=%s error=%s", topic, exc)
+                    # Rows are processed right below; no need to wake the listener.
+                    msg_model = env["iot.mqtt.message"].with_context(iot_mqtt_inline_processing=True)
+                    received = {}
+                    for topic, payload_text, received_ts in batch:
+                        try:
+                            with cr.savepoint():
+                                msg = msg_model.create_from_mqtt(topic, payload_text)
+                        except psycopg2.errors.SerializationFailure:
+                            raise
+                        except Exception as exc:
+                            _logger.exception("IoT MQTT message enqueue failed topic=%s error=%s", topic, exc)
+                            continue
+                        if msg:
+                            # Last-value telemetry is applied inside create_from_mqtt and
+                            # returns no queue row.
+                            received[msg.id] = received_ts
+                    if received:
+                        try:
+                            # One reduced device write per device for the whole batch. Keep
+                            # the queued rows when processing fails; the queue workers retry.
+                            with cr.savepoint():
+                                msg_model.browse(list(received))._process_messages(received_ts=received)
+                        except psycopg2.errors.SerializationFailure:
+                            raise
+                        except Exception as exc:
+                            _logger.exception("IoT MQTT batch process failed size=%s error=%s", len(received), exc)
+                            env["iot.mqtt.message"]._notify_new_message()
                     cr.commit()
                 return
             except psycopg2.errors.SerializationFailure:
                 if attempt >= 2:
-                    _logger.exception("IoT MQTT enqueue failed after retries (serialization failure), topic=%s", topic)
-                    return
+                    _logger.warning(
+                        "IoT MQTT batch write failed after retries (serialization failure), size=%s",
+                        len(batch),
+                    )
+                    # Let the spool keep the batch instead of losing it.
+                    raise
                 time.sleep(0.05 * (attempt + 1))
 
+    def ingest_stats(self):
+        stats = self._ingest.stats()
+        stats["mode"] = "shared" if self.shared else "singleton"
+        if self._sink:
+            stats["spool"] = self._sink.stats()
+        return stats
+
     def start(self):
         with self._lock:
             if self._started:
                 return True
-            if not self._acquire_singleton_lock():
-                # Another worker/process owns MQTT subscription loop for this DB.
+            if not self.shared and not get_elector(self.dbname).is_leader(ROLE_MQTT_SUBSCRIBER):
+                # Another worker or node is the elected subscriber for this DB.
                 return False
             host = self.config.get("host")
             port = self.config.get("port")
             keepalive = self.config.get("keepalive")
             if not host:
-                self._release_singleton_lock()
                 return False
 
+            if self._sink:
+                self._sink.start()
+            self._ingest.start()
             self._client = self._make_client()
             try:
                 self._client.connect(host, port=port, keepalive=keepalive)
@@ -136,7 +194,6 @@ class MQTTService:
                 _logger.error("IoT MQTT start failed for %s:%s (%s)", host, port, exc)
                 self._client = None
                 self._started = False
-                self._release_singleton_lock()
                 return False
 
     def publish(self, topic, payload):
@@ -161,7 +218,9 @@ class MQTTService:
                 self._client.disconnect()
             self._client = None
             self._started = False
-            self._release_singleton_lock()
+            self._ingest.stop(drain=True)
+            if self._sink:
+                self._sink.stop()
 
 
 
@@ -192,6 +251,20 @@ def _load_config(env):
     if password in (False, None, "False", "false"):
         password = ""
 
+    def _int_param(key, default, minimum=1):
+        try:
+            return max(int(icp.get_param(key, default) or default), minimum)
+        except (TypeError, ValueError):
+            return default
+
+    overflow_policy = icp.get_param("iot_control_center.mqtt_ingest_overflow_policy", "drop_oldest")
+    if overflow_policy not in OVERFLOW_POLICIES:
+        overflow_policy = "drop_oldest"
+    shared_subscription = str(icp.get_param("iot_control_center.mqtt_shared_subscription", "False")).lower() in ("1", "true", "yes")
+    shared_group = (icp.get_param("iot_control_center.mqtt_shared_group") or "").strip()
+    if shared_group in ("False", "false"):
+        shared_group = ""
+
     return {
         "host": host,
         "port": port,
@@ -199,6 +272,15 @@ def _load_config(env):
         "password": password,
         "topic_root": topic_root,
         "keepalive": keepalive,
+        "ingest_queue_size": _int_param("iot_control_center.mqtt_ingest_queue_size", 10000),
+        "ingest_batch_size": _int_param("iot_control_center.mqtt_ingest_batch_size", 200),
+        "ingest_batch_ms": _int_param("iot_control_center.mqtt_ingest_batch_ms", 200, minimum=0),
+        "ingest_writers": _int_param("iot_control_center.mqtt_ingest_writers", 1),
+        "ingest_overflow_policy": overflow_policy,
+        "publish_max_inflight": _int_param("iot_control_center.mqtt_publish_max_inflight", 100),
+        "shared_subscription": shared_subscription,
+        "shared_group": shared_group,
+        "spool": load_spool_config(icp, env.cr.dbname, "mqtt"),
     }
 
 
@@ -211,6 +293,9 @@ def ensure_running(env):
     key = (dbname, config["host"], config["port"], config["username"], config["password"], config["topic_root"])
     with _instances_lock:
         current = _instances.get(dbname)
+        if current and current._pid != os.getpid():
+            _instances.pop(dbname, None)
+            current = None
         if current and getattr(current, "config", {}) != config:
             current.stop()
             _instances.pop(dbname, None)
@@ -220,33 +305,179 @@ def ensure_running(env):
             current = MQTTService(dbname, config)
             _instances[dbname] = current
 
+    if not current.shared:
+        # Leadership changes start/stop the subscriber from the heartbeat thread.
+        get_elector(dbname).register(
+            ROLE_MQTT_SUBSCRIBER,
+            on_acquire=lambda: _with_instance(dbname, "start"),
+            on_lost=lambda: _with_instance(dbname, "stop"),
+        )
     current.start()
     return current
 
 
-def publish_once(env, topic, payload, retain=False):
-    config = _load_config(env)
-    host = config.get("host")
-    if not host:
-        return False
-    port = config.get("port") or 1883
-    keepalive = config.get("keepalive") or 60
-    client_id = f"odoo-iot-pub-{env.cr.dbname}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
-    client = mqtt.Client(client_id=client_id, clean_session=True)
-    if config.get("username"):
-        client.username_pw_set(config.get("username"), config.get("password") or None)
-    try:
-        client.connect(host, port=port, keepalive=keepalive)
-        client.loop_start()
-        info = client.publish(topic, payload=payload, qos=1, retain=retain)
-        info.wait_for_publish(timeout=2.0)
-        return info.rc == mqtt.MQTT_ERR_SUCCESS
-    except Exception as exc:
-        _logger.error("IoT MQTT publish_once failed topic=%s error=%s", topic, exc)
-        return False
-    finally:
+def _with_instance(dbname, method):
+    with _instances_lock:
+        current = _instances.get(dbname)
+    if current:
+        getattr(current, method)()
+
+
+def shared_subscription_enabled(env):
+    return bool(_load_config(env).get("shared_subscription"))
+
+
+def ingest_stats(env):
+    """Queue depth and drop/overflow counters of this process' MQTT ingest queue."""
+    with _instances_lock:
+        current = _instances.get(env.cr.dbname)
+    return current.ingest_stats() if current else {}
+
+
+class MQTTPublisher:
+    """Long-lived per-database publisher connection shared by all command paths.
+
+    QoS1 publishes are pipelined on one connection and acknowledged together, so a
+    group command costs one round of PUBACK waits instead of one connection per device.
+    """
+
+    def __init__(self, dbname, config):
+        self.dbname = dbname
+        self.config = config
+        self._client = None
+        self._connected = threading.Event()
+        self._lock = threading.Lock()
+
+    def _make_client(self):
+        client_id = f"odoo-iot-pub-{self.dbname}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        client = mqtt.Client(client_id=client_id, clean_session=True)
+        client.max_inflight_messages_set(max(int(self.config.get("publish_max_inflight") or 100), 1))
+        client.reconnect_delay_set(min_delay=1, max_delay=10)
+        if self.config.get("username"):
+            client.username_pw_set(self.config.get("username"), self.config.get("password") or None)
+
+        def on_connect(c, userdata, flags, rc):
+            if rc == 0:
+                self._connected.set()
+            else:
+                _logger.error("IoT MQTT publisher connect failed rc=%s", rc)
+
+        def on_disconnect(c, userdata, rc):
+            self._connected.clear()
+            if rc != 0:
+                _logger.warning("IoT MQTT publisher disconnected rc=%s", rc)
+
+        client.on_connect = on_connect
+        client.on_disconnect = on_disconnect
+        return client
+
+    def _close_client(self):
+        client = self._client
+        self._client = None
+        self._connected.clear()
+        if not client:
+            return
         try:
             client.loop_stop()
             client.disconnect()
         except Exception:
             pass
+
+    def _ensure_connected(self, timeout=3.0):
+        if self._client and self._connected.is_set():
+            return True
+        # A client that lost its session is discarded instead of resumed: paho would
+        # otherwise replay its queued publishes on reconnect and duplicate commands.
+        self._close_client()
+        host = self.config.get("host")
+        if not host:
+            return False
+        client = self._make_client()
+        try:
+            client.connect(host, port=self.config.get("port") or 1883, keepalive=self.config.get("keepalive") or 60)
+            client.loop_start()
+        except Exception as exc:
+            _logger.error("IoT MQTT publisher connect failed for %s (%s)", host, exc)
+            return False
+        self._client = client
+        if not self._connected.wait(timeout):
+            _logger.error("IoT MQTT publisher connect timed out for %s", host)
+            self._close_client()
+            return False
+        return True
+
+    def _publish_pipelined(self, messages, timeout):
+        infos = []
+        for topic, payload, retain in messages:
+            try:
+                infos.append(self._client.publish(topic, payload=payload, qos=1, retain=bool(retain)))
+            except Exception as exc:
+                _logger.warning("IoT MQTT publish failed topic=%s error=%s", topic, exc)
+                infos.append(None)
+        deadline = time.monotonic() + timeout
+        results = []
+        for info in infos:
+            if info is None or info.rc != mqtt.MQTT_ERR_SUCCESS:
+                results.append(False)
+                continue
+            try:
+                info.wait_for_publish(timeout=max(deadline - time.monotonic(), 0.01))
+            except Exception:
+                pass
+            results.append(info.is_published())
+        return results
+
+    def publish_many(self, messages, timeout=5.0):
+        """Publish ``(topic, payload, retain)`` tuples; returns one success flag per message."""
+        messages = list(messages)
+        if not messages:
+            return []
+        with self._lock:
+            if not self._ensure_connected():
+                return [False] * len(messages)
+            results = self._publish_pipelined(messages, timeout)
+            if all(results) or self._connected.is_set():
+                return results
+            # The connection dropped mid-batch: reconnect once and resend what failed.
+            retry_idx = [i for i, ok in enumerate(results) if not ok]
+            _logger.warning("IoT MQTT publisher lost connection, retrying %s message(s)", len(retry_idx))
+            if not self._ensure_connected():
+                return results
+            retried = self._publish_pipelined([messages[i] for i in retry_idx], timeout)
+            for i, ok in zip(retry_idx, retried):
+                results[i] = ok
+            return results
+
+    def stop(self):
+        with self._lock:
+            self._close_client()
+
+
+def get_publisher(env):
+    dbname = env.cr.dbname
+    config = _load_config(env)
+    with _publishers_lock:
+        current = _publishers.get(dbname)
+        if current and current.config != config:
+            current.stop()
+            current = None
+        if not current:
+            current = MQTTPublisher(dbname, config)
+            _publishers[dbname] = current
+    return current
+
+
+def publish_many(env, messages, timeout=5.0):
+    """Publish several ``(topic, payload, retain)`` messages on the shared connection."""
+    messages = list(messages)
+    if not _load_config(env).get("host"):
+        return [False] * len(messages)
+    try:
+        return get_publisher(env).publish_many(messages, timeout=timeout)
+    except Exception as exc:
+        _logger.error("IoT MQTT publish_many failed (%s)", exc)
+        return [False] * len(messages)
+
+
+def publish_once(env, topic, payload, retain=False):
+    return publish_many(env, [(topic, payload, retain)])[0]
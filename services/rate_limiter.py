@@ -0,0 +1,51 @@
+import threading
+import time
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+
+class TokenBucket:
+    """Thread-safe token bucket refilled at ``rate`` tokens per second up to ``burst``."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = max(float(rate or 1.0), 0.001)
+        self.burst = max(float(burst or self.rate), 1.0)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def take(self, wanted):
+        """Take up to ``wanted`` whole tokens without blocking; returns how many were granted."""
+        with self._lock:
+            self._refill()
+            granted = int(min(max(int(wanted), 0), self._tokens))
+            self._tokens -= granted
+            return granted
+
+    def give_back(self, count):
+        with self._lock:
+            self._tokens = min(self.burst, self._tokens + max(int(count), 0))
+
+    def wait_time(self, wanted=1):
+        """Seconds until ``wanted`` tokens are available."""
+        with self._lock:
+            self._refill()
+            missing = min(float(wanted), self.burst) - self._tokens
+            return max(missing / self.rate, 0.0)
+
+
+def get_bucket(dbname, name, rate, burst=None):
+    """Process-wide bucket per database and name; a changed rate replaces it."""
+    key = (dbname, name)
+    candidate = TokenBucket(rate, burst)
+    with _buckets_lock:
+        bucket = _buckets.get(key)
+        if bucket is None or (bucket.rate, bucket.burst) != (candidate.rate, candidate.burst):
+            bucket = _buckets[key] = candidate
+        return bucket
@@ -1,6 +1,7 @@
+import asyncio
 import json
 import logging
-import socketserver
+import socket
 import threading
 import time
 from datetime import datetime
@@ -8,6 +9,12 @@ from datetime import datetime
 from odoo import SUPERUSER_ID, api, fields
 from odoo.modules.registry import Registry
 
+from .frame_buffer import JSON_LINE, MIN_FRAME_BYTES, FrameBuffer, channel_struct
+from .ingest_queue import BatchIngestQueue
+from .ingest_spool import SpooledSink, load_spool_config
+from .leader_election import ROLE_TH_TCP_LISTENER, check_lease, get_elector
+from .th_resolve_cache import GatewayEntry, ResolveCache, ResolveInvalidationListener, SensorEntry
+
 try:
     from psycopg2.errors import SerializationFailure
 except Exception:  # pragma: no cover
@@ -19,29 +26,8 @@ _instances = {}
 _instances_lock = threading.Lock()
 
 MAX_INGEST_RETRIES = 3
-
-
-class _GatewayTCPHandler(socketserver.BaseRequestHandler):
-    def handle(self):
-        service = getattr(self.server, "service", None)
-        if not service:
-            return
-
-        buffer = bytearray()
-        source_ip = self.client_address[0] if self.client_address else None
-        source_port = self.client_address[1] if self.client_address else None
-        while True:
-            chunk = self.request.recv(4096)
-            if not chunk:
-                service.flush_unparsed_tail(buffer, source_ip=source_ip, source_port=source_port)
-                return
-            buffer.extend(chunk)
-            service.process_buffer(buffer, source_ip=source_ip, source_port=source_port)
-
-
-class _ThreadedTCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
-    allow_reuse_address = True
-    daemon_threads = True
+RETRYABLE_PGCODES = ("40001", "23505")
+READ_CHUNK_BYTES = 4096
 
 
 class TCPIngestService:
@@ -49,9 +35,17 @@ class TCPIngestService:
         self.dbname = dbname
         self.config = config
         self._server = None
+        self._loop = None
         self._thread = None
         self._started = False
         self._lock = threading.Lock()
+        self._sink = None
+        self._ingest = None
+        self._resolve_cache = None
+        self._resolve_listener = None
+        self._connections = 0
+        self._closed_idle = 0
+        self._closed_overflow = 0
 
     def _parse_reported_at(self, value):
         if not value:
@@ -64,126 +58,224 @@ class TCPIngestService:
     def _is_retryable_db_error(self, exc):
         if SerializationFailure and isinstance(exc, SerializationFailure):
             return True
-        pgcode = getattr(exc, "pgcode", None)
-        if pgcode == "40001":
+        # 23505: another writer created the same sensor first; the retry finds it.
+        if getattr(exc, "pgcode", None) in RETRYABLE_PGCODES:
             return True
         cause = getattr(exc, "__cause__", None)
-        cause_pgcode = getattr(cause, "pgcode", None)
-        return cause_pgcode == "40001"
-
-    def _ensure_gateway(self, env, serial):
+        return getattr(cause, "pgcode", None) in RETRYABLE_PGCODES
+
+    def _cached(self, section, keys):
+        if not self._resolve_cache:
+            return {}, list(keys)
+        return self._resolve_cache.get_many(section, keys)
+
+    def _remember(self, section, items, generation):
+        if self._resolve_cache and items:
+            self._resolve_cache.put_many(section, items, generation)
+
+    def _ensure_gateways(self, env, serials, generation=None):
+        """Map serials to ``GatewayEntry``; only cache misses are searched."""
+        gateways, missing = self._cached("gateway", serials)
+        if not missing:
+            return gateways
         gateway_model = env["iot.th.gateway"].sudo()
-        gateway = gateway_model.search([("serial", "=", serial)], limit=1)
-        if not gateway:
-            gateway = gateway_model.create(
-                {
-                    "name": serial,
-                    "serial": serial,
-                }
-            )
-        return gateway
-
-    def _ensure_sensor(self, env, gateway, node_id, probe_code):
-        sensor_model = env["iot.th.sensor"].sudo()
-        canonical_name = f"{node_id}-{str(probe_code or '').strip().lower()}"
-        sensor = sensor_model.search(
-            [("node_id", "=", node_id), ("probe_code", "=", probe_code)],
-            limit=1,
+        found = {}
+        for gateway in gateway_model.search([("serial", "in", missing)]):
+            found.setdefault(gateway.serial, GatewayEntry(gateway.id, gateway.tcp_token or False, gateway.statistics_window_hours))
+        # Rows created here are not cached: a rollback would leave a dangling id.
+        self._remember("gateway", found, generation)
+        gateways.update(found)
+        to_create = [serial for serial in missing if serial not in found]
+        if to_create:
+            for gateway in gateway_model.create([{"name": serial, "serial": serial} for serial in to_create]):
+                gateways[gateway.serial] = GatewayEntry(gateway.id, gateway.tcp_token or False, gateway.statistics_window_hours)
+        return gateways
+
+    @staticmethod
+    def _sensor_entry(sensor):
+        return SensorEntry(
+            sensor.id,
+            sensor.gateway_id.id,
+            sensor.name,
+            sensor._get_effective_threshold_values(),
+            sensor.keep_full_history,
         )
-        if not sensor:
-            sensor = sensor_model.create(
-                {
-                    "gateway_id": gateway.id,
-                    "node_id": node_id,
-                    "probe_code": probe_code,
-                    "name": canonical_name,
-                    "stats_window_hours": gateway.statistics_window_hours or 24,
-                }
-            )
-        else:
+
+    def _ensure_sensors(self, env, wanted, generation=None):
+        """Map ``(node_id, probe_code)`` keys to ``SensorEntry``, creating the missing sensors.
+
+        ``wanted`` maps each key to its ``(gateway_entry, canonical_name)``.
+        """
+        sensors, missing = self._cached("sensor", list(wanted))
+        # Archived channels still own their unique (node_id, probe_code).
+        sensor_model = env["iot.th.sensor"].sudo().with_context(active_test=False)
+        if missing:
+            node_ids = list({node_id for node_id, _probe_code in missing})
+            probe_codes = list({probe_code for _node_id, probe_code in missing})
+            found = {}
+            for sensor in sensor_model.search([("node_id", "in", node_ids), ("probe_code", "in", probe_codes)]):
+                key = (sensor.node_id, sensor.probe_code)
+                if key in wanted:
+                    found[key] = self._sensor_entry(sensor)
+            self._remember("sensor", found, generation)
+            sensors.update(found)
+
+        create_vals = []
+        for (node_id, probe_code), (gateway, canonical_name) in wanted.items():
+            entry = sensors.get((node_id, probe_code))
+            if not entry:
+                create_vals.append(
+                    {
+                        "gateway_id": gateway.id,
+                        "node_id": node_id,
+                        "probe_code": probe_code,
+                        "name": canonical_name,
+                        "stats_window_hours": gateway.statistics_window_hours or 24,
+                    }
+                )
+                continue
             vals = {}
-            if sensor.gateway_id != gateway:
+            if entry.gateway_id != gateway.id:
                 vals["gateway_id"] = gateway.id
-            if sensor.name != canonical_name:
+            if entry.name != canonical_name:
                 vals["name"] = canonical_name
             if vals:
-                sensor.write(vals)
-        return sensor
-
-    def _ingest_measurements(
-        self,
-        serial,
-        reported_at,
-        measurements,
-        token=None,
-        extra_gateway_vals=None,
-        node_id=None,
-    ):
+                # The write notifies the cache listener, which drops the stale entry.
+                sensor_model.browse(entry.id).write(vals)
+                sensors[(node_id, probe_code)] = entry._replace(gateway_id=gateway.id, name=canonical_name)
+        if create_vals:
+            for sensor in sensor_model.create(create_vals):
+                sensors[(sensor.node_id, sensor.probe_code)] = self._sensor_entry(sensor)
+        return sensors
+
+    def _ingest_records(self, env, records, generation=None):
+        """Write a batch of parsed frames: one lookup per model and one reading insert.
+
+        With a warm resolve cache the gateway and sensor lookups cost no query.
+        """
+        entries = [
+            (record["serial"], fields.Datetime.to_datetime(record["reported_at"]), record)
+            for record in records
+            if record.get("serial")
+        ]
+        if not entries:
+            return 0
+        gateways = self._ensure_gateways(env, list(dict.fromkeys(serial for serial, _at, _record in entries)), generation)
+
+        gateway_vals = {}
+        wanted = {}
+        samples = []
+        for serial, reported_at, record in entries:
+            gateway = gateways[serial]
+            token = record.get("token")
+            if gateway.tcp_token and token is not None and token != gateway.tcp_token:
+                _logger.warning("TH payload token mismatch for gateway %s", serial)
+                continue
+            vals = gateway_vals.setdefault(gateway.id, {})
+            vals.update(record.get("extra_gateway_vals") or {})
+            if not vals.get("last_seen") or reported_at > vals["last_seen"]:
+                vals["last_seen"] = reported_at
+
+            for m in record.get("measurements") or []:
+                probe_code = str(m.get("probe_code") or "").strip()
+                if not probe_code:
+                    continue
+                temperature = m.get("temperature")
+                humidity = m.get("humidity")
+                if temperature is None or humidity is None:
+                    continue
+                try:
+                    t_val = float(temperature)
+                    h_val = float(humidity)
+                except Exception:
+                    continue
+                # Drop invalid zero-pair samples (T=0 and H=0) from gateway glitches.
+                if abs(t_val) < 1e-9 and abs(h_val) < 1e-9:
+                    continue
+
+                sensor_node_id = (m.get("node_id") or record.get("node_id") or "").strip().upper()
+                if not sensor_node_id:
+                    sensor_node_id = "unknown"
+
+                # Sensors store node_id and probe_code upper-cased.
+                key = (sensor_node_id.upper(), probe_code.upper())
+                wanted[key] = (gateway, f"{sensor_node_id}-{probe_code.lower()}")
+                samples.append((key, gateway, t_val, h_val, m.get("battery_voltage"), reported_at))
+
+        gateway_model = env["iot.th.gateway"].sudo()
+        for gateway_id, vals in gateway_vals.items():
+            gateway_model.browse(gateway_id).write(vals)
+        if not samples:
+            return 0
+
+        sensors = self._ensure_sensors(env, wanted, generation)
+        reading_vals = []
+        readings = []
+        for key, gateway, t_val, h_val, battery_voltage, reported_at in samples:
+            sensor = sensors[key]
+            reading_vals.append(
+                {
+                    "sensor_id": sensor.id,
+                    "gateway_id": gateway.id,
+                    "reported_at": reported_at,
+                    "temperature": t_val,
+                    "humidity": h_val,
+                }
+            )
+            readings.append((sensor.id, t_val, h_val, reported_at, battery_voltage))
+        env["iot.th.reading"].sudo().create(reading_vals)
+        env["iot.th.sensor"].sudo()._apply_readings(
+            readings,
+            thresholds={entry.id: entry.thresholds for entry in sensors.values()},
+            alert_cache=self._resolve_cache,
+            generation=generation,
+        )
+        return len(reading_vals)
+
+    def _write_records(self, records):
+        """Write one micro-batch of parsed frames in a single transaction."""
         registry = Registry(self.dbname)
         for attempt in range(1, MAX_INGEST_RETRIES + 1):
+            # Taken before the transaction snapshot, see ResolveCache.
+            generation = self._resolve_cache.generation() if self._resolve_cache else None
             try:
                 with registry.cursor() as cr:
+                    if self._ingest:
+                        # Written for the elected listener, not inline for the middleware.
+                        check_lease(cr, ROLE_TH_TCP_LISTENER, get_elector(self.dbname).fencing_token(ROLE_TH_TCP_LISTENER))
                     env = api.Environment(cr, SUPERUSER_ID, {})
-                    reading_model = env["iot.th.reading"].sudo()
-
-                    gateway = self._ensure_gateway(env, serial)
-                    if extra_gateway_vals:
-                        gateway.sudo().write(extra_gateway_vals)
-
-                    if gateway.tcp_token and token is not None and token != gateway.tcp_token:
-                        _logger.warning("TH payload token mismatch for gateway %s", serial)
-                        cr.commit()
-                        return
-
-                    gateway.last_seen = reported_at
-
-                    for m in measurements:
-                        probe_code = m.get("probe_code")
-                        if not probe_code:
-                            continue
-                        temperature = m.get("temperature")
-                        humidity = m.get("humidity")
-                        battery_voltage = m.get("battery_voltage")
-                        if temperature is None or humidity is None:
-                            continue
-                        try:
-                            t_val = float(temperature)
-                            h_val = float(humidity)
-                        except Exception:
-                            continue
-                        # Drop invalid zero-pair samples (T=0 and H=0) from gateway glitches.
-                        if abs(t_val) < 1e-9 and abs(h_val) < 1e-9:
-                            continue
-
-                        sensor_node_id = (m.get("node_id") or node_id or "").strip().upper()
-                        if not sensor_node_id:
-                            sensor_node_id = "unknown"
-
-                        sensor = self._ensure_sensor(env, gateway, sensor_node_id, probe_code)
-                        reading_model.create(
-                            {
-                                "sensor_id": sensor.id,
-                                "gateway_id": gateway.id,
-                                "reported_at": reported_at,
-                                "temperature": t_val,
-                                "humidity": h_val,
-                            }
-                        )
-                        sensor.apply_reading(t_val, h_val, reported_at, battery_voltage=battery_voltage)
-
+                    self._ingest_records(env, records, generation)
                     cr.commit()
                     return
             except Exception as exc:
                 if not self._is_retryable_db_error(exc) or attempt >= MAX_INGEST_RETRIES:
                     raise
                 _logger.warning(
-                    "TH ingest serialization conflict for gateway %s, retry %s/%s",
-                    serial,
+                    "TH ingest conflict on a batch of %s frames, retry %s/%s",
+                    len(records),
                     attempt,
                     MAX_INGEST_RETRIES,
                 )
                 time.sleep(0.1 * attempt)
 
+    def _store_measurements(self, serial, reported_at, measurements, token=None, extra_gateway_vals=None, node_id=None):
+        # Records stay JSON-serialisable for the spool, which keeps the original
+        # reported_at so replayed readings land at receive time.
+        record = {
+            "serial": serial,
+            "reported_at": fields.Datetime.to_string(reported_at),
+            "measurements": measurements,
+            "token": token,
+            "extra_gateway_vals": extra_gateway_vals,
+            "node_id": node_id,
+        }
+        if not self._ingest:
+            # No listener running (middleware forwarding): write inline.
+            self._write_records([record])
+            return
+        if not self._ingest.put(record, key=serial):
+            _logger.debug("TH TCP ingest queue full, dropped frame from gateway %s", serial)
+
     def process_json_line(self, payload_text, source_ip=None, source_port=None):
         try:
             payload = json.loads(payload_text)
@@ -226,7 +318,7 @@ class TCPIngestService:
                 bv = None
             measurements.append({"probe_code": code, "node_id": node_id, "temperature": t, "humidity": h, "battery_voltage": bv})
 
-        self._ingest_measurements(serial, reported_at, measurements, token=token, node_id=node_id)
+        self._store_measurements(serial, reported_at, measurements, token=token, node_id=node_id)
 
     def process_binary_frame(self, frame, source_ip=None, source_port=None):
         node_id = f"{((frame[3] << 8) | frame[4]):04X}" if len(frame) >= 5 else None
@@ -235,7 +327,7 @@ class TCPIngestService:
         # BYTE0=0xFA BYTE1=0xCE BYTE2=control BYTE3-4=sender addr BYTE5=device info BYTE6=seq BYTE7=data count(16-bit words)
         # BYTE8.. data area, each word is 16-bit big-endian; 1 channel => temp(signed*10), humidity(unsigned)
         # Last byte checksum = sum(BYTE0..BYTE(n-1)) & 0xFF
-            if len(frame) < 9:
+            if len(frame) < MIN_FRAME_BYTES:
                 _logger.warning("TH binary frame too short from %s:%s", source_ip, source_port)
                 return
             if frame[0] != 0xFA or frame[1] != 0xCE:
@@ -252,12 +344,9 @@ class TCPIngestService:
                 _logger.warning("TH binary invalid data_count=%s from %s:%s", data_count, source_ip, source_port)
                 return
 
-            data_start = 8
-            data_end = len(frame) - 1
-            data = frame[data_start:data_end]
-
-            if len(data) != data_count * 2:
-                _logger.warning("TH binary length mismatch: data_count=%s bytes=%s", data_count, len(data))
+            data_len = len(frame) - MIN_FRAME_BYTES
+            if data_len != data_count * 2:
+                _logger.warning("TH binary length mismatch: data_count=%s bytes=%s", data_count, data_len)
                 return
 
             addr = (frame[3] << 8) | frame[4]
@@ -265,12 +354,13 @@ class TCPIngestService:
             voltage = frame[5] / 10.0
 
             measurements = []
-            # Multi-channel support: each channel uses two words: temp, humidity
+            # Multi-channel support: each channel uses two words: temp, humidity,
+            # all decoded by one unpack straight from the receive buffer.
             pair_count = data_count // 2
+            words = channel_struct(pair_count).unpack_from(frame, 8)
             for i in range(pair_count):
-                off = i * 4
-                temp_raw = int.from_bytes(data[off : off + 2], byteorder="big", signed=True)
-                hum_raw = int.from_bytes(data[off + 2 : off + 4], byteorder="big", signed=False)
+                temp_raw = words[2 * i]
+                hum_raw = words[2 * i + 1]
 
                 measurements.append(
                     {
@@ -285,7 +375,7 @@ class TCPIngestService:
             extra_gateway_vals = {"name": f"Gateway {serial}", "sampling_interval_min": 1}
             reported_at = fields.Datetime.now()
 
-            self._ingest_measurements(
+            self._store_measurements(
                 serial,
                 reported_at,
                 measurements,
@@ -298,39 +388,12 @@ class TCPIngestService:
 
     def process_buffer(self, buffer, source_ip=None, source_port=None):
         # Mixed protocol parser: legacy JSON lines + binary frames.
-        while buffer:
-            # JSON-line mode (legacy compatibility)
-            if buffer[0] in (ord("{"), ord("[")):
-                nl = buffer.find(b"\n")
-                if nl < 0:
-                    return
-                line = bytes(buffer[:nl]).decode("utf-8", errors="ignore").strip()
-                del buffer[: nl + 1]
+        for kind, frame in buffer.frames():
+            if kind == JSON_LINE:
+                line = str(frame, "utf-8", "ignore").strip()
                 if line:
                     self.process_json_line(line, source_ip=source_ip, source_port=source_port)
                 continue
-
-            # Binary frame mode.
-            idx = buffer.find(b"\xFA\xCE")
-            if idx < 0:
-                # Keep the last byte in case it is a partial frame header.
-                if len(buffer) > 1:
-                    del buffer[:-1]
-                return
-
-            if idx > 0:
-                del buffer[:idx]
-
-            if len(buffer) < 9:
-                return
-
-            data_count = buffer[7]
-            frame_len = 9 + data_count * 2
-            if len(buffer) < frame_len:
-                return
-
-            frame = bytes(buffer[:frame_len])
-            del buffer[:frame_len]
             self.process_binary_frame(frame, source_ip=source_ip, source_port=source_port)
 
     def flush_unparsed_tail(self, buffer, source_ip=None, source_port=None):
@@ -344,10 +407,75 @@ class TCPIngestService:
         )
         buffer.clear()
 
+    async def _handle_connection(self, reader, writer):
+        # One coroutine per gateway on the shared loop: parsing only, the
+        # database work is queued for the writer threads.
+        peer = writer.get_extra_info("peername") or (None, None)
+        source_ip, source_port = peer[0], peer[1]
+        idle_timeout = self.config.get("idle_timeout_sec") or 300
+        max_buffer = self.config.get("max_buffer_bytes") or 65536
+        buffer = FrameBuffer()
+        self._connections += 1
+        try:
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(reader.read(READ_CHUNK_BYTES), idle_timeout)
+                except asyncio.TimeoutError:
+                    self._closed_idle += 1
+                    _logger.info("TH TCP connection from %s:%s idle for %ss, closed", source_ip, source_port, idle_timeout)
+                    break
+                if not chunk:
+                    self.flush_unparsed_tail(buffer, source_ip=source_ip, source_port=source_port)
+                    break
+                buffer.feed(chunk)
+                self.process_buffer(buffer, source_ip=source_ip, source_port=source_port)
+                if len(buffer) > max_buffer:
+                    # An unterminated JSON line or garbage stream; drop the peer
+                    # rather than let it grow the buffer without bound.
+                    self._closed_overflow += 1
+                    _logger.warning(
+                        "TH TCP connection from %s:%s exceeded %s buffered bytes without a complete frame, closed",
+                        source_ip,
+                        source_port,
+                        max_buffer,
+                    )
+                    break
+        except (ConnectionError, OSError):
+            pass
+        except Exception:
+            _logger.exception("TH TCP connection handler failed for %s:%s", source_ip, source_port)
+        finally:
+            self._connections -= 1
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except Exception:
+                pass
+
+    def _run_loop(self, loop, sock):
+        asyncio.set_event_loop(loop)
+        try:
+            self._server = loop.run_until_complete(asyncio.start_server(self._handle_connection, sock=sock))
+            loop.run_forever()
+        except Exception:
+            _logger.exception("TH TCP event loop crashed")
+        finally:
+            if self._server:
+                self._server.close()
+            tasks = asyncio.all_tasks(loop)
+            for task in tasks:
+                task.cancel()
+            if tasks:
+                loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            loop.close()
+
     def start(self):
         with self._lock:
             if self._started:
                 return True
+            if not get_elector(self.dbname).is_leader(ROLE_TH_TCP_LISTENER):
+                # Only the elected node binds the listener; others take over on failover.
+                return False
 
             host = self.config.get("host")
             port = self.config.get("port")
@@ -355,15 +483,47 @@ class TCPIngestService:
                 return False
 
             try:
-                self._server = _ThreadedTCPServer((host, port), _GatewayTCPHandler)
+                # Bind here so a busy port is reported to the caller, not the loop thread.
+                sock = socket.create_server((host, port), backlog=1024)
             except OSError as exc:
                 _logger.warning("TH TCP service cannot bind %s:%s (%s)", host, port, exc)
                 self._server = None
                 self._thread = None
                 self._started = False
                 return False
-            self._server.service = self
-            self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+            spool = self.config.get("spool") or {}
+            if spool.get("enabled"):
+                self._sink = SpooledSink(
+                    f"iot-th-tcp-ingest-{self.dbname}",
+                    spool["base_dir"],
+                    self._write_records,
+                    latency_budget_ms=spool["latency_budget_ms"],
+                    replay_batch=self.config.get("ingest_batch_size", 500),
+                    max_bytes=spool["max_bytes"],
+                    fsync_policy=spool["fsync_policy"],
+                )
+                self._sink.start()
+            self._ingest = BatchIngestQueue(
+                f"iot-th-tcp-ingest-{self.dbname}",
+                self._sink.submit if self._sink else self._write_records,
+                writers=self.config.get("ingest_writers", 4),
+                maxsize=self.config.get("ingest_queue_size", 10000),
+                batch_size=self.config.get("ingest_batch_size", 500),
+                batch_ms=self.config.get("ingest_batch_ms", 200),
+            )
+            self._ingest.start()
+            # Frames resolve gateways and sensors from memory; ORM changes to them
+            # reach this process through NOTIFY.
+            self._resolve_cache = ResolveCache(self.config.get("resolve_cache_size", 50000))
+            self._resolve_listener = ResolveInvalidationListener(self.dbname, self._resolve_cache)
+            self._resolve_listener.start()
+            self._loop = asyncio.new_event_loop()
+            self._thread = threading.Thread(
+                target=self._run_loop,
+                args=(self._loop, sock),
+                name=f"iot-th-tcp-{self.dbname}",
+                daemon=True,
+            )
             self._thread.start()
             self._started = True
             _logger.info("TH TCP service started on %s:%s", host, port)
@@ -371,13 +531,45 @@ class TCPIngestService:
 
     def stop(self):
         with self._lock:
-            if self._server:
-                self._server.shutdown()
-                self._server.server_close()
+            if self._loop:
+                try:
+                    self._loop.call_soon_threadsafe(self._loop.stop)
+                except RuntimeError:
+                    # Loop already closed after a crash.
+                    pass
+            if self._thread:
+                self._thread.join(5.0)
+            if self._ingest:
+                # Drain parsed frames into the database (or the spool) before it stops.
+                self._ingest.stop(drain=True)
+            if self._sink:
+                self._sink.stop()
+            if self._resolve_listener:
+                self._resolve_listener.stop()
             self._server = None
+            self._loop = None
             self._thread = None
+            self._ingest = None
+            self._resolve_cache = None
+            self._resolve_listener = None
+            self._sink = None
             self._started = False
 
+    def ingest_stats(self):
+        stats = {}
+        if self._ingest:
+            stats["queue"] = self._ingest.stats()
+            stats["connections"] = {
+                "open": self._connections,
+                "closed_idle": self._closed_idle,
+                "closed_overflow": self._closed_overflow,
+            }
+        if self._resolve_cache:
+            stats["resolve_cache"] = self._resolve_cache.stats()
+        if self._sink:
+            stats["spool"] = self._sink.stats()
+        return stats
+
 
 def _load_config(env):
     icp = env["ir.config_parameter"].sudo()
@@ -393,9 +585,23 @@ def _load_config(env):
     if port <= 0:
         port = 9910
 
+    def _int_param(key, default, minimum=1):
+        try:
+            return max(int(icp.get_param(key, default) or default), minimum)
+        except (TypeError, ValueError):
+            return default
+
     return {
         "host": host,
         "port": port,
+        "idle_timeout_sec": _int_param("iot_control_center.th_tcp_idle_timeout_sec", 300),
+        "max_buffer_bytes": _int_param("iot_control_center.th_tcp_max_buffer_bytes", 65536, minimum=1024),
+        "ingest_queue_size": _int_param("iot_control_center.th_tcp_ingest_queue_size", 10000),
+        "ingest_writers": _int_param("iot_control_center.th_tcp_ingest_writers", 4),
+        "ingest_batch_size": _int_param("iot_control_center.th_tcp_ingest_batch_size", 500),
+        "ingest_batch_ms": _int_param("iot_control_center.th_tcp_ingest_batch_ms", 200, minimum=0),
+        "resolve_cache_size": _int_param("iot_control_center.th_tcp_resolve_cache_size", 50000),
+        "spool": load_spool_config(icp, env.cr.dbname, "th_tcp"),
     }
 
 
@@ -415,10 +621,22 @@ def ensure_running(env):
             current = TCPIngestService(dbname, config)
             _instances[dbname] = current
 
+    get_elector(dbname).register(
+        ROLE_TH_TCP_LISTENER,
+        on_acquire=lambda: _with_instance(dbname, "start"),
+        on_lost=lambda: _with_instance(dbname, "stop"),
+    )
     current.start()
     return current
 
 
+def _with_instance(dbname, method):
+    with _instances_lock:
+        current = _instances.get(dbname)
+    if current:
+        getattr(current, method)()
+
+
 def process_ingest_payload(env, payload_text=None, frame_bytes=None, source_ip=None, source_port=None):
     """Process one gateway payload without binding a TCP listener.
 
@@ -0,0 +1,142 @@
+from collections import namedtuple
+
+# metric -> (alert type below the low threshold, alert type above the high one)
+ALERT_METRICS = {
+    "temperature": ("temp_low", "temp_high"),
+    "humidity": ("hum_low", "hum_high"),
+}
+ALERT_TYPE_METRIC = {alert_type: metric for metric, types in ALERT_METRICS.items() for alert_type in types}
+
+AlertPolicy = namedtuple("AlertPolicy", "temperature_hysteresis humidity_hysteresis debounce_samples debounce_sec")
+
+
+class MetricAlertState:
+    """Open alert and debounce progress of one metric of one sensor.
+
+    An alert opens after ``debounce_samples`` consecutive samples beyond a
+    threshold spanning at least ``debounce_sec``. It closes the same way once
+    samples are back inside the threshold by the hysteresis band.
+    """
+
+    __slots__ = ("open_type", "open_ids", "pending_type", "pending_count", "pending_since", "clear_count", "clear_since")
+
+    def __init__(self, open_type=None, open_ids=()):
+        self.open_type = open_type
+        self.open_ids = list(open_ids)
+        self.pending_type = None
+        self.pending_count = 0
+        self.pending_since = None
+        self.clear_count = 0
+        self.clear_since = None
+
+    def copy(self):
+        other = MetricAlertState(self.open_type, self.open_ids)
+        other.pending_type = self.pending_type
+        other.pending_count = self.pending_count
+        other.pending_since = self.pending_since
+        other.clear_count = self.clear_count
+        other.clear_since = self.clear_since
+        return other
+
+    @staticmethod
+    def _debounced(count, since, at, policy):
+        if count < policy.debounce_samples:
+            return False
+        return not policy.debounce_sec or (at - since).total_seconds() >= policy.debounce_sec
+
+    def step(self, metric, value, low, high, band, policy, at):
+        """Advance by one sample; returns ``(closed_ids, opened)``.
+
+        ``closed_ids`` is None when nothing closed; an empty list means the
+        closed alert was opened earlier in the same batch and has no id yet.
+        ``opened`` is ``(alert_type, threshold, occurred_at)`` or None.
+        """
+        low_type, high_type = ALERT_METRICS[metric]
+        # A band wider than half the range would make clearing impossible.
+        band = max(min(band, (high - low) / 2.0), 0.0)
+        breach = high_type if value > high else low_type if value < low else None
+        closed_ids = None
+        opened = None
+
+        if self.open_type:
+            if self.open_type == high_type:
+                cleared = value <= high - band
+            else:
+                cleared = value >= low + band
+            if cleared:
+                if not self.clear_count:
+                    self.clear_since = at
+                self.clear_count += 1
+                if self._debounced(self.clear_count, self.clear_since, at, policy):
+                    closed_ids = self.open_ids
+                    self.open_type = None
+                    self.open_ids = []
+                    self.clear_count = 0
+                    self.clear_since = None
+            else:
+                self.clear_count = 0
+                self.clear_since = None
+
+        if breach and breach != self.open_type:
+            if self.pending_type != breach:
+                self.pending_type = breach
+                self.pending_count = 0
+                self.pending_since = at
+            self.pending_count += 1
+            if self._debounced(self.pending_count, self.pending_since, at, policy):
+                if self.open_type:
+                    # Swung straight across to the opposite threshold.
+                    closed_ids = self.open_ids
+                opened = (breach, high if breach == high_type else low, self.pending_since)
+                self.open_type = breach
+                self.open_ids = []
+                self.pending_type = None
+                self.pending_count = 0
+                self.pending_since = None
+                self.clear_count = 0
+                self.clear_since = None
+        else:
+            self.pending_type = None
+            self.pending_count = 0
+            self.pending_since = None
+        return closed_ids, opened
+
+
+class SensorAlertState:
+    """Alert state machines of one sensor, keyed by metric."""
+
+    __slots__ = ("metrics",)
+
+    def __init__(self, metrics=None):
+        self.metrics = metrics or {metric: MetricAlertState() for metric in ALERT_METRICS}
+
+    @classmethod
+    def from_open_alerts(cls, alerts):
+        """Rebuild from ``(alert_id, alert_type)`` of open alerts, oldest first."""
+        state = cls()
+        for alert_id, alert_type in alerts:
+            metric = state.metrics[ALERT_TYPE_METRIC[alert_type]]
+            # Legacy rows may hold both sides open; the newest side wins and
+            # closing it closes them all.
+            metric.open_type = alert_type
+            metric.open_ids.append(alert_id)
+        return state
+
+    def copy(self):
+        return SensorAlertState({metric: state.copy() for metric, state in self.metrics.items()})
+
+    def adopt_progress(self, previous):
+        """Carry the debounce progress of ``previous`` over to this rebuilt state.
+
+        Clearing progress only holds for the same open alert type and breach
+        progress only for a type that is not open now.
+        """
+        for metric, state in self.metrics.items():
+            old = previous.metrics[metric]
+            if old.open_type and old.open_type == state.open_type:
+                state.clear_count = old.clear_count
+                state.clear_since = old.clear_since
+            if old.pending_type and old.pending_type != state.open_type:
+                state.pending_type = old.pending_type
+                state.pending_count = old.pending_count
+                state.pending_since = old.pending_since
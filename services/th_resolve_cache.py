@@ -0,0 +1,197 @@
+import logging
+import os
+import select
+import threading
+from collections import OrderedDict, namedtuple
+
+import psycopg2
+from odoo.sql_db import connection_info_for
+
+_logger = logging.getLogger(__name__)
+
+CHANNEL = "iot_th_resolve_changed"
+# "alert_progress" keeps the debounce progress of the alert machines; it only
+# derives from readings, so alert notifications leave it alone.
+SECTIONS = ("gateway", "sensor", "alert", "alert_progress")
+
+# Fields the TCP ingest resolves frames with; changing any of them invalidates the cache.
+GATEWAY_CACHE_FIELDS = frozenset({"serial", "active", "tcp_token", "statistics_window_hours"})
+SENSOR_CACHE_FIELDS = frozenset(
+    {
+        "node_id",
+        "probe_code",
+        "active",
+        "gateway_id",
+        "name",
+        "group_id",
+        "keep_full_history",
+        "temperature_low",
+        "temperature_high",
+        "humidity_low",
+        "humidity_high",
+    }
+)
+SENSOR_GROUP_CACHE_FIELDS = frozenset({"active", "temperature_low", "temperature_high", "humidity_low", "humidity_high"})
+
+GatewayEntry = namedtuple("GatewayEntry", "id tcp_token statistics_window_hours")
+SensorEntry = namedtuple("SensorEntry", "id gateway_id name thresholds keep_full_history")
+
+
+def notify_changed(env, section):
+    """Tell every ingest process to drop its cached ``section`` once this transaction commits."""
+    env.cr.execute("SELECT pg_notify(%s, %s)", [CHANNEL, section])
+
+
+class ResolveCache:
+    """Thread-safe LRU of serial -> gateway, (node_id, probe_code) -> sensor and
+    sensor id -> alert state machines.
+
+    Readers take ``generation()`` before their transaction reads anything and
+    pass it to ``put_many``; values read across an invalidation are then never cached.
+    """
+
+    def __init__(self, maxsize=50000):
+        self.maxsize = max(int(maxsize or 1), 1)
+        self._sections = {section: OrderedDict() for section in SECTIONS}
+        self._generation = 0
+        # Only trusted while the invalidation listener is connected.
+        self._active = False
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    def generation(self):
+        with self._lock:
+            return self._generation
+
+    def is_active(self):
+        with self._lock:
+            return self._active
+
+    def get_many(self, section, keys):
+        """Return the cached entries of ``keys`` and the list of missing keys."""
+        entries = self._sections[section]
+        found = {}
+        missing = []
+        with self._lock:
+            if not self._active:
+                return found, list(keys)
+            for key in keys:
+                entry = entries.get(key)
+                if entry is None:
+                    missing.append(key)
+                    continue
+                entries.move_to_end(key)
+                found[key] = entry
+            self._stats["hits"] += len(found)
+            self._stats["misses"] += len(missing)
+        return found, missing
+
+    def put_many(self, section, items, generation):
+        """Cache ``items`` unless invalidated since ``generation``; None skips that check."""
+        entries = self._sections[section]
+        with self._lock:
+            if not self._active or generation not in (None, self._generation):
+                return
+            for key, entry in items.items():
+                entries[key] = entry
+                entries.move_to_end(key)
+            while len(entries) > self.maxsize:
+                entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def invalidate(self, section=None):
+        with self._lock:
+            for name, entries in self._sections.items():
+                if section in (None, name):
+                    entries.clear()
+            self._generation += 1
+            self._stats["invalidations"] += 1
+
+    def reset(self, active):
+        with self._lock:
+            for entries in self._sections.values():
+                entries.clear()
+            self._generation += 1
+            self._active = bool(active)
+
+    def stats(self):
+        with self._lock:
+            out = dict(self._stats)
+            out["active"] = self._active
+            out.update({section: len(entries) for section, entries in self._sections.items()})
+            out["capacity"] = self.maxsize
+        return out
+
+
+class ResolveInvalidationListener:
+    """LISTEN for ``notify_changed`` on a dedicated connection and invalidate ``cache``.
+
+    Notifications missed while disconnected are unknown, so the cache is off
+    until the listener is connected and starts empty on every (re)connect.
+    """
+
+    def __init__(self, dbname, cache, idle_timeout_sec=5):
+        self.dbname = dbname
+        self.cache = cache
+        self.idle_timeout_sec = idle_timeout_sec
+        self._thread = None
+        self._stop_event = threading.Event()
+
+    def _connect(self):
+        _db, info = connection_info_for(self.dbname)
+        conn = psycopg2.connect(**info)
+        conn.autocommit = True
+        with conn.cursor() as cr:
+            cr.execute("SET application_name = %s", [f"iot_th_resolve_listener:{os.getpid()}"])
+            cr.execute(f"LISTEN {CHANNEL}")
+        return conn
+
+    def _run(self, stop_event):
+        conn = None
+        backoff = 1.0
+        while not stop_event.is_set():
+            try:
+                if conn is None or conn.closed:
+                    conn = self._connect()
+                    backoff = 1.0
+                    self.cache.reset(active=True)
+                if select.select([conn], [], [], self.idle_timeout_sec) == ([], [], []):
+                    continue
+                conn.poll()
+                sections = {notify.payload for notify in conn.notifies}
+                conn.notifies.clear()
+                for section in sections:
+                    self.cache.invalidate(section if section in SECTIONS else None)
+            except Exception as exc:
+                _logger.warning("TH resolve cache listener error db=%s: %s; reconnecting in %.0fs", self.dbname, exc, backoff)
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+                conn = None
+                self.cache.reset(active=False)
+                stop_event.wait(backoff)
+                backoff = min(backoff * 2, 30.0)
+        self.cache.reset(active=False)
+        if conn is not None:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run,
+            args=(self._stop_event,),
+            name=f"iot-th-resolve-listener-{self.dbname}",
+            daemon=True,
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        self._thread = None
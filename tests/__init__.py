@@ -0,0 +1 @@
+from . import test_frame_buffer
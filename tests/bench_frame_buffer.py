@@ -0,0 +1,119 @@
+"""Throughput of the TH receive buffer against the parser it replaced.
+
+Standalone, no odoo needed::
+
+    python tests/bench_frame_buffer.py [--frames 20000] [--repeat 5]
+
+Both sides frame the stream and decode every binary frame the way
+``process_binary_frame`` does in their version (checksum, then the channel
+words), fed in gateway-sized chunks. Outputs are compared before timing.
+"""
+import argparse
+import importlib.util
+import time
+from pathlib import Path
+
+HERE = Path(__file__).resolve().parent
+
+
+def _load(name, path):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+frame_buffer = _load("frame_buffer", HERE.parent / "services" / "frame_buffer.py")
+frame_streams = _load("frame_streams", HERE / "frame_streams.py")
+
+
+def legacy_decode(frame):
+    if not frame_streams.checksum_ok(frame):
+        return None
+    data_count = frame[7]
+    data = frame[8:-1]
+    if data_count < 2 or len(data) != data_count * 2:
+        return None
+    out = []
+    for i in range(data_count // 2):
+        off = i * 4
+        out.append(
+            (
+                int.from_bytes(data[off : off + 2], byteorder="big", signed=True),
+                int.from_bytes(data[off + 2 : off + 4], byteorder="big", signed=False),
+            )
+        )
+    return out
+
+
+def buffer_decode(frame):
+    if not frame_streams.checksum_ok(frame):
+        return None
+    data_count = frame[7]
+    if data_count < 2 or len(frame) - frame_buffer.MIN_FRAME_BYTES != data_count * 2:
+        return None
+    pair_count = data_count // 2
+    words = frame_buffer.channel_struct(pair_count).unpack_from(frame, 8)
+    return [(words[2 * i], words[2 * i + 1]) for i in range(pair_count)]
+
+
+def run_legacy(stream, chunk):
+    buffer = bytearray()
+    out = []
+    for offset in range(0, len(stream), chunk):
+        buffer.extend(stream[offset : offset + chunk])
+        for kind, frame in frame_streams.legacy_frames(buffer):
+            if kind == frame_streams.JSON_LINE:
+                out.append(frame.decode("utf-8", errors="ignore").strip())
+            else:
+                out.append(legacy_decode(frame))
+    return out
+
+
+def run_buffer(stream, chunk):
+    buffer = frame_buffer.FrameBuffer()
+    out = []
+    for offset in range(0, len(stream), chunk):
+        buffer.feed(stream[offset : offset + chunk])
+        for kind, frame in buffer.frames():
+            if kind == frame_buffer.JSON_LINE:
+                out.append(str(frame, "utf-8", "ignore").strip())
+            else:
+                out.append(buffer_decode(frame))
+    return out
+
+
+def best_of(func, stream, chunk, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func(stream, chunk)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--frames", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--chunks", type=int, nargs="+", default=[4096, 65536])
+    args = parser.parse_args()
+
+    print(f"{'stream':<10} {'chunk':>6} {'MB':>6} {'legacy MB/s':>12} {'buffer MB/s':>12} {'speedup':>8}")
+    for name, build in frame_streams.STREAMS.items():
+        stream = build(count=args.frames)
+        megabytes = len(stream) / 1e6
+        for chunk in args.chunks:
+            if run_legacy(stream, chunk) != run_buffer(stream, chunk):
+                raise SystemExit(f"{name} stream, chunk {chunk}: parsers disagree")
+            legacy = best_of(run_legacy, stream, chunk, args.repeat)
+            current = best_of(run_buffer, stream, chunk, args.repeat)
+            print(
+                f"{name:<10} {chunk:>6} {megabytes:>6.2f} {megabytes / legacy:>12.1f} "
+                f"{megabytes / current:>12.1f} {legacy / current:>7.2f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""Reference parser and synthetic gateway streams for the TH frame buffer.
+
+Plain Python without odoo imports, so ``bench_frame_buffer.py`` can load it
+outside a server.
+"""
+import random
+import struct
+
+JSON_LINE = "json"
+BINARY_FRAME = "binary"
+
+
+def legacy_frames(buffer):
+    """The parser ``FrameBuffer`` replaced: pops complete frames off ``buffer`` in place.
+
+    Yields ``(kind, bytes)`` exactly like ``FrameBuffer.frames()`` yields its views.
+    """
+    while buffer:
+        if buffer[0] in (ord("{"), ord("[")):
+            nl = buffer.find(b"\n")
+            if nl < 0:
+                return
+            line = bytes(buffer[:nl])
+            del buffer[: nl + 1]
+            yield JSON_LINE, line
+            continue
+
+        idx = buffer.find(b"\xFA\xCE")
+        if idx < 0:
+            if len(buffer) > 1:
+                del buffer[:-1]
+            return
+        if idx > 0:
+            del buffer[:idx]
+        if len(buffer) < 9:
+            return
+        frame_len = 9 + buffer[7] * 2
+        if len(buffer) < frame_len:
+            return
+        frame = bytes(buffer[:frame_len])
+        del buffer[:frame_len]
+        yield BINARY_FRAME, frame
+
+
+def checksum_ok(frame):
+    """The checksum rule of ``process_binary_frame``."""
+    return len(frame) >= 9 and sum(frame[:-1]) & 0xFF == frame[-1]
+
+
+def binary_frame(rng, channels, node=None, bad_checksum=False):
+    words = b"".join(struct.pack(">hH", rng.randint(-400, 800), rng.randint(0, 100)) for _ in range(channels))
+    node = rng.randint(0, 0xFFFF) if node is None else node
+    body = bytes([0xFA, 0xCE, 0, node >> 8, node & 0xFF, 33, rng.randint(0, 255), channels * 2]) + words
+    checksum = sum(body) & 0xFF
+    if bad_checksum:
+        checksum ^= 0xFF
+    return body + bytes([checksum])
+
+
+def json_line(rng):
+    return b'{"gateway_serial":"G%d","probes":[{"probe_code":"a","temperature":%d,"humidity":%d}]}\n' % (
+        rng.randint(1, 50),
+        rng.randint(-40, 80),
+        rng.randint(0, 100),
+    )
+
+
+def garbage(rng, size=30):
+    # No header bytes and no JSON start, so garbage never parses as a frame by accident.
+    return bytes(rng.choice([b for b in range(256) if b not in (0xFA, 0xCE, ord("{"), ord("["))]) for _ in range(size))
+
+
+def clean_stream(count=20000, seed=1):
+    rng = random.Random(seed)
+    return b"".join(binary_frame(rng, rng.randint(1, 8)) for _ in range(count))
+
+
+def mixed_stream(count=20000, seed=2):
+    rng = random.Random(seed)
+    parts = []
+    for _ in range(count):
+        if rng.random() < 0.8:
+            parts.append(binary_frame(rng, rng.randint(1, 8)))
+        else:
+            parts.append(json_line(rng))
+    return b"".join(parts)
+
+
+def corrupted_stream(count=20000, seed=3):
+    rng = random.Random(seed)
+    parts = []
+    for _ in range(count):
+        roll = rng.random()
+        if roll < 0.7:
+            parts.append(binary_frame(rng, rng.randint(1, 8)))
+        elif roll < 0.8:
+            parts.append(json_line(rng))
+        elif roll < 0.9:
+            parts.append(binary_frame(rng, 4, bad_checksum=True))
+        else:
+            parts.append(garbage(rng, rng.randint(1, 60)))
+    return b"".join(parts)
+
+
+STREAMS = {
+    "clean": clean_stream,
+    "mixed": mixed_stream,
+    "corrupted": corrupted_stream,
+}
@@ -0,0 +1,74 @@
+import random
+
+from odoo.tests.common import BaseCase
+
+from ..services.frame_buffer import BINARY_FRAME, JSON_LINE, FrameBuffer
+from .frame_streams import STREAMS, binary_frame, checksum_ok, garbage, json_line, legacy_frames
+
+
+def buffer_frames(stream, chunk):
+    buffer = FrameBuffer(compact_bytes=1024)
+    out = []
+    for offset in range(0, len(stream), chunk):
+        buffer.feed(stream[offset : offset + chunk])
+        out.extend((kind, bytes(frame)) for kind, frame in buffer.frames())
+    return out, len(buffer)
+
+
+def reference_frames(stream, chunk):
+    buffer = bytearray()
+    out = []
+    for offset in range(0, len(stream), chunk):
+        buffer.extend(stream[offset : offset + chunk])
+        out.extend(legacy_frames(buffer))
+    return out, len(buffer)
+
+
+class TestFrameBuffer(BaseCase):
+    def assertSameAsLegacy(self, stream, chunks=(1, 7, 64, 4096)):
+        for chunk in chunks:
+            with self.subTest(chunk=chunk):
+                self.assertEqual(buffer_frames(stream, chunk), reference_frames(stream, chunk))
+
+    def test_streams_match_legacy_parser(self):
+        for name, build in STREAMS.items():
+            with self.subTest(stream=name):
+                self.assertSameAsLegacy(build(count=500))
+
+    def test_random_noise_matches_legacy_parser(self):
+        rng = random.Random(7)
+        noise = bytes(rng.randint(0, 255) for _ in range(20000))
+        self.assertSameAsLegacy(noise)
+
+    def test_resync_after_garbage(self):
+        rng = random.Random(11)
+        first = binary_frame(rng, 2)
+        second = binary_frame(rng, 3)
+        line = json_line(rng)
+        # Resync looks for the binary header only, so a JSON line must follow a
+        # complete frame, as it did for the legacy parser.
+        stream = garbage(rng, 25) + first + line + garbage(rng, 40) + second + garbage(rng, 3)
+        frames, left = buffer_frames(stream, 5)
+        self.assertEqual(frames, [(BINARY_FRAME, first), (JSON_LINE, line.rstrip(b"\n")), (BINARY_FRAME, second)])
+        # Only the last byte is kept back, it could start a header.
+        self.assertEqual(left, 1)
+        self.assertSameAsLegacy(stream)
+
+    def test_resync_after_bad_checksum(self):
+        rng = random.Random(13)
+        bad = binary_frame(rng, 4, bad_checksum=True)
+        good = binary_frame(rng, 1)
+        frames, _left = buffer_frames(bad + good + bad + bad + good, 3)
+        self.assertEqual([frame for _kind, frame in frames], [bad, good, bad, bad, good])
+        self.assertEqual([checksum_ok(frame) for _kind, frame in frames], [False, True, False, False, True])
+        self.assertSameAsLegacy(bad + good + bad + bad + good)
+
+    def test_partial_frame_waits_for_more_bytes(self):
+        rng = random.Random(17)
+        frame = binary_frame(rng, 2)
+        buffer = FrameBuffer()
+        buffer.feed(frame[:-1])
+        self.assertEqual(list(buffer.frames()), [])
+        buffer.feed(frame[-1:])
+        self.assertEqual([(kind, bytes(view)) for kind, view in buffer.frames()], [(BINARY_FRAME, frame)])
+        self.assertEqual(len(buffer), 0)
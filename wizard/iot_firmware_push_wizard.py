@@ -1,8 +1,10 @@
-import json
+import logging
 
 from odoo import _, fields, models
 from odoo.exceptions import UserError
 
+_logger = logging.getLogger(__name__)
+
 
 class IoTFirmwarePushWizard(models.TransientModel):
     _name = "iot.firmware.push.wizard"
@@ -32,60 +34,50 @@ class IoTFirmwarePushWizard(models.TransientModel):
             raise UserError(_("No matched devices for push."))
 
         firmware = self.firmware_id
-        ok_count = 0
         failed = []
+        entries = []
         for device in devices:
             try:
                 url = firmware.build_download_url(device)
-                payload = {
-                    "url": url,
-                    "version": firmware.version,
-                }
-                # Keep batch push robust: one failure should not abort all devices.
-                published = device._publish_command("upgrade", payload, raise_on_fail=False)
-                if not published:
-                    failed.append("%s: MQTT publish failed" % (device.switch_id_display or device.display_name))
-                    continue
-                now = fields.Datetime.now()
-                device.write(
-                    {
-                        "firmware_target_version": firmware.version,
-                        "firmware_upgrade_requested_at": now,
-                        "firmware_upgrade_state": "pending",
-                    }
-                )
-                self.env["iot.firmware.upgrade.log"].create(
-                    {
-                        "device_id": device.id,
-                        "firmware_id": firmware.id,
-                        "target_version": firmware.version or "",
-                        "state": "pending",
-                        "requested_at": now,
-                        "command_payload": json.dumps(payload, ensure_ascii=False),
-                    }
-                )
-                ok_count += 1
             except Exception as exc:
                 failed.append("%s: %s" % ((device.switch_id_display or device.display_name), str(exc)))
+                continue
+            entries.append((device, "upgrade", {"url": url, "version": firmware.version}, firmware))
 
-        if ok_count == 0:
+        if not entries:
             detail = "\n".join(failed[:5]) if failed else _("Unknown error")
             raise UserError(_("No upgrade command sent successfully.\n%s") % detail)
 
-        msg = _("Upgrade command sent to %s device(s).") % ok_count
-        if failed:
-            msg += "\n" + _("Failed: %s") % len(failed)
-            msg += "\n" + "\n".join(failed[:3])
-            if len(failed) > 3:
-                msg += "\n..."
-
+        # Commands are queued and published by the dispatcher; pending state and the
+        # upgrade log are written once the broker accepts each command.
+        job = self.env["iot.device"]._enqueue_commands(
+            entries,
+            job_name=_("Firmware %(version)s x %(count)s", version=firmware.version, count=len(entries)),
+        )
+        action = {
+            "type": "ir.actions.act_window",
+            "name": _("Firmware Push"),
+            "res_model": "iot.device.command.job",
+            "res_id": job.id,
+            "view_mode": "form",
+            "target": "new",
+        }
+        if not failed:
+            return action
+        _logger.warning("Firmware push skipped %s device(s): %s", len(failed), "; ".join(failed[:5]))
+        message = _("Upgrade command queued for %s device(s).") % len(entries)
+        message += "\n" + _("Failed: %s") % len(failed)
+        message += "\n" + "\n".join(failed[:3])
+        if len(failed) > 3:
+            message += "\n..."
         return {
             "type": "ir.actions.client",
             "tag": "display_notification",
             "params": {
                 "title": _("Firmware Push"),
-                "message": msg,
-                "sticky": bool(failed),
-                "type": "warning" if failed else "success",
+                "message": message,
+                "sticky": True,
+                "type": "warning",
+                "next": action,
             },
         }